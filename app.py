@@ -11,6 +11,11 @@ if GRADIO_TEMP_DIR is None:
     os.environ["GRADIO_TEMP_DIR"] = GRADIO_TEMP_DIR
 
 
+from kotaemon.loaders.pdf_loader import start_thumbnail_pool  # noqa
+
+# fork the thumbnail rendering workers, if any, before the app starts threads
+start_thumbnail_pool()
+
 from ktem.main import App  # noqa
 
 app = App()
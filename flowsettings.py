@@ -48,6 +48,10 @@ KH_MARKDOWN_OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 KH_CHUNKS_OUTPUT_DIR = KH_APP_DATA_DIR / "chunks_cache_dir"
 KH_CHUNKS_OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
+# content-addressed store of the images (e.g. page thumbnails) of the documents,
+# the document metadata only keeps a reference to them
+KH_BLOB_STORE_DIR = KH_USER_DATA_DIR / "blobs"
+
 # zip output directory
 KH_ZIP_OUTPUT_DIR = KH_APP_DATA_DIR / "zip_cache_dir"
 KH_ZIP_OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
@@ -98,10 +102,26 @@ KH_DOCSTORE = {
 KH_VECTORSTORE = {
     # "__type__": "kotaemon.storages.LanceDBVectorStore",
     "__type__": "kotaemon.storages.ChromaVectorStore",
+    # "__type__": "kotaemon.storages.FlatVectorStore",
+    # "__type__": "kotaemon.storages.IVFVectorStore",
     # "__type__": "kotaemon.storages.MilvusVectorStore",
     # "__type__": "kotaemon.storages.QdrantVectorStore",
     "path": str(KH_USER_DATA_DIR / "vectorstore"),
 }
+# cache embeddings on disk so that re-indexing doesn't embed the same text again
+KH_EMBEDDING_CACHE = {
+    "path": str(KH_USER_DATA_DIR / "embedding_cache.db"),
+    "max_entries": 1_000_000,
+}
+# cache query embeddings in memory, shared by the retrievers of all the indices
+KH_QUERY_EMBEDDING_CACHE = {"max_entries": 1024, "ttl": 3600}
+# cache retrieval results in memory until the index changes, None to disable
+KH_RETRIEVAL_CACHE = {"max_entries": 256, "ttl": 3600}
+# number of background jobs embedding the files indexed in quick index mode
+KH_INDEXING_JOB_WORKERS = config("KH_INDEXING_JOB_WORKERS", default=2, cast=int)
+# seconds between the heartbeats of a running job, a job that missed 3 heartbeats
+# is resumed by another process of the app
+KH_INDEXING_JOB_HEARTBEAT = config("KH_INDEXING_JOB_HEARTBEAT", default=30, cast=int)
 KH_LLMS = {}
 KH_EMBEDDINGS = {}
 KH_RERANKINGS = {}
@@ -5,15 +5,156 @@ This module provides programmatic access to batch indexing functionality.
 It can be imported and used in other Python scripts to index files programmatically.
 """
 
+import fnmatch
+import functools
+import hashlib
+import json
 import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from typing import List, Optional, Dict, Any
 
 from ktem.app import BaseApp
 from ktem.db.engine import engine
+from ktem.index.file.blob_refs import release_blobs
+from ktem.index.file.retrieval_cache import bump_index_version
 from ktem.utils.generator import Generator as GeneratorWrapper
-from sqlalchemy import select
+from kotaemon.storages import get_chunk_archive
+from sqlalchemy import delete, or_, select
 from sqlalchemy.orm import Session
+from theflow.settings import settings as flowsettings
+
+# Number of files streamed through the indexing pipeline at once. The indexed
+# documents of a batch are kept in memory until the whole batch is done.
+FILES_PER_BATCH = 64
+
+# Statuses of the files that don't need to be indexed again when resuming
+DONE_STATUSES = ("indexed", "skipped")
+
+# Number of files whose rows are deleted per statement, within the bound
+# parameter limit of SQLite
+DELETE_BATCH_SIZE = 500
+
+# Number of chunk ids per vector store or document store deletion
+STORE_DELETE_BATCH_SIZE = 1000
+
+
+def get_file_hash(file_path: Path) -> str:
+    """Get the sha256 hash of a file, reading it by blocks"""
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def glob_to_like(pattern: str) -> str:
+    """Convert a glob pattern to a SQL `LIKE` pattern, matching at least its names"""
+    like = pattern.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    like = re.sub(r"\[[^\]]*\]", "_", like)
+    return like.replace("*", "%").replace("?", "_")
+
+
+def get_file_chunk_archive():
+    """Get the archive of the indexed chunks, if `KH_CHUNKS_OUTPUT_DIR` is set"""
+    cache_dir = getattr(flowsettings, "KH_CHUNKS_OUTPUT_DIR", None)
+    return get_chunk_archive(cache_dir) if cache_dir else None
+
+
+class IndexingManifest:
+    """
+    Record of the files processed by a batch indexing run
+
+    The manifest is a JSON lines file, with one line per processed file holding
+    its path, size, mtime, hash and status. Lines are appended as the files
+    complete, so the manifest of an interrupted run lists all the files done
+    before the interruption, and the last line of a path wins.
+
+    Args:
+        path: Path to the manifest file, created if it doesn't exist
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.records: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+        if self.path.exists():
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # the last line may be cut by the interruption
+                        continue
+                    self.records[record["path"]] = record
+
+    def is_done(self, file_path: Path) -> bool:
+        """Check if the file was indexed and hasn't changed since"""
+        record = self.records.get(str(file_path.resolve()))
+        if not record or record.get("status") not in DONE_STATUSES:
+            return False
+
+        stat = file_path.stat()
+        return record["size"] == stat.st_size and record["mtime"] == stat.st_mtime
+
+    def get_hash(self, file_path: Path, stat: Optional[os.stat_result] = None) -> str:
+        """Get the hash of a file, from its record if it hasn't changed since"""
+        record = self.records.get(str(file_path.resolve()))
+        stat = stat or file_path.stat()
+        if (
+            record
+            and record.get("hash")
+            and record["size"] == stat.st_size
+            and record["mtime"] == stat.st_mtime
+        ):
+            return record["hash"]
+        return get_file_hash(file_path)
+
+    def add(self, file_path: Path, status: str, file_id: Optional[str] = None,
+            message: Optional[str] = None,
+            file_hash: Optional[str] = None) -> Dict[str, Any]:
+        """Record the status of a file, and return the record"""
+        stat = file_path.stat()
+        if file_hash is None and status in DONE_STATUSES:
+            file_hash = get_file_hash(file_path)
+        record = {
+            "path": str(file_path.resolve()),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "hash": file_hash,
+            "status": status,
+            "file_id": file_id,
+            "message": message,
+        }
+
+        with self._lock:
+            self.records[record["path"]] = record
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+
+        return record
+
+    def remove(self, file_path: Path):
+        """Forget a file, e.g. deleted from the folder, at the next `compact`"""
+        with self._lock:
+            self.records.pop(str(file_path.resolve()), None)
+
+    def compact(self):
+        """Rewrite the manifest with only the last record of each file"""
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.path.parent)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                for record in self.records.values():
+                    f.write(json.dumps(record) + "\n")
+            os.replace(tmp_path, self.path)
 
 
 class BatchIndexerModule:
@@ -68,19 +209,35 @@ class BatchIndexerModule:
         
         return sorted(files)
     
-    def index_single_file(self, file_path: Path, index_name: Optional[str] = None, 
-                         index_id: Optional[int] = None, reindex: bool = False, 
-                         user_id: str = "default") -> Dict[str, Any]:
-        index = self.get_index(index_name, index_id)
-        if not index:
-            if index_name:
-                raise ValueError(f"Index with name '{index_name}' not found")
-            elif index_id:
-                raise ValueError(f"Index with ID {index_id} not found")
-            else:
-                raise ValueError("No index specified")
-        
-        pipeline = index.get_indexing_pipeline({}, user_id)
+    def index_single_file(self, file_path: Path, index_name: Optional[str] = None,
+                          index_id: Optional[int] = None, reindex: bool = False,
+                          user_id: str = "default", pipeline=None) -> Dict[str, Any]:
+        """
+        Index a single file
+
+        Args:
+            file_path: Path to the file to index
+            index_name: Name of the index to use
+            index_id: ID of the index to use
+            reindex: Whether to reindex the file if it exists
+            user_id: User ID for the indexing operation
+            pipeline: The indexing pipeline to reuse, built from the index if not
+                given
+
+        Returns:
+            Dictionary with the indexing result
+        """
+        if pipeline is None:
+            index = self.get_index(index_name, index_id)
+            if not index:
+                if index_name:
+                    raise ValueError(f"Index with name '{index_name}' not found")
+                elif index_id:
+                    raise ValueError(f"Index with ID {index_id} not found")
+                else:
+                    raise ValueError("No index specified")
+
+            pipeline = index.get_indexing_pipeline({}, user_id)
         
         try:
             stream_gen = pipeline.stream(str(file_path), reindex=reindex)
@@ -137,20 +294,78 @@ class BatchIndexerModule:
                 "message": str(e)
             }
     
-    def index_folder(self, folder_path: Path, index_name: Optional[str] = None, 
-                    index_id: Optional[int] = None, reindex: bool = False, 
-                    user_id: str = "default", progress_callback: Optional[callable] = None) -> Dict[str, Any]:
+    def stream_files(self, pipeline, files: List[Path], reindex: bool = False):
+        """
+        Index the files with the pipeline, in batches of `FILES_PER_BATCH`
+
+        Yields:
+            Tuples of (file_path, status, file_id, message) as each file is done,
+            in the order of `files`
+        """
+        for batch_start in range(0, len(files), FILES_PER_BATCH):
+            batch = files[batch_start:batch_start + FILES_PER_BATCH]
+            n_done = 0
+
+            try:
+                # the pipeline reports each file on the "index" channel, in order
+                file_paths = [str(file_path) for file_path in batch]
+                for response in pipeline.stream(file_paths, reindex=reindex):
+                    if response is None or response.channel != "index":
+                        continue
+
+                    content = response.content
+                    file_path = batch[n_done]
+                    n_done += 1
+                    message = content.get("message", "")
+                    if content["status"] == "success":
+                        yield (file_path, "indexed", content.get("file_id"),
+                               "File indexed successfully")
+                    elif "already indexed" in message and not reindex:
+                        yield file_path, "skipped", None, message
+                    else:
+                        yield (file_path, "failed", None,
+                               f"Failed to index file: {message or 'Unknown error'}")
+            except Exception as e:
+                self.logger.exception(e)
+                for file_path in batch[n_done:]:
+                    yield file_path, "error", None, str(e)
+
+    def index_folder(self, folder_path: Path, index_name: Optional[str] = None,
+                     index_id: Optional[int] = None, reindex: bool = False,
+                     user_id: str = "default",
+                     progress_callback: Optional[callable] = None,
+                     max_workers: Optional[int] = None,
+                     manifest_path: Optional[Path] = None,
+                     event_callback: Optional[callable] = None,
+                     pipeline=None) -> Dict[str, Any]:
         """
         Index all files in the specified folder
-        
+
+        The files are streamed in batches through a single indexing pipeline,
+        which indexes up to `max_workers` files concurrently. If a manifest is
+        given, the status of each file is recorded in it as soon as the file is
+        done, and the files recorded as indexed or skipped, with the same size
+        and mtime, are not indexed again. Rerun with the same manifest to resume
+        an interrupted run, delete it to start over.
+
         Args:
             folder_path: Path to the folder containing files to index
             index_name: Name of the index to use
             index_id: ID of the index to use
             reindex: Whether to reindex existing files
             user_id: User ID for the indexing operation
-            progress_callback: Optional callback function for progress updates
-            
+            progress_callback: Optional callback function for progress updates,
+                called as `progress_callback(current, total, file_path)` when a
+                file is done
+            max_workers: Number of files to index concurrently, default to the
+                "indexing_workers" setting of the index
+            manifest_path: Optional path to the manifest file to resume from and
+                record to
+            event_callback: Optional callback function receiving the progress
+                events, as JSON-serializable dictionaries
+            pipeline: The indexing pipeline to use, built from the index if not
+                given
+
         Returns:
             Dictionary with indexing results
         """
@@ -177,45 +392,420 @@ class BatchIndexerModule:
         # Get files to index
         files = self.get_files_to_index(folder_path, supported_extensions)
         self.logger.info(f"Found {len(files)} files to index")
-        
-        # Index files
-        indexed_count = 0
-        skipped_count = 0
-        error_count = 0
-        results = []
-        
-        for i, file_path in enumerate(files, 1):
-            if progress_callback:
-                progress_callback(i, len(files), str(file_path))
-            
-            result = self.index_single_file(
-                file_path=file_path,
-                index_name=index_name,
-                index_id=index_id,
-                reindex=reindex,
-                user_id=user_id
+
+        # Skip the files done by a previous run
+        manifest = IndexingManifest(manifest_path) if manifest_path else None
+        if manifest:
+            pending = [
+                file_path for file_path in files if not manifest.is_done(file_path)
+            ]
+            self.logger.info(
+                f"Resuming: {len(files) - len(pending)} files already done"
             )
-            
-            result["file_path"] = str(file_path)
-            result["file_name"] = file_path.name
+        else:
+            pending = files
+
+        # Build the pipeline once for all the files
+        if pipeline is None:
+            pipeline = index.get_indexing_pipeline({}, user_id)
+        if max_workers:
+            pipeline.indexing_workers = max_workers
+
+        start_time = time.time()
+        counts = {
+            "indexed": 0,
+            "skipped": 0,
+            "errors": 0,
+            "resumed": len(files) - len(pending),
+        }
+        results = []
+
+        def emit(event: str, **kwargs):
+            if event_callback:
+                event_callback({
+                    "event": event,
+                    "time": time.time(),
+                    "elapsed": round(time.time() - start_time, 3),
+                    **kwargs,
+                })
+
+        def record(file_path: Path, status: str, file_id: Optional[str], message: str):
+            result = {
+                "success": status in DONE_STATUSES,
+                "file_id": file_id,
+                "status": status,
+                "message": message,
+                "file_path": str(file_path),
+                "file_name": file_path.name,
+            }
             results.append(result)
-            
-            if result["status"] == "indexed":
-                indexed_count += 1
-            elif result["status"] == "skipped":
-                skipped_count += 1
+
+            if status == "indexed":
+                counts["indexed"] += 1
+            elif status == "skipped":
+                counts["skipped"] += 1
             else:
-                error_count += 1
-        
+                counts["errors"] += 1
+
+            if manifest:
+                manifest.add(file_path, status, file_id, message)
+
+            current = counts["resumed"] + len(results)
+            if progress_callback:
+                progress_callback(current, len(files), str(file_path))
+            emit("file", current=current, total=len(files), **result)
+
+        emit("start", folder_path=str(folder_path), index_id=index.id,
+             total=len(files), pending=len(pending), resumed=counts["resumed"],
+             max_workers=int(pipeline.indexing_workers or 1))
+
+        for file_path, status, file_id, message in self.stream_files(
+            pipeline, pending, reindex
+        ):
+            record(file_path, status, file_id, message)
+
+        if manifest:
+            manifest.compact()
+
+        emit("done", total=len(files), **counts)
+
         return {
-            "success": error_count == 0,
-            "indexed": indexed_count,
-            "skipped": skipped_count,
-            "errors": error_count,
+            "success": counts["errors"] == 0,
+            "indexed": counts["indexed"],
+            "skipped": counts["skipped"],
+            "errors": counts["errors"],
+            "resumed": counts["resumed"],
             "total_files": len(files),
             "results": results
         }
     
+    def scan_folder(self, folder_path: Path,
+                    supported_extensions: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Take a snapshot of the supported files in the folder
+
+        The folder is walked with `os.scandir`, which reads the directories
+        without building a `Path` for every entry.
+
+        Args:
+            folder_path: Path to the folder to scan
+            supported_extensions: The file extensions to keep
+
+        Returns:
+            Dictionary of file name to the path, size and mtime of the file. The
+            index identifies files by name, so of several files with the same
+            name only the first in path order is kept
+        """
+        if not folder_path.exists():
+            raise FileNotFoundError(f"Folder {folder_path} does not exist")
+
+        if not folder_path.is_dir():
+            raise NotADirectoryError(f"{folder_path} is not a directory")
+
+        extensions = {ext.strip().lower() for ext in supported_extensions}
+        entries = []
+        folders = [str(folder_path)]
+        while folders:
+            with os.scandir(folders.pop()) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        folders.append(entry.path)
+                    elif (entry.is_file()
+                          and os.path.splitext(entry.name)[1].lower() in extensions):
+                        stat = entry.stat()
+                        entries.append((entry.path, entry.name,
+                                        stat.st_size, stat.st_mtime))
+
+        snapshot = {}
+        for path, name, size, mtime in sorted(entries):
+            if name in snapshot:
+                self.logger.warning(f"Ignoring {path}, a file named {name} "
+                                    "is already in the folder")
+                continue
+            snapshot[name] = {"path": Path(path), "size": size, "mtime": mtime}
+
+        return snapshot
+
+    def get_indexed_files(self, index,
+                          user_id: str = "default") -> Dict[str, Dict[str, Any]]:
+        """
+        Get the files of the index, in a single query
+
+        Returns:
+            Dictionary of file name to the id, hash and size of the indexed file
+        """
+        Source = index._resources["Source"]
+        query = select(Source.id, Source.name, Source.path, Source.size)
+        if index.config.get("private", False):
+            query = query.where(Source.user == user_id)
+
+        with Session(engine) as session:
+            return {
+                row.name: {"id": row.id, "hash": row.path, "size": row.size}
+                for row in session.execute(query)
+            }
+
+    def sync_folder(self, folder_path: Path, index_name: Optional[str] = None,
+                    index_id: Optional[int] = None, user_id: str = "default",
+                    delete_missing: bool = False, max_workers: Optional[int] = None,
+                    manifest_path: Optional[Path] = None, dry_run: bool = False,
+                    progress_callback: Optional[callable] = None,
+                    event_callback: Optional[callable] = None,
+                    pipeline=None) -> Dict[str, Any]:
+        """
+        Bring the index in sync with the folder
+
+        A snapshot of the folder is compared with the files of the index,
+        fetched in a single query. Files are matched by name: new files are
+        indexed, and files whose size or content hash changed are reindexed.
+        With a manifest, the hashes of the files that have the same size and
+        mtime as in the manifest are not computed again, so a sync of an
+        unchanged folder only lists it.
+
+        With `delete_missing`, the files indexed from this folder, as recorded
+        in the manifest, that are no longer in the folder are deleted from the
+        index. The other files of the index, e.g. uploaded in the UI or indexed
+        from another folder, are never deleted.
+
+        Args:
+            folder_path: Path to the folder to sync
+            index_name: Name of the index to use
+            index_id: ID of the index to use
+            user_id: User ID for the indexing operation
+            delete_missing: Whether to delete the files indexed from the folder
+                that are missing from it, needs `manifest_path`
+            max_workers: Number of files to hash and index concurrently, default
+                to the "indexing_workers" setting of the index
+            manifest_path: Optional path to the manifest file keeping the size,
+                mtime and hash of the files between syncs
+            dry_run: Only compute the changes, without applying them
+            progress_callback: Optional callback function for progress updates,
+                called as `progress_callback(current, total, file_path)` when a
+                change is applied
+            event_callback: Optional callback function receiving the progress
+                events, as JSON-serializable dictionaries
+            pipeline: The indexing pipeline to reuse, built from the index if not
+                given
+
+        Returns:
+            Dictionary with the sync results
+        """
+        if delete_missing and not manifest_path:
+            raise ValueError(
+                "delete_missing needs a manifest_path, to tell the files indexed "
+                "from the folder from the other files of the index"
+            )
+
+        index = self.get_index(index_name, index_id)
+        if not index:
+            if index_name:
+                raise ValueError(f"Index with name '{index_name}' not found")
+            elif index_id:
+                raise ValueError(f"Index with ID {index_id} not found")
+            else:
+                if not self.index_manager.indices:
+                    raise ValueError("No indices available")
+                index = self.index_manager.indices[0]
+                self.logger.info(f"Using default index: {index.name} (ID: {index.id})")
+
+        start_time = time.time()
+
+        def emit(event: str, **kwargs):
+            if event_callback:
+                event_callback({
+                    "event": event,
+                    "time": time.time(),
+                    "elapsed": round(time.time() - start_time, 3),
+                    **kwargs,
+                })
+
+        if pipeline is None:
+            pipeline = index.get_indexing_pipeline({}, user_id)
+        if max_workers:
+            pipeline.indexing_workers = max_workers
+        n_workers = int(pipeline.indexing_workers or 1)
+
+        snapshot = self.scan_folder(folder_path, self.get_supported_extensions(index))
+        indexed = self.get_indexed_files(index, user_id)
+        manifest = IndexingManifest(manifest_path) if manifest_path else None
+
+        added = [file["path"] for name, file in snapshot.items() if name not in indexed]
+
+        # only delete the files that were indexed from this folder
+        removed: List[tuple] = []
+        if delete_missing and manifest:
+            folder = folder_path.resolve()
+            for record in manifest.records.values():
+                file_path = Path(record["path"])
+                name = file_path.name
+                if (
+                    name not in snapshot
+                    and name in indexed
+                    and indexed[name]["id"] == record.get("file_id")
+                    and file_path.is_relative_to(folder)
+                ):
+                    removed.append((file_path, indexed[name]["id"]))
+
+        # only the content of the files with the same size needs to be compared
+        candidates = [
+            name for name, file in snapshot.items()
+            if name in indexed and file["size"] == indexed[name]["size"]
+        ]
+        modified = [
+            file["path"] for name, file in snapshot.items()
+            if name in indexed and file["size"] != indexed[name]["size"]
+        ]
+
+        def get_hash(name: str) -> str:
+            if manifest:
+                return manifest.get_hash(snapshot[name]["path"])
+            return get_file_hash(snapshot[name]["path"])
+
+        n_unchanged = 0
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            for name, file_hash in zip(candidates, executor.map(get_hash, candidates)):
+                file_path = snapshot[name]["path"]
+                if file_hash != indexed[name]["hash"]:
+                    modified.append(file_path)
+                    continue
+
+                n_unchanged += 1
+                if manifest and not manifest.is_done(file_path):
+                    manifest.add(file_path, "indexed", indexed[name]["id"],
+                                 "File unchanged", file_hash=file_hash)
+
+        self.logger.info(
+            f"Sync {folder_path}: {len(added)} added, {len(modified)} modified, "
+            f"{len(removed)} removed, {n_unchanged} unchanged"
+        )
+        emit("start", folder_path=str(folder_path), index_id=index.id,
+             added=len(added), modified=len(modified), removed=len(removed),
+             unchanged=n_unchanged, dry_run=dry_run)
+
+        counts = {"added": 0, "modified": 0, "deleted": 0,
+                  "unchanged": n_unchanged, "errors": 0}
+        results = []
+        total = len(added) + len(modified) + len(removed)
+
+        def record(action: str, file_path: Path, status: str,
+                   file_id: Optional[str], message: str):
+            result = {
+                "success": status in DONE_STATUSES or status == "deleted",
+                "action": action,
+                "file_id": file_id,
+                "status": status,
+                "message": message,
+                "file_path": str(file_path),
+                "file_name": file_path.name,
+            }
+            results.append(result)
+
+            if status == "indexed" or status == "deleted":
+                counts[action] += 1
+            elif status != "skipped":
+                counts["errors"] += 1
+
+            if manifest and action != "deleted":
+                manifest.add(file_path, status, file_id, message)
+
+            if progress_callback:
+                progress_callback(len(results), total, str(file_path))
+            emit("file", current=len(results), total=total, **result)
+
+        if not dry_run:
+            for file_path, file_id in removed:
+                try:
+                    pipeline.route(file_path).delete_file(file_id)
+                    record("deleted", file_path, "deleted", file_id,
+                           "File deleted from index")
+                    manifest.remove(file_path)
+                except Exception as e:
+                    self.logger.exception(e)
+                    record("deleted", file_path, "error", file_id, str(e))
+
+            actions = {file_path: "added" for file_path in added}
+            actions.update({file_path: "modified" for file_path in modified})
+            for file_path, status, file_id, message in self.stream_files(
+                pipeline, added + modified, reindex=True
+            ):
+                record(actions[file_path], file_path, status, file_id, message)
+
+        if manifest:
+            manifest.compact()
+
+        emit("done", **counts)
+
+        return {
+            "success": counts["errors"] == 0,
+            **counts,
+            "total_files": len(snapshot),
+            "planned": {
+                "added": [str(file_path) for file_path in added],
+                "modified": [str(file_path) for file_path in modified],
+                "removed": [str(file_path) for file_path, _ in removed],
+            },
+            "results": results
+        }
+
+    def watch_folder(self, folder_path: Path, interval: float = 60,
+                     stop_event: Optional[threading.Event] = None,
+                     max_syncs: Optional[int] = None, index_name: Optional[str] = None,
+                     index_id: Optional[int] = None, user_id: str = "default",
+                     **kwargs) -> Optional[Dict[str, Any]]:
+        """
+        Keep the index in sync with the folder, by polling it
+
+        The folder is synced with `sync_folder` every `interval` seconds, until
+        `stop_event` is set or `max_syncs` syncs are done. A failed sync is
+        logged and retried at the next interval.
+
+        Args:
+            folder_path: Path to the folder to watch
+            interval: Number of seconds between the end of a sync and the next
+            stop_event: Optional event to set, e.g. from another thread, to stop
+                watching
+            max_syncs: Optional maximum number of syncs
+            index_name: Name of the index to use
+            index_id: ID of the index to use
+            user_id: User ID for the indexing operation
+            **kwargs: The other arguments of `sync_folder`
+
+        Returns:
+            The results of the last successful sync
+        """
+        index = self.get_index(index_name, index_id)
+        if not index:
+            if index_name:
+                raise ValueError(f"Index with name '{index_name}' not found")
+            elif index_id:
+                raise ValueError(f"Index with ID {index_id} not found")
+            else:
+                if not self.index_manager.indices:
+                    raise ValueError("No indices available")
+                index = self.index_manager.indices[0]
+
+        stop_event = stop_event or threading.Event()
+        pipeline = (kwargs.pop("pipeline", None)
+                    or index.get_indexing_pipeline({}, user_id))
+        result = None
+        n_syncs = 0
+
+        while not stop_event.is_set():
+            try:
+                result = self.sync_folder(
+                    folder_path, index_id=index.id, user_id=user_id,
+                    pipeline=pipeline, **kwargs
+                )
+            except Exception as e:
+                self.logger.exception(f"Error syncing {folder_path}: {e}")
+
+            n_syncs += 1
+            if max_syncs and n_syncs >= max_syncs:
+                break
+            stop_event.wait(interval)
+
+        return result
+
     def get_files_for_user(self, user_id: str, index_name: Optional[str] = None, index_id: Optional[int] = None) -> list[dict]:
         """
         Retrieve files uploaded by a specific user.
@@ -264,22 +854,23 @@ class BatchIndexerModule:
             return []
 
         return files
-    
-    
-    def delete_file_from_index(self, file_path: Path, index_name: Optional[str] = None, 
-                              index_id: Optional[int] = None, user_id: str = "default") -> Dict[str, Any]:
+
+    def get_indexing_jobs(self, index_name: Optional[str] = None,
+                          index_id: Optional[int] = None,
+                          status: Optional[str] = None) -> List[Dict[str, Any]]:
         """
-        Delete a file from the index
-        
+        Get the background embedding jobs of an index, most recent first
+
         Args:
-            file_path: Path to the file to delete
             index_name: Name of the index to use
             index_id: ID of the index to use
-            user_id: User ID for the operation
-            
+            status: Only return the jobs with this status (pending, running,
+                completed or failed)
+
         Returns:
-            Dictionary with deletion result
+            List of dictionaries with the job status and progress
         """
+        from ktem.index.file.jobs import list_jobs
 
         index = self.get_index(index_name, index_id)
         if not index:
@@ -289,72 +880,208 @@ class BatchIndexerModule:
                 raise ValueError(f"Index with ID {index_id} not found")
             else:
                 raise ValueError("No index specified")
-        
-        try:
-            with Session(engine) as session:
-                Source = index._resources["Source"]
-                # Try to filter by user_id if the column exists
-                if hasattr(Source, "user") and user_id:
-                    query = select(Source).where(Source.user == user_id)
-                else:
-                    # If user_id is not tracked, return all files (or empty)
-                    query = select(Source)
 
-                sources = session.execute(query).all()
+        source_table = index._resources["Source"].__tablename__
+        return list_jobs(source_table=source_table, status=status)
 
-                source = None
+    def resolve_files(self, index, names: Optional[List[str]] = None,
+                      file_ids: Optional[List[str]] = None,
+                      patterns: Optional[List[str]] = None,
+                      user_id: str = "default") -> Dict[str, str]:
+        """
+        Find the files of the index by name, id or glob pattern, in a single query
 
-                for s in sources:
-                    if s[0].name == file_path.name:
-                        source = s[0]
-                        break
-                
-                if not source:
-                    return {
-                        "success": False,
-                        "message": "File not found in index"
-                    }
-                
-                file_id = source.id
-                file_name = source.name
-                
-                # Delete the source record
-                session.delete(source)
-                
-                # Find and delete related index records
-                vs_ids, ds_ids = [], []
-                index_records = session.execute(
-                    select(index._resources["Index"]).where(
-                        index._resources["Index"].source_id == file_id
+        The names are looked up through the unique index on the file name. The
+        glob patterns are turned into `LIKE` filters, then checked with
+        `fnmatch` since `LIKE` has no character classes.
+
+        Args:
+            index: The index to search
+            names: File names to find
+            file_ids: File ids to find
+            patterns: Glob patterns on the file names, e.g. "2023-*.pdf"
+            user_id: Only find the files of this user
+
+        Returns:
+            Dictionary of file id to file name of the found files
+        """
+        Source = index._resources["Source"]
+        conditions = []
+        if names:
+            conditions.append(Source.name.in_(names))
+        if file_ids:
+            conditions.append(Source.id.in_(file_ids))
+        for pattern in patterns or []:
+            conditions.append(Source.name.like(glob_to_like(pattern), escape="\\"))
+        if not conditions:
+            return {}
+
+        query = select(Source.id, Source.name).where(or_(*conditions))
+        if user_id:
+            query = query.where(Source.user == user_id)
+
+        exact_names, exact_ids = set(names or []), set(file_ids or [])
+        with Session(engine) as session:
+            return {
+                row.id: row.name
+                for row in session.execute(query)
+                if row.name in exact_names
+                or row.id in exact_ids
+                or any(fnmatch.fnmatchcase(row.name, pattern)
+                       for pattern in patterns or [])
+            }
+
+    def delete_files(self, names: Optional[List[str]] = None,
+                     file_ids: Optional[List[str]] = None,
+                     patterns: Optional[List[str]] = None,
+                     index_name: Optional[str] = None, index_id: Optional[int] = None,
+                     user_id: str = "default", max_workers: int = 4,
+                     dry_run: bool = False) -> Dict[str, Any]:
+        """
+        Delete many files from the index at once
+
+        The files are resolved with a single query, then their rows are removed
+        with one `DELETE ... WHERE ... IN (...)` per table and batch of
+        `DELETE_BATCH_SIZE` files, in a single transaction. The chunks are then
+        deleted from the vector store and the document store in batches, run
+        concurrently.
+
+        Args:
+            names: Names of the files to delete
+            file_ids: Ids of the files to delete
+            patterns: Glob patterns on the names of the files to delete
+            index_name: Name of the index to use
+            index_id: ID of the index to use
+            user_id: User ID for the operation
+            max_workers: Number of store deletions run concurrently
+            dry_run: Only find the files, without deleting them
+
+        Returns:
+            Dictionary with the deletion result
+        """
+        index = self.get_index(index_name, index_id)
+        if not index:
+            if index_name:
+                raise ValueError(f"Index with name '{index_name}' not found")
+            elif index_id:
+                raise ValueError(f"Index with ID {index_id} not found")
+            else:
+                raise ValueError("No index specified")
+
+        try:
+            files = self.resolve_files(index, names, file_ids, patterns, user_id)
+            if dry_run or not files:
+                return {
+                    "success": True,
+                    "deleted": 0 if dry_run else len(files),
+                    "files": files,
+                    "message": f"{len(files)} files found in index",
+                }
+
+            Source, Index = index._resources["Source"], index._resources["Index"]
+            ids = list(files)
+            vs_ids, ds_ids = [], []
+            with Session(engine) as session:
+                for batch_start in range(0, len(ids), DELETE_BATCH_SIZE):
+                    batch = ids[batch_start:batch_start + DELETE_BATCH_SIZE]
+                    relations = session.execute(
+                        select(Index.target_id, Index.relation_type).where(
+                            Index.source_id.in_(batch)
+                        )
                     )
-                ).all()
-                
-                for each in index_records:
-                    if each[0].relation_type == "vector":
-                        vs_ids.append(each[0].target_id)
-                    elif each[0].relation_type == "document":
-                        ds_ids.append(each[0].target_id)
-                    session.delete(each[0])
-                
+                    for target_id, relation_type in relations:
+                        if relation_type == "vector":
+                            vs_ids.append(target_id)
+                        elif relation_type == "document":
+                            ds_ids.append(target_id)
+
+                    session.execute(delete(Index).where(Index.source_id.in_(batch)))
+                    session.execute(delete(Source).where(Source.id.in_(batch)))
                 session.commit()
-            
-            # Delete from vector store and document store
-            if vs_ids:
-                index._vs.delete(vs_ids)
-            index._docstore.delete(ds_ids)
-            
-            self.logger.info(f"File {file_name} has been deleted from index")
-            
+            bump_index_version(Source.__tablename__)
+
+            # the rows are gone, so a failed store deletion only leaves orphan chunks
+            store_deletions = [
+                (store.delete,
+                 target_ids[batch_start:batch_start + STORE_DELETE_BATCH_SIZE])
+                for store, target_ids in ((index._vs, vs_ids),
+                                          (index._docstore, ds_ids))
+                for batch_start in range(0, len(target_ids), STORE_DELETE_BATCH_SIZE)
+            ]
+            archive = get_file_chunk_archive()
+            if archive:
+                store_deletions.extend((archive.delete, file_id) for file_id in ids)
+            store_deletions.append(
+                (functools.partial(release_blobs, Source.__tablename__), ids)
+            )
+
+            errors = []
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = [executor.submit(func, arg) for func, arg in store_deletions]
+                for future in as_completed(futures):
+                    try:
+                        future.result()
+                    except Exception as e:
+                        self.logger.exception(e)
+                        errors.append(str(e))
+
+            self.logger.info(
+                f"{len(ids)} files deleted from index, with {len(vs_ids)} vectors "
+                f"and {len(ds_ids)} documents"
+            )
+
             return {
-                "success": True,
-                "file_id": file_id,
-                "file_name": file_name,
-                "message": f"File {file_name} deleted from index successfully"
+                "success": not errors,
+                "deleted": len(ids),
+                "files": files,
+                "message": (
+                    f"{len(ids)} files deleted from index successfully" if not errors
+                    else f"{len(ids)} files deleted from index, with store errors: "
+                    + "; ".join(errors)
+                ),
             }
-            
+
         except Exception as e:
-            self.logger.error(f"Error deleting file {file_path}: {str(e)}")
+            self.logger.error(f"Error deleting files: {str(e)}")
             return {
                 "success": False,
-                "message": f"Error deleting file: {str(e)}"
-            }
\ No newline at end of file
+                "deleted": 0,
+                "files": {},
+                "message": f"Error deleting files: {str(e)}"
+            }
+
+    def delete_file_from_index(self, file_path: Path,
+                               index_name: Optional[str] = None,
+                               index_id: Optional[int] = None,
+                               user_id: str = "default") -> Dict[str, Any]:
+        """
+        Delete a file from the index
+        
+        Args:
+            file_path: Path to the file to delete
+            index_name: Name of the index to use
+            index_id: ID of the index to use
+            user_id: User ID for the operation
+            
+        Returns:
+            Dictionary with deletion result
+        """
+        result = self.delete_files(names=[file_path.name], index_name=index_name,
+                                   index_id=index_id, user_id=user_id)
+        if not result["success"]:
+            self.logger.error(f"Error deleting file {file_path}: {result['message']}")
+            return {"success": False, "message": result["message"]}
+
+        if not result["files"]:
+            return {
+                "success": False,
+                "message": "File not found in index"
+            }
+
+        file_id, file_name = next(iter(result["files"].items()))
+        return {
+            "success": True,
+            "file_id": file_id,
+            "file_name": file_name,
+            "message": f"File {file_name} deleted from index successfully"
+        }
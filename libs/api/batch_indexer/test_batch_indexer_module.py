@@ -0,0 +1,421 @@
+import json
+import os
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import batch_indexer_module
+import pytest
+from batch_indexer_module import BatchIndexerModule, IndexingManifest, get_file_hash
+from ktem.index.file import blob_refs
+from ktem.index.file import index as file_index_module
+from ktem.index.file import retrieval_cache
+from ktem.index.file.index import FileIndex
+from sqlalchemy import delete, event, select
+from sqlalchemy.orm import Session
+from sqlmodel import SQLModel, create_engine
+
+from kotaemon.base import Document
+
+
+class StubPipeline:
+    """Report the files as indexed in order, failing the files named "bad*"
+
+    Args:
+        stop_after: the number of files after which the stream is interrupted
+    """
+
+    indexing_workers = 2
+
+    def __init__(self, stop_after=None):
+        self.stop_after = stop_after
+        self.streamed = []
+
+    def stream(self, file_paths, reindex=False):
+        for file_path in file_paths:
+            if self.stop_after is not None and len(self.streamed) >= self.stop_after:
+                raise RuntimeError("indexing interrupted")
+            self.streamed.append(file_path)
+
+            # the progress messages are not reported as file results
+            yield Document(f" => Indexing {file_path}", channel="debug")
+            if "bad" in file_path:
+                content = {"status": "failed", "message": "cannot read the file"}
+            else:
+                content = {"status": "success", "file_id": f"id-{file_path}"}
+            yield Document(content={"file_path": file_path, **content}, channel="index")
+
+
+class SyncStubPipeline(StubPipeline):
+    """Also record the files deleted from the index"""
+
+    def __init__(self, stop_after=None):
+        super().__init__(stop_after)
+        self.deleted = []
+
+    def route(self, file_path):
+        return self
+
+    def delete_file(self, file_id):
+        self.deleted.append(file_id)
+
+
+@pytest.fixture(scope="function")
+def sql_engine(tmp_path, monkeypatch):
+    """A fresh database, instead of the one of the app"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'sql.db'}")
+    SQLModel.metadata.create_all(engine)
+    for module in (batch_indexer_module, blob_refs, retrieval_cache):
+        monkeypatch.setattr(module, "engine", engine)
+    return engine
+
+
+@pytest.fixture(scope="function")
+def file_index(sql_engine, monkeypatch):
+    """A file index with its tables in the temporary database and mocked stores"""
+    monkeypatch.setattr(file_index_module, "get_vectorstore", lambda name: MagicMock())
+    monkeypatch.setattr(file_index_module, "get_docstore", lambda name: MagicMock())
+    monkeypatch.setattr(batch_indexer_module, "get_file_chunk_archive", lambda: None)
+
+    index = FileIndex(
+        app=None, id=1, name="test", config={"supported_file_types": ".txt"}
+    )
+    index._setup_resources()
+    index._resources["Source"].metadata.create_all(sql_engine)
+    return index
+
+
+def add_files(sql_engine, index, files):
+    """Add the files, as tuples of (id, name, user, hash, size), to the index"""
+    Source = index._resources["Source"]
+    with Session(sql_engine) as session:
+        session.add_all(
+            Source(id=file_id, name=name, user=user, path=file_hash, size=size)
+            for file_id, name, user, file_hash, size in files
+        )
+        session.commit()
+
+
+def add_chunks(sql_engine, index, file_id, n_chunks):
+    """Add the document and vector relations of the chunks of a file"""
+    Index = index._resources["Index"]
+    with Session(sql_engine) as session:
+        session.add_all(
+            Index(source_id=file_id, target_id=f"{file_id}-{idx}", relation_type=kind)
+            for idx in range(n_chunks)
+            for kind in ("document", "vector")
+        )
+        session.commit()
+
+
+def make_indexer(index=None):
+    index = index or SimpleNamespace(
+        id=1, name="test", config={"supported_file_types": ".txt"}
+    )
+    return BatchIndexerModule(
+        app=SimpleNamespace(index_manager=SimpleNamespace(indices=[index]))
+    )
+
+
+def make_folder(tmp_path, names):
+    folder = tmp_path / "docs"
+    folder.mkdir()
+    for name in names:
+        (folder / name).write_text(f"content of {name}")
+    return folder
+
+
+def test_index_folder_results_in_order(tmp_path):
+    folder = make_folder(tmp_path, ["c.txt", "a.txt", "bad.txt", "b.txt", "d.md"])
+    events = []
+
+    result = make_indexer().index_folder(
+        folder, index_id=1, pipeline=StubPipeline(), event_callback=events.append
+    )
+
+    assert [item["file_name"] for item in result["results"]] == [
+        "a.txt",
+        "b.txt",
+        "bad.txt",
+        "c.txt",
+    ]
+    assert [item["status"] for item in result["results"]] == [
+        "indexed",
+        "indexed",
+        "failed",
+        "indexed",
+    ]
+    assert result["results"][0]["file_id"] == f"id-{folder / 'a.txt'}"
+    assert (result["indexed"], result["errors"]) == (3, 1)
+    assert [event["event"] for event in events] == ["start"] + ["file"] * 4 + ["done"]
+
+
+def test_index_folder_resumes_from_manifest(tmp_path):
+    folder = make_folder(tmp_path, [f"{idx}.txt" for idx in range(5)])
+    manifest_path = tmp_path / "manifest.jsonl"
+    indexer = make_indexer()
+
+    result = indexer.index_folder(
+        folder,
+        index_id=1,
+        manifest_path=manifest_path,
+        pipeline=StubPipeline(stop_after=2),
+    )
+    assert [item["status"] for item in result["results"]] == [
+        "indexed",
+        "indexed",
+        "error",
+        "error",
+        "error",
+    ]
+    manifest = IndexingManifest(manifest_path)
+    assert [manifest.is_done(folder / f"{idx}.txt") for idx in range(5)] == [
+        True,
+        True,
+        False,
+        False,
+        False,
+    ]
+
+    # the manifest is compacted to one record per file
+    with open(manifest_path) as f:
+        assert len([json.loads(line) for line in f]) == 5
+
+    pipeline = StubPipeline()
+    result = indexer.index_folder(
+        folder, index_id=1, manifest_path=manifest_path, pipeline=pipeline
+    )
+    assert pipeline.streamed == [str(folder / f"{idx}.txt") for idx in range(2, 5)]
+    assert (result["resumed"], result["indexed"], result["errors"]) == (2, 3, 0)
+
+    # a file changed since it was indexed is indexed again
+    (folder / "0.txt").write_text("new content of 0.txt")
+    pipeline = StubPipeline()
+    indexer.index_folder(
+        folder, index_id=1, manifest_path=manifest_path, pipeline=pipeline
+    )
+    assert pipeline.streamed == [str(folder / "0.txt")]
+
+
+def test_resolve_files(file_index, sql_engine):
+    add_files(
+        sql_engine,
+        file_index,
+        [
+            ("id-a", "2023-a.pdf", "default", "hash-a", 1),
+            ("id-b", "2023-b.txt", "default", "hash-b", 1),
+            ("id-c", "2024-c.pdf", "default", "hash-c", 1),
+            ("id-d", "2023-d.pdf", "other", "hash-d", 1),
+            ("id-e", "2023_e.pdf", "default", "hash-e", 1),
+        ],
+    )
+    indexer = make_indexer(file_index)
+
+    assert indexer.resolve_files(file_index, names=["2024-c.pdf"]) == {
+        "id-c": "2024-c.pdf"
+    }
+    assert indexer.resolve_files(file_index, file_ids=["id-a", "missing"]) == {
+        "id-a": "2023-a.pdf"
+    }
+    assert indexer.resolve_files(file_index, patterns=["2023-*.pdf"]) == {
+        "id-a": "2023-a.pdf"
+    }
+    assert indexer.resolve_files(file_index, patterns=["2023-[b-z].*"]) == {
+        "id-b": "2023-b.txt"
+    }
+    assert indexer.resolve_files(
+        file_index, names=["2024-c.pdf"], file_ids=["id-b"], patterns=["*_*"]
+    ) == {"id-b": "2023-b.txt", "id-c": "2024-c.pdf", "id-e": "2023_e.pdf"}
+    assert indexer.resolve_files(file_index) == {}
+
+    # the files of the other users are not found
+    assert indexer.resolve_files(file_index, names=["2023-d.pdf"]) == {}
+    assert indexer.resolve_files(file_index, names=["2023-d.pdf"], user_id="other") == {
+        "id-d": "2023-d.pdf"
+    }
+
+
+def test_delete_files(file_index, sql_engine):
+    add_files(
+        sql_engine,
+        file_index,
+        [
+            ("id-a", "a.txt", "default", "hash-a", 1),
+            ("id-b", "b.txt", "default", "hash-b", 1),
+            ("id-c", "c.txt", "default", "hash-c", 1),
+        ],
+    )
+    add_chunks(sql_engine, file_index, "id-a", 2)
+    add_chunks(sql_engine, file_index, "id-b", 1)
+    add_chunks(sql_engine, file_index, "id-c", 1)
+    indexer = make_indexer(file_index)
+
+    statements = []
+    event.listen(
+        sql_engine,
+        "before_cursor_execute",
+        lambda conn, cursor, statement, *args: statements.append(statement),
+    )
+    result = indexer.delete_files(patterns=["[ab].txt"], index_id=1)
+    assert result["success"] and result["deleted"] == 2
+    assert result["files"] == {"id-a": "a.txt", "id-b": "b.txt"}
+
+    # the relations of the files are removed in one statement
+    Source, Index = file_index._resources["Source"], file_index._resources["Index"]
+    index_deletions = [
+        statement
+        for statement in statements
+        if statement.startswith(f"DELETE FROM {Index.__tablename__}")
+    ]
+    assert len(index_deletions) == 1
+    with Session(sql_engine) as session:
+        assert session.execute(select(Source.id)).scalars().all() == ["id-c"]
+        assert set(session.execute(select(Index.source_id)).scalars()) == {"id-c"}
+
+    chunk_ids = {"id-a-0", "id-a-1", "id-b-0"}
+    for store in (file_index._vs, file_index._docstore):
+        assert {
+            chunk_id
+            for call in store.delete.call_args_list
+            for chunk_id in call.args[0]
+        } == chunk_ids
+
+    # no store is called without chunks to delete
+    file_index._vs.reset_mock()
+    file_index._docstore.reset_mock()
+    with Session(sql_engine) as session:
+        session.execute(delete(Index))
+        session.commit()
+    result = indexer.delete_files(names=["c.txt"], index_id=1)
+    assert result["success"] and result["deleted"] == 1
+    assert not file_index._vs.delete.called
+    assert not file_index._docstore.delete.called
+
+    result = indexer.delete_files(names=["missing.txt"], index_id=1)
+    assert result["success"] and result["deleted"] == 0
+
+
+def test_sync_folder(file_index, sql_engine, tmp_path):
+    folder = make_folder(
+        tmp_path, ["same.txt", "resized.txt", "edited.txt", "new.txt", "gone.txt"]
+    )
+    manifest_path = tmp_path / "manifest.jsonl"
+    manifest = IndexingManifest(manifest_path)
+    manifest.add(folder / "gone.txt", "indexed", "id-gone")
+    (folder / "gone.txt").unlink()
+    # a file of the index recorded from another folder
+    (tmp_path / "other").mkdir()
+    other_folder = make_folder(tmp_path / "other", ["moved.txt"])
+    manifest.add(other_folder / "moved.txt", "indexed", "id-moved")
+    (other_folder / "moved.txt").unlink()
+
+    def size(name):
+        return (folder / name).stat().st_size
+
+    add_files(
+        sql_engine,
+        file_index,
+        [
+            (
+                "id-same",
+                "same.txt",
+                "default",
+                get_file_hash(folder / "same.txt"),
+                size("same.txt"),
+            ),
+            (
+                "id-resized",
+                "resized.txt",
+                "default",
+                get_file_hash(folder / "resized.txt"),
+                size("resized.txt") + 1,
+            ),
+            ("id-edited", "edited.txt", "default", "0" * 64, size("edited.txt")),
+            ("id-gone", "gone.txt", "default", "hash-gone", 1),
+            ("id-moved", "moved.txt", "default", "hash-moved", 1),
+            ("id-uploaded", "uploaded.txt", "default", "hash-uploaded", 1),
+        ],
+    )
+    indexer = make_indexer(file_index)
+
+    pipeline = SyncStubPipeline()
+    result = indexer.sync_folder(
+        folder,
+        index_id=1,
+        manifest_path=manifest_path,
+        dry_run=True,
+        delete_missing=True,
+        pipeline=pipeline,
+    )
+    assert result["planned"]["added"] == [str(folder / "new.txt")]
+    assert set(result["planned"]["modified"]) == {
+        str(folder / "resized.txt"),
+        str(folder / "edited.txt"),
+    }
+    assert result["planned"]["removed"] == [str(folder / "gone.txt")]
+    assert result["unchanged"] == 1
+    assert pipeline.streamed == pipeline.deleted == []
+
+    result = indexer.sync_folder(
+        folder,
+        index_id=1,
+        manifest_path=manifest_path,
+        delete_missing=True,
+        pipeline=pipeline,
+    )
+    assert set(pipeline.streamed) == {
+        str(folder / name) for name in ("new.txt", "resized.txt", "edited.txt")
+    }
+    # only the file indexed from the folder is deleted
+    assert pipeline.deleted == ["id-gone"]
+    assert (result["added"], result["modified"], result["deleted"]) == (1, 2, 1)
+
+    # without delete_missing, no file is deleted
+    pipeline = SyncStubPipeline()
+    indexer.sync_folder(folder, index_id=1, pipeline=pipeline)
+    assert pipeline.deleted == []
+
+
+def test_watch_unchanged_folder(file_index, sql_engine, tmp_path):
+    folder = make_folder(tmp_path, ["a.txt", "b.txt"])
+    add_files(
+        sql_engine,
+        file_index,
+        [
+            (
+                f"id-{name}",
+                name,
+                "default",
+                get_file_hash(folder / name),
+                (folder / name).stat().st_size,
+            )
+            for name in ("a.txt", "b.txt")
+        ],
+    )
+    indexer = make_indexer(file_index)
+    manifest_path = tmp_path / "manifest.jsonl"
+
+    pipeline = SyncStubPipeline()
+    result = indexer.watch_folder(
+        folder,
+        interval=0,
+        max_syncs=2,
+        index_id=1,
+        pipeline=pipeline,
+        manifest_path=manifest_path,
+        delete_missing=True,
+    )
+    assert result["unchanged"] == 2
+    assert pipeline.streamed == pipeline.deleted == []
+
+    # a file touched without being changed is still unchanged
+    os.utime(folder / "a.txt", (0, 0))
+    result = indexer.watch_folder(
+        folder,
+        interval=0,
+        max_syncs=1,
+        index_id=1,
+        pipeline=pipeline,
+        manifest_path=manifest_path,
+    )
+    assert result["unchanged"] == 2
+    assert pipeline.streamed == []
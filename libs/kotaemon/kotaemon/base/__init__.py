@@ -1,4 +1,10 @@
-from .component import BaseComponent, Node, Param, lazy
+from .component import BaseComponent, Node, Param, get_component_spec, lazy
+from .resources import (
+    LazyTokenizer,
+    get_encoding,
+    get_encoding_for_model,
+    get_resource,
+)
 from .schema import (
     AIMessage,
     BaseMessage,
@@ -27,4 +33,9 @@ __all__ = [
     "Param",
     "Node",
     "lazy",
+    "get_component_spec",
+    "get_resource",
+    "get_encoding",
+    "get_encoding_for_model",
+    "LazyTokenizer",
 ]
@@ -5,6 +5,9 @@ from theflow import Function, Node, Param, lazy
 
 from kotaemon.base.schema import Document
 
+# params that don't change the output of a component, e.g. credentials
+_CONNECTION_PARAM_KEYWORDS = ("key", "token", "secret", "timeout", "retries")
+
 
 class BaseComponent(Function):
     """A component is a class that can be used to compose a pipeline.
@@ -63,4 +66,32 @@ class BaseComponent(Function):
         ...
 
 
-__all__ = ["BaseComponent", "Param", "Node", "lazy"]
+def get_component_spec(component: Function) -> dict:
+    """Get the class and the output-relevant params of a component
+
+    Components with the same spec produce the same outputs, so the spec can
+    fingerprint them, e.g. to key a cache or to detect a config change.
+    Credentials and connection settings are not part of the spec.
+
+    Returns:
+        a dict with the class path as "function" and the params as "params"
+    """
+    # llama-index and langchain based components keep their params outside of
+    # theflow, and dump them flat instead of under "params"
+    params = {
+        **component.dump(strict=False).get("params", {}),
+        **getattr(component, "_kwargs", {}),
+    }
+    return {
+        "function": (
+            f"{component.__class__.__module__}.{component.__class__.__qualname__}"
+        ),
+        "params": {
+            name: value
+            for name, value in params.items()
+            if not any(kw in name.lower() for kw in _CONNECTION_PARAM_KEYWORDS)
+        },
+    }
+
+
+__all__ = ["BaseComponent", "Param", "Node", "lazy", "get_component_spec"]
@@ -0,0 +1,84 @@
+"""Process-wide registry of the resources that are expensive to load
+
+Tokenizers, models, etc. are loaded the first time they are requested, then
+shared by the whole process, so that importing a module or starting a worker
+doesn't pay for resources that are never used.
+"""
+from __future__ import annotations
+
+import threading
+from typing import TYPE_CHECKING, Any, Callable, TypeVar
+
+if TYPE_CHECKING:
+    import tiktoken
+
+T = TypeVar("T")
+
+_resources: dict[str, Any] = {}
+_locks: dict[str, threading.Lock] = {}
+_locks_lock = threading.Lock()
+
+
+def get_resource(key: str, loader: Callable[[], T]) -> T:
+    """Get a resource, loading it with `loader` the first time it is requested
+
+    Args:
+        key: the unique name of the resource
+        loader: the function to load the resource
+
+    Returns:
+        the resource
+    """
+    try:
+        return _resources[key]
+    except KeyError:
+        pass
+
+    # load each resource once, without blocking the loading of the others
+    with _locks_lock:
+        lock = _locks.setdefault(key, threading.Lock())
+    with lock:
+        if key not in _resources:
+            _resources[key] = loader()
+    return _resources[key]
+
+
+def get_encoding(encoding_name: str = "cl100k_base") -> "tiktoken.Encoding":
+    """Get a tiktoken encoding"""
+
+    def load():
+        import tiktoken
+
+        return tiktoken.get_encoding(encoding_name)
+
+    return get_resource(f"tiktoken:{encoding_name}", load)
+
+
+def get_encoding_for_model(model_name: str = "gpt-3.5-turbo") -> "tiktoken.Encoding":
+    """Get the tiktoken encoding of an OpenAI model"""
+    import tiktoken
+
+    return get_encoding(tiktoken.encoding_name_for_model(model_name))
+
+
+class LazyTokenizer:
+    """Tokenize text with the tiktoken encoding of a model, loaded on first use
+
+    It can be used where a tokenizer function is expected, e.g. as a default
+    parameter value, without loading the encoding at import time.
+
+    Args:
+        model_name: the OpenAI model whose encoding to use
+        **encode_kwargs: the keyword arguments of `tiktoken.Encoding.encode`
+    """
+
+    def __init__(self, model_name: str = "gpt-3.5-turbo", **encode_kwargs):
+        self.model_name = model_name
+        self.encode_kwargs = encode_kwargs
+
+    def __call__(self, text: str) -> list[int]:
+        encoding = get_encoding_for_model(self.model_name)
+        return encoding.encode(text, **self.encode_kwargs)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(model_name={self.model_name!r})"
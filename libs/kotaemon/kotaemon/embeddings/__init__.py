@@ -1,4 +1,5 @@
 from .base import BaseEmbeddings
+from .cache import CachedEmbeddings, EmbeddingCache, QueryEmbeddingCache
 from .endpoint_based import EndpointEmbeddings
 from .fastembed import FastEmbedEmbeddings
 from .langchain_based import (
@@ -15,6 +16,9 @@ from .voyageai import VoyageAIEmbeddings
 
 __all__ = [
     "BaseEmbeddings",
+    "CachedEmbeddings",
+    "EmbeddingCache",
+    "QueryEmbeddingCache",
     "EndpointEmbeddings",
     "TeiEndpointEmbeddings",
     "LCOpenAIEmbeddings",
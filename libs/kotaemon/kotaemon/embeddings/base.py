@@ -1,6 +1,15 @@
 from __future__ import annotations
 
-from kotaemon.base import BaseComponent, Document, DocumentWithEmbedding
+import json
+from hashlib import sha256
+from typing import Optional
+
+from kotaemon.base import (
+    BaseComponent,
+    Document,
+    DocumentWithEmbedding,
+    get_component_spec,
+)
 
 
 class BaseEmbeddings(BaseComponent):
@@ -19,6 +28,38 @@ class BaseEmbeddings(BaseComponent):
     ) -> list[DocumentWithEmbedding]:
         raise NotImplementedError
 
+    def identity(self) -> str:
+        """Get a key that identifies the embedding model and its output settings
+
+        Embedding components with the same identity produce the same embeddings,
+        so their embeddings can be shared, e.g. in a cache. Credentials and
+        connection settings are not part of the identity.
+        """
+        spec = get_component_spec(self)
+        return sha256(
+            json.dumps(
+                [spec["function"], spec["params"]], sort_keys=True, default=str
+            ).encode()
+        ).hexdigest()
+
+    def supports_images(self) -> bool:
+        """Whether the model embeds the image of a document, not only its text
+
+        Multimodal models read the image of each document with `get_image`.
+        """
+        return False
+
+    def get_image(self, doc: Document) -> Optional[str]:
+        """Get the image of a document as a data URL, or None if it has none
+
+        Blob store references are resolved here, so that the image is only
+        loaded while it is embedded and never copied into the stored metadata.
+        """
+        from kotaemon.storages.blob_store import resolve_blob_url
+
+        image_origin = doc.metadata.get("image_origin")
+        return resolve_blob_url(image_origin) if image_origin else None
+
     def prepare_input(
         self, text: str | list[str] | Document | list[Document]
     ) -> list[Document]:
@@ -0,0 +1,370 @@
+from __future__ import annotations
+
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from hashlib import sha256
+from pathlib import Path
+from typing import Callable, Optional
+
+from theflow.settings import settings as flowsettings
+
+from kotaemon.base import Param
+
+from .base import BaseEmbeddings, Document, DocumentWithEmbedding
+
+# max number of variables in a single SQLite statement, kept low for old versions
+_SQLITE_BATCH_SIZE = 500
+
+
+class EmbeddingCache:
+    """Persistent cache of embeddings, backed by a single SQLite file
+
+    Embeddings are keyed by the identity of the embedding model and the hash of the
+    embedded text. When the cache holds more than `max_entries` embeddings, the
+    least recently used ones are evicted.
+
+    Args:
+        path: the path to the SQLite file
+        max_entries: the maximum number of embeddings to keep, 0 for unlimited
+    """
+
+    def __init__(self, path: str | Path, max_entries: int = 1_000_000):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._path = str(path)
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self._path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT NOT NULL, "
+                "key TEXT NOT NULL, "
+                "embedding BLOB NOT NULL, "
+                "last_access REAL NOT NULL, "
+                "PRIMARY KEY (model, key))"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS embeddings_last_access "
+                "ON embeddings (last_access)"
+            )
+            (self._size,) = self._conn.execute(
+                "SELECT COUNT(*) FROM embeddings"
+            ).fetchone()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, model: str, keys: list[str]) -> dict[str, list[float]]:
+        """Get the cached embeddings of a model
+
+        Args:
+            model: the identity of the embedding model
+            keys: the keys of the embeddings
+
+        Returns:
+            the cached embeddings by key, missing keys are not included
+        """
+        keys = list(dict.fromkeys(keys))
+        found: dict[str, list[float]] = {}
+        with self._lock, self._conn:
+            for start_idx in range(0, len(keys), _SQLITE_BATCH_SIZE):
+                batch = keys[start_idx : start_idx + _SQLITE_BATCH_SIZE]
+                rows = self._conn.execute(
+                    "SELECT key, embedding FROM embeddings "
+                    f"WHERE model = ? AND key IN ({', '.join('?' * len(batch))})",
+                    [model, *batch],
+                )
+                for key, blob in rows:
+                    found[key] = array("d", blob).tolist()
+
+            now = time.time()
+            self._conn.executemany(
+                "UPDATE embeddings SET last_access = ? WHERE model = ? AND key = ?",
+                [(now, model, key) for key in found],
+            )
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+
+        return found
+
+    def set(self, model: str, embeddings: dict[str, list[float]]):
+        """Add the embeddings of a model to the cache
+
+        Args:
+            model: the identity of the embedding model
+            embeddings: the embeddings by key
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, key, embedding, last_access) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (model, key, array("d", embedding).tobytes(), now)
+                    for key, embedding in embeddings.items()
+                ],
+            )
+            self._size += max(cursor.rowcount, 0)
+
+            if self._max_entries and self._size > self._max_entries:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE rowid IN ("
+                    "SELECT rowid FROM embeddings ORDER BY last_access LIMIT ?)",
+                    (self._size - self._max_entries,),
+                )
+                (self._size,) = self._conn.execute(
+                    "SELECT COUNT(*) FROM embeddings"
+                ).fetchone()
+
+    def stats(self) -> dict:
+        """Get the number of cached embeddings, hits and misses"""
+        return {"size": self._size, "hits": self.hits, "misses": self.misses}
+
+    def clear(self):
+        """Remove all the cached embeddings"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM embeddings")
+            self._size = 0
+
+
+_caches: dict[str, EmbeddingCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(path: str | Path, max_entries: int = 1_000_000):
+    """Get the embedding cache at the path, shared within the process"""
+    key = str(Path(path).resolve())
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = EmbeddingCache(path, max_entries)
+        return _caches[key]
+
+
+class QueryEmbeddingCache:
+    """In-memory cache of query embeddings, shared by the retrievers of a process
+
+    Queries are keyed by the identity of the embedding model and the query text
+    with its whitespace normalized, so the retrievers of several indices using
+    the same model embed a query only once. When several threads ask for the
+    same missing query at once, only one of them embeds it and the others wait
+    for its result.
+
+    Args:
+        max_entries: the maximum number of embeddings to keep, the least recently
+            used ones are evicted first
+        ttl: the number of seconds an embedding is kept, 0 to keep it until
+            evicted
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._entries: OrderedDict[
+            tuple[str, str], tuple[float, list[float]]
+        ] = OrderedDict()
+        self._pending: dict[tuple[str, str], threading.Event] = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(text.split())
+
+    def get(
+        self, model: str, text: str | Document, embed: Callable[[], list[float]]
+    ) -> list[float]:
+        """Get the embedding of the query, embedding it if it isn't cached
+
+        Args:
+            model: the identity of the embedding model
+            text: the query
+            embed: the function embedding the query on a cache miss
+
+        Returns:
+            the embedding of the query
+        """
+        query = text.text if isinstance(text, Document) else text
+        key = (model, self.normalize(query))
+
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry and (not self._ttl or time.time() - entry[0] < self._ttl):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                if entry:
+                    del self._entries[key]
+                    self.evictions += 1
+
+                pending = self._pending.get(key)
+                if pending is None:
+                    pending = self._pending[key] = threading.Event()
+                    self.misses += 1
+                    break
+
+            # another thread is embedding the query, retry once it is done
+            pending.wait()
+
+        try:
+            vector = embed()
+            with self._lock:
+                self._entries[key] = (time.time(), vector)
+                while len(self._entries) > self._max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+            return vector
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.set()
+
+    def stats(self) -> dict:
+        """Get the number of cached embeddings, hits, misses and evictions"""
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def clear(self):
+        """Remove all the cached embeddings"""
+        with self._lock:
+            self._entries.clear()
+
+
+_query_cache: Optional[QueryEmbeddingCache] = None
+
+
+def get_query_embedding_cache() -> Optional[QueryEmbeddingCache]:
+    """Get the query embedding cache of the process
+
+    The cache is configured by the `KH_QUERY_EMBEDDING_CACHE` setting, e.g.
+    `{"max_entries": 1024, "ttl": 3600}`. Set it to None to disable the cache.
+    """
+    global _query_cache
+
+    cache_settings = getattr(flowsettings, "KH_QUERY_EMBEDDING_CACHE", {})
+    if cache_settings is None:
+        return None
+
+    with _caches_lock:
+        if _query_cache is None:
+            _query_cache = QueryEmbeddingCache(**cache_settings)
+        return _query_cache
+
+
+class CachedEmbeddings(BaseEmbeddings):
+    """Wrap an embedding model with a persistent embedding cache
+
+    Only the texts that are not cached yet are sent to the wrapped model, and
+    identical texts in the same batch are only embedded once.
+
+    Example:
+        ```python
+        embedding = CachedEmbeddings(
+            embedding=OpenAIEmbeddings(model="text-embedding-3-small", api_key=...),
+            path="embedding_cache.db",
+        )
+        ```
+    """
+
+    embedding: BaseEmbeddings
+    path: str = Param(help="Path to the SQLite file of the cache")
+    max_entries: int = Param(
+        1_000_000, help="Max number of cached embeddings, 0 for unlimited"
+    )
+
+    @property
+    def cache(self) -> EmbeddingCache:
+        return get_embedding_cache(self.path, self.max_entries)
+
+    def identity(self) -> str:
+        return self.get_from_path("embedding").identity()
+
+    def supports_images(self) -> bool:
+        return self.get_from_path("embedding").supports_images()
+
+    def get_image(self, doc: Document) -> Optional[str]:
+        return self.get_from_path("embedding").get_image(doc)
+
+    @staticmethod
+    def get_key(doc: Document) -> str:
+        """Get the cache key of a doc, from its text and its image if it has one
+
+        Images, e.g. page thumbnails, all have the same placeholder text, so
+        their key includes the image, as a data URL or a blob store URL.
+        """
+        key = sha256(doc.text.encode())
+        image_origin = doc.metadata.get("image_origin")
+        if image_origin:
+            key.update(b"\0" + str(image_origin).encode())
+        return key.hexdigest()
+
+    def _split_cached(
+        self, text: str | list[str] | Document | list[Document]
+    ) -> tuple[list[Document], list[str], dict[str, list[float]], dict[str, Document]]:
+        """Look up the input in the cache
+
+        Returns:
+            the input docs, their keys, the cached embeddings by key and the unique
+            docs that still need to be embedded by key
+        """
+        input_docs = self.prepare_input(text)
+        keys = [self.get_key(doc) for doc in input_docs]
+        cached = self.cache.get(self.identity(), keys)
+
+        to_embed: dict[str, Document] = {}
+        for key, doc in zip(keys, input_docs):
+            if key not in cached and key not in to_embed:
+                to_embed[key] = doc
+
+        return input_docs, keys, cached, to_embed
+
+    def _merge(
+        self,
+        input_docs: list[Document],
+        keys: list[str],
+        cached: dict[str, list[float]],
+        new_keys: list[str],
+        embedded: list[DocumentWithEmbedding],
+    ) -> list[DocumentWithEmbedding]:
+        """Store the new embeddings and assemble the output in the input order"""
+        new_embeddings = {key: doc.embedding for key, doc in zip(new_keys, embedded)}
+        if new_embeddings:
+            self.cache.set(self.identity(), new_embeddings)
+
+        embeddings = {**cached, **new_embeddings}
+        return [
+            DocumentWithEmbedding(embedding=embeddings[key], content=doc)
+            for key, doc in zip(keys, input_docs)
+        ]
+
+    def invoke(
+        self, text: str | list[str] | Document | list[Document], *args, **kwargs
+    ) -> list[DocumentWithEmbedding]:
+        input_docs, keys, cached, to_embed = self._split_cached(text)
+        embedded = (
+            self.embedding(list(to_embed.values()), *args, **kwargs) if to_embed else []
+        )
+        return self._merge(input_docs, keys, cached, list(to_embed), embedded)
+
+    async def ainvoke(
+        self, text: str | list[str] | Document | list[Document], *args, **kwargs
+    ) -> list[DocumentWithEmbedding]:
+        input_docs, keys, cached, to_embed = self._split_cached(text)
+        embedded = (
+            await self.get_from_path("embedding").ainvoke(
+                list(to_embed.values()), *args, **kwargs
+            )
+            if to_embed
+            else []
+        )
+        return self._merge(input_docs, keys, cached, list(to_embed), embedded)
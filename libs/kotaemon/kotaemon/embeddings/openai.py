@@ -3,7 +3,6 @@ from typing import Optional
 
 import numpy as np
 import openai
-import tiktoken
 from tenacity import (
     retry,
     retry_if_not_exception_type,
@@ -12,7 +11,7 @@ from tenacity import (
 )
 from theflow.utils.modules import import_dotted_string
 
-from kotaemon.base import Param
+from kotaemon.base import Param, get_encoding
 
 from .base import BaseEmbeddings, Document, DocumentWithEmbedding
 
@@ -27,7 +26,7 @@ def split_text_by_chunk_size(text: str, chunk_size: int) -> list[list[int]]:
     Returns:
         list of chunks (as tokens)
     """
-    encoding = tiktoken.get_encoding("cl100k_base")
+    encoding = get_encoding("cl100k_base")
     tokens = iter(encoding.encode(text))
     result = []
     while chunk := list(islice(tokens, chunk_size)):
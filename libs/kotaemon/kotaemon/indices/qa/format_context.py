@@ -1,10 +1,8 @@
 import html
-from functools import partial
 
-import tiktoken
-
-from kotaemon.base import BaseComponent, Document, RetrievedDocument
+from kotaemon.base import BaseComponent, Document, LazyTokenizer, RetrievedDocument
 from kotaemon.indices.splitters import TokenSplitter
+from kotaemon.storages import resolve_blob_url
 
 EVIDENCE_MODE_TEXT = 0
 EVIDENCE_MODE_TABLE = 1
@@ -38,10 +36,8 @@ class PrepareEvidencePipeline(BaseComponent):
                 chunk_size=self.max_context_length,
                 chunk_overlap=0,
                 separator=" ",
-                tokenizer=partial(
-                    tiktoken.encoding_for_model("gpt-3.5-turbo").encode,
-                    allowed_special=set(),
-                    disallowed_special="all",
+                tokenizer=LazyTokenizer(
+                    "gpt-3.5-turbo", allowed_special=set(), disallowed_special="all"
                 ),
             )
         )
@@ -83,7 +79,7 @@ class PrepareEvidencePipeline(BaseComponent):
                     + f"alt='{retrieved_caption}'/>"
                     + "\n<br>"
                 )
-                images.append(retrieved_content)
+                images.append(resolve_blob_url(retrieved_content))
             else:
                 if "window" in retrieved_item.metadata:
                     retrieved_content = retrieved_item.metadata["window"]
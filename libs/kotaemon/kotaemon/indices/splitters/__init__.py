@@ -1,10 +1,6 @@
-from ..base import DocTransformer, LlamaIndexDocTransformerMixin
-
-
-class BaseSplitter(DocTransformer):
-    """Represent base splitter class"""
-
-    ...
+from ..base import LlamaIndexDocTransformerMixin
+from .base import BaseSplitter
+from .tiktoken_splitter import TiktokenSplitter
 
 
 class TokenSplitter(LlamaIndexDocTransformerMixin, BaseSplitter):
@@ -47,3 +43,11 @@ class SentenceWindowSplitter(LlamaIndexDocTransformerMixin, BaseSplitter):
         from llama_index.core.node_parser import SentenceWindowNodeParser
 
         return SentenceWindowNodeParser
+
+
+__all__ = [
+    "BaseSplitter",
+    "TokenSplitter",
+    "SentenceWindowSplitter",
+    "TiktokenSplitter",
+]
@@ -0,0 +1,7 @@
+from ..base import DocTransformer
+
+
+class BaseSplitter(DocTransformer):
+    """Represent base splitter class"""
+
+    ...
@@ -0,0 +1,314 @@
+from __future__ import annotations
+
+import multiprocessing
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+from llama_index.core.schema import MetadataMode, NodeRelationship
+from theflow.base import Param
+
+from kotaemon.base import Document, get_encoding, get_resource
+
+from .base import BaseSplitter
+
+# number of tokens reserved for the metadata formatting, as in llama-index
+_METADATA_FORMAT_LEN = 2
+
+# minimum number of characters for a worker process to be worth starting
+_MIN_CHARS_PER_WORKER = 200_000
+
+
+def _token_byte_lengths(encoding_name: str) -> np.ndarray:
+    """Get the number of bytes of each token of the encoding"""
+
+    def load():
+        encoding = get_encoding(encoding_name)
+        lengths = np.zeros(encoding.n_vocab, dtype=np.int64)
+        for token in range(encoding.n_vocab):
+            try:
+                lengths[token] = len(encoding.decode_single_token_bytes(token))
+            except KeyError:
+                # the token ids are not contiguous
+                pass
+        return lengths
+
+    return get_resource(f"tiktoken-byte-lengths:{encoding_name}", load)
+
+
+def _token_offsets(text: str, tokens: list[int], byte_lengths: np.ndarray):
+    """Get the character offset where each token of the text starts
+
+    A token starting inside a multi-byte character gets the offset of that
+    character, as in `tiktoken.Encoding.decode_with_offsets`.
+    """
+    token_lengths = byte_lengths[tokens]
+    byte_offsets = np.cumsum(token_lengths) - token_lengths
+    if text.isascii():
+        return byte_offsets.tolist()
+
+    data = np.frombuffer(text.encode("utf-8"), dtype=np.uint8)
+    n_chars = np.cumsum((data & 0xC0) != 0x80)
+    return (n_chars[byte_offsets] - 1).tolist()
+
+
+class _OffsetSplitter:
+    """Split a text into chunks of character offsets, given its token offsets
+
+    This follows the llama-index `TokenTextSplitter` algorithm: the text is
+    split by the separators in order, down to single tokens, until every split
+    fits in the chunk size, then the splits are merged into overlapping chunks.
+    The splits are only character ranges, their number of tokens is read from
+    the token offsets of the whole text instead of encoding them again.
+    """
+
+    def __init__(
+        self,
+        text: str,
+        offsets: list[int],
+        chunk_size: int,
+        chunk_overlap: int,
+        separators: list[str],
+    ):
+        self.text = text
+        self.offsets = offsets
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = separators
+
+    def n_tokens(self, start: int, end: int) -> int:
+        return bisect_left(self.offsets, end) - bisect_left(self.offsets, start)
+
+    def split_text(self) -> list[tuple[int, int, int]]:
+        """Get the start, end and number of tokens of each chunk"""
+        if not self.text:
+            return [(0, 0, 0)]
+        return self.merge(self.split(0, len(self.text)))
+
+    def split(self, start: int, end: int) -> list[tuple[int, int]]:
+        if self.n_tokens(start, end) <= self.chunk_size:
+            return [(start, end)]
+
+        for separator in self.separators:
+            bounds = self.find(separator, start, end)
+            if len(bounds) > 2:
+                break
+        else:
+            # split at the token boundaries
+            lo = bisect_right(self.offsets, start)
+            hi = bisect_left(self.offsets, end)
+            bounds = [start, *self.offsets[lo:hi], end]
+            if len(bounds) == 2:
+                # a single character encoded to more tokens than the chunk size
+                return [(start, end)]
+
+        splits = []
+        for split_start, split_end in zip(bounds, bounds[1:]):
+            if split_end <= split_start:
+                continue
+            if self.n_tokens(split_start, split_end) <= self.chunk_size:
+                splits.append((split_start, split_end))
+            else:
+                splits.extend(self.split(split_start, split_end))
+        return splits
+
+    def find(self, separator: str, start: int, end: int) -> list[int]:
+        """Get the split bounds, each split but the first starts with a separator"""
+        bounds = [start]
+        pos = self.text.find(separator, start, end)
+        while pos != -1:
+            if pos > start:
+                bounds.append(pos)
+            pos = self.text.find(separator, pos + len(separator), end)
+        bounds.append(end)
+        return bounds
+
+    def merge(self, splits: list[tuple[int, int]]) -> list[tuple[int, int, int]]:
+        chunks: list[tuple[int, int, int]] = []
+        cur_chunk: list[tuple[int, int, int]] = []
+        cur_len = 0
+        for start, end in splits:
+            split_len = self.n_tokens(start, end)
+            if cur_len + split_len > self.chunk_size:
+                self.add_chunk(chunks, cur_chunk)
+                # start a new chunk with the end of the previous one as overlap
+                while cur_chunk and (
+                    cur_len > self.chunk_overlap
+                    or cur_len + split_len > self.chunk_size
+                ):
+                    cur_len -= cur_chunk.pop(0)[2]
+            cur_chunk.append((start, end, split_len))
+            cur_len += split_len
+
+        self.add_chunk(chunks, cur_chunk)
+        return chunks
+
+    def add_chunk(self, chunks: list, cur_chunk: list[tuple[int, int, int]]):
+        if not cur_chunk:
+            return
+        start, end = cur_chunk[0][0], cur_chunk[-1][1]
+        chunk = self.text[start:end]
+        start += len(chunk) - len(chunk.lstrip())
+        end -= len(chunk) - len(chunk.rstrip())
+        if end > start:
+            chunks.append((start, end, self.n_tokens(start, end)))
+
+
+def _split_texts(
+    texts: list[str],
+    chunk_sizes: list[int],
+    chunk_overlap: int,
+    separators: list[str],
+    encoding_name: str,
+) -> list[list[tuple[int, int, int]]]:
+    """Split the texts, each with its own chunk size, encoding them in a batch"""
+    encoding = get_encoding(encoding_name)
+    byte_lengths = _token_byte_lengths(encoding_name)
+    all_tokens = encoding.encode_ordinary_batch(texts)
+    return [
+        _OffsetSplitter(
+            text,
+            _token_offsets(text, tokens, byte_lengths),
+            chunk_size,
+            chunk_overlap,
+            separators,
+        ).split_text()
+        for text, tokens, chunk_size in zip(texts, all_tokens, chunk_sizes)
+    ]
+
+
+class TiktokenSplitter(BaseSplitter):
+    """Split documents into chunks of tokens, like `TokenSplitter` but natively
+
+    The documents are encoded once, in a batch, and the chunks are cut at token
+    offsets that map directly to the text, so no text is encoded twice. The
+    separators have the same semantics as in `TokenSplitter`. The number of
+    tokens of each chunk, as counted in the document, is kept in its `n_tokens`
+    metadata.
+
+    Args:
+        chunk_size: the maximum number of tokens of a chunk
+        chunk_overlap: the number of tokens shared by consecutive chunks
+        separator: the separator to split the text by first
+        backup_separators: the separators to split the text by next, if the
+            splits are still larger than the chunk size
+        encoding_name: the tiktoken encoding
+        include_metadata: whether the chunks inherit the document metadata, the
+            metadata then counts towards the chunk size
+        include_prev_next_rel: whether to link the consecutive chunks
+        num_workers: the number of processes to split large batches of documents
+    """
+
+    chunk_size: int = 1024
+    chunk_overlap: int = 20
+    separator: str = " "
+    backup_separators: list[str] = Param(
+        default_callback=lambda _: ["\n"],
+        help="Separators to split by if the splits are larger than the chunk size",
+    )
+    encoding_name: str = "cl100k_base"
+    include_metadata: bool = True
+    include_prev_next_rel: bool = True
+    num_workers: int = 1
+
+    def run(self, documents: list[Document], **kwargs) -> list[Document]:
+        if self.chunk_overlap > self.chunk_size:
+            raise ValueError(
+                f"Got a larger chunk overlap ({self.chunk_overlap}) than chunk size "
+                f"({self.chunk_size}), should be smaller."
+            )
+
+        texts = [doc.get_content(metadata_mode=MetadataMode.NONE) for doc in documents]
+        all_spans = self.split_texts(texts, self.get_chunk_sizes(documents))
+
+        chunks = []
+        for doc, text, spans in zip(documents, texts, all_spans):
+            source = doc.as_related_node_info()
+            doc_chunks = [
+                Document(
+                    text=text[start:end],
+                    metadata={
+                        **(doc.metadata if self.include_metadata else {}),
+                        "n_tokens": n_tokens,
+                    },
+                    excluded_embed_metadata_keys=doc.excluded_embed_metadata_keys,
+                    excluded_llm_metadata_keys=doc.excluded_llm_metadata_keys,
+                    metadata_seperator=doc.metadata_seperator,
+                    metadata_template=doc.metadata_template,
+                    text_template=doc.text_template,
+                    relationships={NodeRelationship.SOURCE: source},
+                    start_char_idx=start,
+                    end_char_idx=end,
+                )
+                for start, end, n_tokens in spans
+            ]
+            if self.include_prev_next_rel and len(doc_chunks) > 1:
+                infos = [chunk.as_related_node_info() for chunk in doc_chunks]
+                for idx, chunk in enumerate(doc_chunks):
+                    if idx > 0:
+                        chunk.relationships[NodeRelationship.PREVIOUS] = infos[idx - 1]
+                    if idx < len(doc_chunks) - 1:
+                        chunk.relationships[NodeRelationship.NEXT] = infos[idx + 1]
+            chunks.extend(doc_chunks)
+
+        return chunks
+
+    def get_chunk_sizes(self, documents: list[Document]) -> list[int]:
+        """Get the chunk size of each document, leaving room for its metadata"""
+        if not self.include_metadata:
+            return [self.chunk_size] * len(documents)
+
+        metadata_strs = []
+        for doc in documents:
+            embed_str = doc.get_metadata_str(mode=MetadataMode.EMBED)
+            llm_str = doc.get_metadata_str(mode=MetadataMode.LLM)
+            metadata_strs.append(
+                embed_str if len(embed_str) > len(llm_str) else llm_str
+            )
+
+        encoding = get_encoding(self.encoding_name)
+        chunk_sizes = []
+        for tokens in encoding.encode_ordinary_batch(metadata_strs):
+            metadata_len = len(tokens) + _METADATA_FORMAT_LEN
+            if metadata_len >= self.chunk_size:
+                raise ValueError(
+                    f"Metadata length ({metadata_len}) is longer than chunk size "
+                    f"({self.chunk_size}). Consider increasing the chunk size or "
+                    "decreasing the size of your metadata to avoid this."
+                )
+            chunk_sizes.append(self.chunk_size - metadata_len)
+        return chunk_sizes
+
+    def split_texts(
+        self, texts: list[str], chunk_sizes: list[int]
+    ) -> list[list[tuple[int, int, int]]]:
+        """Get the start, end and number of tokens of the chunks of each text
+
+        Large batches are split across `num_workers` forked processes.
+        """
+        split = partial(
+            _split_texts,
+            chunk_overlap=self.chunk_overlap,
+            separators=[self.separator, *self.backup_separators],
+            encoding_name=self.encoding_name,
+        )
+        num_workers = min(
+            self.num_workers,
+            len(texts),
+            sum(len(text) for text in texts) // _MIN_CHARS_PER_WORKER,
+        )
+        if num_workers <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+            return split(texts, chunk_sizes)
+
+        batch_size = -(-len(texts) // num_workers)
+        batches = range(0, len(texts), batch_size)
+        with ProcessPoolExecutor(
+            max_workers=num_workers, mp_context=multiprocessing.get_context("fork")
+        ) as pool:
+            results = pool.map(
+                split,
+                [texts[idx : idx + batch_size] for idx in batches],
+                [chunk_sizes[idx : idx + batch_size] for idx in batches],
+            )
+            return [spans for batch_spans in results for spans in batch_spans]
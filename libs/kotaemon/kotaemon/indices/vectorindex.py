@@ -2,14 +2,17 @@ from __future__ import annotations
 
 import threading
 import uuid
-from pathlib import Path
+import weakref
+from collections import OrderedDict
 from typing import Optional, Sequence, cast
 
+import numpy as np
 from theflow.settings import settings as flowsettings
 
 from kotaemon.base import BaseComponent, Document, RetrievedDocument
 from kotaemon.embeddings import BaseEmbeddings
-from kotaemon.storages import BaseDocumentStore, BaseVectorStore
+from kotaemon.embeddings.cache import get_query_embedding_cache
+from kotaemon.storages import BaseDocumentStore, BaseVectorStore, get_chunk_archive
 
 from .base import BaseIndexing, BaseRetrieval
 from .rankings import BaseReranking, LLMReranking
@@ -17,6 +20,166 @@ from .rankings import BaseReranking, LLMReranking
 VECTOR_STORE_FNAME = "vectorstore"
 DOC_STORE_FNAME = "docstore"
 
+# max number of vectors kept in memory per vector store for the exact search
+EXACT_SEARCH_CACHE_SIZE = 20_000
+
+
+class _VectorCache:
+    """LRU cache of the normalized vectors of a vector store, by id
+
+    The ids of the chunks don't change once embedded, so the cached vectors only
+    need to be evicted to bound the memory.
+    """
+
+    def __init__(self, max_entries: int):
+        self._max_entries = max_entries
+        self._vectors: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(
+        self, vector_store: BaseVectorStore, ids: list[str]
+    ) -> tuple[list[str], np.ndarray]:
+        """Get the normalized vectors of the ids, loading the missing ones from the
+        vector store
+
+        Returns:
+            the ids found, and their vectors as the rows of a matrix
+        """
+        with self._lock:
+            found = {id_: self._vectors[id_] for id_ in ids if id_ in self._vectors}
+            for id_ in found:
+                self._vectors.move_to_end(id_)
+
+        missing = [id_ for id_ in ids if id_ not in found]
+        if missing:
+            loaded_ids, embeddings = vector_store.get_embeddings(missing)
+            if loaded_ids:
+                matrix = np.asarray(embeddings, dtype=np.float32)
+                norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+                matrix /= np.where(norms == 0, 1, norms)
+                loaded = dict(zip(loaded_ids, matrix))
+                found.update(loaded)
+                with self._lock:
+                    self._vectors.update(loaded)
+                    while len(self._vectors) > self._max_entries:
+                        self._vectors.popitem(last=False)
+
+        found_ids = [id_ for id_ in dict.fromkeys(ids) if id_ in found]
+        if not found_ids:
+            return [], np.empty((0, 0), dtype=np.float32)
+        return found_ids, np.stack([found[id_] for id_ in found_ids])
+
+
+_vector_caches: weakref.WeakKeyDictionary[
+    BaseVectorStore, _VectorCache
+] = weakref.WeakKeyDictionary()
+_vector_caches_lock = threading.Lock()
+
+
+def exact_search(
+    vector_store: BaseVectorStore, embedding: list[float], ids: list[str], top_k: int
+) -> tuple[list[float], list[str]]:
+    """Find the most similar vectors among the given ids, by brute force
+
+    The vectors are cached in memory per vector store, and scored by their cosine
+    similarity to the query with a single matrix product.
+
+    Args:
+        vector_store: the vector store holding the vectors
+        embedding: the query embedding
+        ids: the ids of the vectors to search in
+        top_k: the number of vectors to return
+
+    Returns:
+        the similarity scores and the ids of the top_k most similar vectors, best
+        first
+    """
+    with _vector_caches_lock:
+        cache = _vector_caches.get(vector_store)
+        if cache is None:
+            cache = _vector_caches[vector_store] = _VectorCache(EXACT_SEARCH_CACHE_SIZE)
+
+    found_ids, matrix = cache.get(vector_store, ids)
+    if not found_ids or top_k <= 0:
+        return [], []
+
+    query = np.asarray(embedding, dtype=np.float32)
+    query_norm = np.linalg.norm(query)
+    scores = matrix @ (query / query_norm if query_norm else query)
+
+    k = min(top_k, len(found_ids))
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top], kind="stable")]
+    return scores[top].tolist(), [found_ids[idx] for idx in top]
+
+
+def fuse_rankings(
+    rankings: Sequence[Sequence[str]],
+    scores: Optional[Sequence[Optional[Sequence[float]]]] = None,
+    weights: Optional[Sequence[float]] = None,
+    method: str = "rrf",
+    rrf_k: int = 60,
+) -> tuple[list[str], list[float]]:
+    """Fuse several ranked lists of doc ids into a single ranking
+
+    Args:
+        rankings: the ranked lists of doc ids, best first. A doc id repeated in a
+            list only counts at its best rank
+        scores: the scores of each list, higher is better, or None for a list
+            that only has ranks. Only used by the "weighted" method
+        weights: the weight of each list, default to 1 for every list
+        method: "rrf" for reciprocal rank fusion, where a doc scores
+            `sum(weight / (rrf_k + rank))` over the lists, or "weighted" for the
+            weighted sum of the min-max normalized scores of each list. A list
+            without scores is scored `1 - rank / len(list)`
+        rrf_k: the rank offset of reciprocal rank fusion
+
+    Returns:
+        the fused doc ids, best first, and their fused scores
+    """
+    if method not in ("rrf", "weighted"):
+        raise ValueError(f"Unknown fusion method {method}, should be rrf or weighted")
+
+    weights = list(weights) if weights is not None else [1.0] * len(rankings)
+    scores = list(scores) if scores is not None else [None] * len(rankings)
+
+    positions: dict[str, int] = {}
+    fused = np.zeros(sum(len(ranking) for ranking in rankings), dtype=np.float64)
+    for ranking, list_scores, weight in zip(rankings, scores, weights):
+        if not ranking:
+            continue
+
+        # keep the first, best ranked, occurrence of each doc id
+        list_ids, first_ranks = np.unique(np.asarray(ranking), return_index=True)
+        by_rank = np.argsort(first_ranks)
+        list_ids, first_ranks = list_ids[by_rank], first_ranks[by_rank]
+        ranks = first_ranks.astype(np.float64)
+
+        if method == "rrf":
+            contribution = weight / (rrf_k + ranks + 1)
+        elif list_scores is not None:
+            values = np.asarray(list_scores, dtype=np.float64)[first_ranks]
+            spread = values.max() - values.min()
+            if spread:
+                contribution = weight * (values - values.min()) / spread
+            else:
+                contribution = weight * np.ones_like(values)
+        else:
+            contribution = weight * (1 - ranks / len(ranking))
+
+        indices = np.fromiter(
+            (positions.setdefault(str(doc_id), len(positions)) for doc_id in list_ids),
+            dtype=np.int64,
+            count=len(list_ids),
+        )
+        np.add.at(fused, indices, contribution)
+
+    fused = fused[: len(positions)]
+    doc_ids = np.array(list(positions), dtype=object)
+    # stable sort, so that ties keep the order in which the docs were first seen
+    order = np.argsort(-fused, kind="stable")
+    return doc_ids[order].tolist(), fused[order].tolist()
+
 
 class VectorIndexing(BaseIndexing):
     """Ingest the document, run through the embedding, and store the embedding in a
@@ -43,38 +206,22 @@ class VectorIndexing(BaseIndexing):
         )
 
     def write_chunk_to_file(self, docs: list[Document]):
-        # save the chunks content into markdown format
-        if self.cache_dir:
-            file_name = docs[0].metadata.get("file_name")
-            if not file_name:
-                return
-
-            file_name = Path(file_name)
-            for i in range(len(docs)):
-                markdown_content = ""
-                if "page_label" in docs[i].metadata:
-                    page_label = str(docs[i].metadata["page_label"])
-                    markdown_content += f"Page label: {page_label}"
-                if "file_name" in docs[i].metadata:
-                    filename = docs[i].metadata["file_name"]
-                    markdown_content += f"\nFile name: {filename}"
-                if "section" in docs[i].metadata:
-                    section = docs[i].metadata["section"]
-                    markdown_content += f"\nSection: {section}"
-                if "type" in docs[i].metadata:
-                    if docs[i].metadata["type"] == "image":
-                        image_origin = docs[i].metadata["image_origin"]
-                        image_origin = f'<p><img src="{image_origin}"></p>'
-                        markdown_content += f"\nImage origin: {image_origin}"
-                if docs[i].text:
-                    markdown_content += f"\ntext:\n{docs[i].text}"
-
-                with open(
-                    Path(self.cache_dir) / f"{file_name.stem}_{self.count_+i}.md",
-                    "w",
-                    encoding="utf-8",
-                ) as f:
-                    f.write(markdown_content)
+        """Archive the chunks in `cache_dir`, grouped by their source file
+
+        The chunks are written in the background, see `ChunkArchive`.
+        """
+        if not self.cache_dir:
+            return
+
+        archive = get_chunk_archive(self.cache_dir)
+        sources: dict[str, list[Document]] = {}
+        for doc in docs:
+            source = doc.metadata.get("file_id") or doc.metadata.get("file_name")
+            if source:
+                sources.setdefault(source, []).append(doc)
+
+        for source, source_docs in sources.items():
+            archive.append(source, source_docs)
 
     def add_to_docstore(self, docs: list[Document]):
         if self.doc_store:
@@ -123,6 +270,14 @@ class VectorRetrieval(BaseRetrieval):
     top_k: int = 5
     first_round_top_k_mult: int = 10
     retrieval_mode: str = "hybrid"  # vector, text, hybrid
+    fusion_method: str = "rrf"  # rrf, weighted
+    vector_weight: float = 1.0
+    text_weight: float = 1.0
+    rrf_k: int = 60
+    cache_query_embedding: bool = True
+    # scopes of at most this number of docs are searched exactly, in-process,
+    # instead of by the vector store. 0 to disable
+    exact_search_threshold: int = 2000
 
     def _filter_docs(
         self, documents: list[RetrievedDocument], top_k: int | None = None
@@ -131,6 +286,82 @@ class VectorRetrieval(BaseRetrieval):
             documents = documents[:top_k]
         return documents
 
+    def _embed_query(self, text: str | Document) -> list[float]:
+        """Embed the query, through the query embedding cache of the process if
+        enabled
+        """
+        cache = get_query_embedding_cache() if self.cache_query_embedding else None
+        if cache is None:
+            return self.embedding(text)[0].embedding
+        return cache.get(
+            self.get_from_path("embedding").identity(),
+            text,
+            lambda: self.embedding(text)[0].embedding,
+        )
+
+    def _query_vectorstore(
+        self,
+        emb: list[float],
+        top_k: int,
+        scope: Optional[list[str]],
+        vector_scope: Optional[list[str]],
+        **kwargs,
+    ) -> tuple[list[float], list[str]]:
+        """Query the vector store, or search the scope exactly if it is small
+
+        The exact search is only used with no other query parameters than the
+        metadata filters, which the scope is expected to imply.
+        """
+        if (
+            self.exact_search_threshold
+            and scope
+            and len(scope) <= self.exact_search_threshold
+            and set(kwargs) <= {"filters"}
+        ):
+            try:
+                return exact_search(self.vector_store, emb, scope, top_k)
+            except NotImplementedError:
+                pass
+
+        _, scores, ids = self.vector_store.query(
+            embedding=emb, top_k=top_k, doc_ids=vector_scope, **kwargs
+        )
+        return scores, ids
+
+    def _fuse(
+        self,
+        vs_docs: list[RetrievedDocument],
+        vs_scores: list[float],
+        ds_docs: list[RetrievedDocument],
+    ) -> list[RetrievedDocument]:
+        """Merge the vector store and full-text hits into one ranking, see
+        `fuse_rankings`
+
+        A doc keeps its vector store score, or -1.0 if it is only a full-text hit,
+        and its fused score is kept in the "fusion_score" metadata.
+        """
+        docs = {doc.doc_id: doc for doc in ds_docs}
+        docs.update({doc.doc_id: doc for doc in vs_docs})
+        vector_scores = {doc.doc_id: score for doc, score in zip(vs_docs, vs_scores)}
+
+        doc_ids, fused_scores = fuse_rankings(
+            [[doc.doc_id for doc in vs_docs], [doc.doc_id for doc in ds_docs]],
+            scores=[vs_scores[: len(vs_docs)], None],
+            weights=[self.vector_weight, self.text_weight],
+            method=self.fusion_method,
+            rrf_k=self.rrf_k,
+        )
+
+        result = []
+        for doc_id, fused_score in zip(doc_ids, fused_scores):
+            doc = RetrievedDocument(
+                **docs[doc_id].to_dict(), score=vector_scores.get(doc_id, -1.0)
+            )
+            doc.metadata["fusion_score"] = fused_score
+            result.append(doc)
+
+        return result
+
     def run(
         self, text: str | Document, top_k: Optional[int] = None, **kwargs
     ) -> list[RetrievedDocument]:
@@ -162,13 +393,19 @@ class VectorRetrieval(BaseRetrieval):
 
         result: list[RetrievedDocument] = []
         # TODO: should declare scope directly in the run params
+        # scope: the ids of the docs to search in, both in the vector store and in
+        # the doc store. vector_scope overrides the scope of the vector store, e.g.
+        # None when it is scoped by metadata filters instead. search_all searches
+        # the whole stores, without scope
         scope = kwargs.pop("scope", None)
+        vector_scope = kwargs.pop("vector_scope", scope)
+        search_all = kwargs.pop("search_all", False)
         emb: list[float]
 
         if self.retrieval_mode == "vector":
-            emb = self.embedding(text)[0].embedding
-            _, scores, ids = self.vector_store.query(
-                embedding=emb, top_k=top_k_first_round, doc_ids=scope, **kwargs
+            emb = self._embed_query(text)
+            scores, ids = self._query_vectorstore(
+                emb, top_k_first_round, scope, vector_scope, **kwargs
             )
             docs = self.doc_store.get(ids)
             result = [
@@ -178,14 +415,14 @@ class VectorRetrieval(BaseRetrieval):
         elif self.retrieval_mode == "text":
             query = text.text if isinstance(text, Document) else text
             docs = []
-            if scope:
+            if scope or search_all:
                 docs = self.doc_store.query(
                     query, top_k=top_k_first_round, doc_ids=scope
                 )
             result = [RetrievedDocument(**doc.to_dict(), score=-1.0) for doc in docs]
         elif self.retrieval_mode == "hybrid":
             # similarity search section
-            emb = self.embedding(text)[0].embedding
+            emb = self._embed_query(text)
             vs_docs: list[RetrievedDocument] = []
             vs_ids: list[str] = []
             vs_scores: list[float] = []
@@ -196,8 +433,8 @@ class VectorRetrieval(BaseRetrieval):
                 nonlocal vs_ids
 
                 assert self.doc_store is not None
-                _, vs_scores, vs_ids = self.vector_store.query(
-                    embedding=emb, top_k=top_k_first_round, doc_ids=scope, **kwargs
+                vs_scores, vs_ids = self._query_vectorstore(
+                    emb, top_k_first_round, scope, vector_scope, **kwargs
                 )
                 if vs_ids:
                     vs_docs = self.doc_store.get(vs_ids)
@@ -210,7 +447,7 @@ class VectorRetrieval(BaseRetrieval):
 
                 assert self.doc_store is not None
                 query = text.text if isinstance(text, Document) else text
-                if scope:
+                if scope or search_all:
                     ds_docs = self.doc_store.query(
                         query, top_k=top_k_first_round, doc_ids=scope
                     )
@@ -224,15 +461,7 @@ class VectorRetrieval(BaseRetrieval):
             vs_query_thread.join()
             ds_query_thread.join()
 
-            result = [
-                RetrievedDocument(**doc.to_dict(), score=-1.0)
-                for doc in ds_docs
-                if doc not in vs_ids
-            ]
-            result += [
-                RetrievedDocument(**doc.to_dict(), score=score)
-                for doc, score in zip(vs_docs, vs_scores)
-            ]
+            result = self._fuse(vs_docs, vs_scores, ds_docs)
             print(f"Got {len(vs_docs)} from vectorstore")
             print(f"Got {len(ds_docs)} from docstore")
 
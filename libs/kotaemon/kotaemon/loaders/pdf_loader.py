@@ -1,4 +1,9 @@
 import base64
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
 from io import BytesIO
 from pathlib import Path
 from typing import Dict, List, Optional
@@ -9,61 +14,189 @@ from llama_index.readers.file import PDFReader
 from PIL import Image
 
 from kotaemon.base import Document
+from kotaemon.storages import get_blob_store
 
 PDF_LOADER_DPI = config("PDF_LOADER_DPI", default=40, cast=int)
+# image format of the page thumbnails: PNG, JPEG or WEBP
+PDF_THUMBNAIL_FORMAT = config("PDF_THUMBNAIL_FORMAT", default="PNG").upper()
+# quality of the JPEG and WEBP thumbnails, from 1 to 100
+PDF_THUMBNAIL_QUALITY = config("PDF_THUMBNAIL_QUALITY", default=80, cast=int)
+# number of processes rendering the page thumbnails, 1 to render in-process. The
+# processes are forked by `start_thumbnail_pool`, when the app starts
+PDF_THUMBNAIL_WORKERS = config("PDF_THUMBNAIL_WORKERS", default=1, cast=int)
+# render the page thumbnails on first access instead of when loading the file,
+# requires the blob store (`KH_BLOB_STORE_DIR`)
+PDF_THUMBNAIL_LAZY = config("PDF_THUMBNAIL_LAZY", default=False, cast=bool)
+
+_MIME_TYPES = {"PNG": "image/png", "JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+# number of pages rendered by a worker process at once
+_PAGES_PER_TASK = 8
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _noop():
+    pass
+
+
+def start_thumbnail_pool(max_workers: int = PDF_THUMBNAIL_WORKERS):
+    """Start the process pool shared by the thumbnail renderings
+
+    The workers are forked, since spawned workers re-import the main module,
+    which launches the app. Forking a process that runs other threads can
+    deadlock the workers on a lock held by one of these threads, so the pool has
+    to be started before the app starts any thread. Without a pool, e.g. with
+    a single worker or without fork, the thumbnails are rendered in-process.
+
+    Args:
+        max_workers: the number of worker processes
+    """
+    global _pool
+
+    if max_workers <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+        return
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=max_workers, mp_context=multiprocessing.get_context("fork")
+            )
+            # the forked workers are all started with the first task
+            _pool.submit(_noop).result()
+
+
+def _reset_pool():
+    global _pool
+
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def _render_pages(
+    file_path: str, pages: list[int], dpi: int, format: str, quality: int
+) -> list[str]:
+    """Render the pages of the PDF file into base64 images"""
+    import fitz
+
+    output_imgs = []
+    with fitz.open(file_path) as doc:
+        for page_number in pages:
+            page = doc.load_page(page_number)
+            pm = page.get_pixmap(dpi=dpi)
+            img = Image.frombytes("RGB", [pm.width, pm.height], pm.samples)
+            output_imgs.append(convert_image_to_base64(img, format, quality))
+
+    return output_imgs
 
 
 def get_page_thumbnails(
-    file_path: Path, pages: list[int], dpi: int = PDF_LOADER_DPI
-) -> List[Image.Image]:
+    file_path: Path,
+    pages: list[int],
+    dpi: int = PDF_LOADER_DPI,
+    format: str = PDF_THUMBNAIL_FORMAT,
+    quality: int = PDF_THUMBNAIL_QUALITY,
+    max_workers: int = PDF_THUMBNAIL_WORKERS,
+) -> List[str]:
     """Get image thumbnails of the pages in the PDF file.
 
+    Large page ranges are split into batches rendered by the pool of processes,
+    if it was started by `start_thumbnail_pool`.
+
     Args:
         file_path (Path): path to the image file
         page_number (list[int]): list of page numbers to extract
+        dpi (int): resolution of the thumbnails
+        format (str): image format of the thumbnails, PNG, JPEG or WEBP
+        quality (int): quality of the JPEG and WEBP thumbnails
+        max_workers (int): 1 to render the thumbnails in-process, even if the
+            pool of processes is started
 
     Returns:
-        list[Image.Image]: list of page thumbnails
+        list[str]: list of page thumbnails, as base64 data URLs
     """
-
-    img: Image.Image
-    suffix = file_path.suffix.lower()
+    suffix = Path(file_path).suffix.lower()
     assert suffix == ".pdf", "This function only supports PDF files."
     try:
-        import fitz
+        import fitz  # noqa: F401
     except ImportError:
         raise ImportError("Please install PyMuPDF: 'pip install PyMuPDF'")
 
-    doc = fitz.open(file_path)
-
-    output_imgs = []
-    for page_number in pages:
-        page = doc.load_page(page_number)
-        pm = page.get_pixmap(dpi=dpi)
-        img = Image.frombytes("RGB", [pm.width, pm.height], pm.samples)
-        output_imgs.append(convert_image_to_base64(img))
-
-    return output_imgs
-
+    render = partial(
+        _render_pages, str(file_path), dpi=dpi, format=format, quality=quality
+    )
+    pages = list(pages)
+    pool = _pool if max_workers > 1 else None
+    if pool is None or len(pages) <= _PAGES_PER_TASK:
+        return render(pages)
+
+    batches = [
+        pages[idx : idx + _PAGES_PER_TASK]
+        for idx in range(0, len(pages), _PAGES_PER_TASK)
+    ]
+    try:
+        return [img for imgs in pool.map(render, batches) for img in imgs]
+    except BrokenProcessPool:
+        # a worker died, e.g. killed for memory, render in-process instead
+        _reset_pool()
+        return render(pages)
+
+
+def convert_image_to_base64(
+    img: Image.Image, format: str = "PNG", quality: int = PDF_THUMBNAIL_QUALITY
+) -> str:
+    format = format.upper()
+    if format not in _MIME_TYPES:
+        raise ValueError(
+            f"Unsupported thumbnail format {format}, should be one of "
+            f"{', '.join(_MIME_TYPES)}"
+        )
 
-def convert_image_to_base64(img: Image.Image) -> str:
     # convert the image into base64
     img_bytes = BytesIO()
-    img.save(img_bytes, format="PNG")
+    if format == "PNG":
+        img.save(img_bytes, format=format)
+    else:
+        img.save(img_bytes, format=format, quality=quality)
     img_base64 = base64.b64encode(img_bytes.getvalue()).decode("utf-8")
-    img_base64 = f"data:image/png;base64,{img_base64}"
+    img_base64 = f"data:{_MIME_TYPES[format]};base64,{img_base64}"
 
     return img_base64
 
 
+def get_lazy_page_thumbnails(file_path: Path, pages: list[int]) -> List[str]:
+    """Get references to the page thumbnails, rendered on first access
+
+    The PDF file is copied into the blob store, the thumbnails are then rendered
+    from it when `resolve_blob_url` is called on their references.
+
+    Args:
+        file_path (Path): path to the PDF file
+        pages (list[int]): list of page numbers
+
+    Returns:
+        list[str]: the blob URLs of the page thumbnails
+    """
+    blob_store = get_blob_store()
+    if blob_store is None:
+        raise ValueError("Lazy page thumbnails require KH_BLOB_STORE_DIR")
+
+    url = blob_store.put(Path(file_path).read_bytes(), ".pdf")
+    return [f"{url}#page={page_number}" for page_number in pages]
+
+
 class PDFThumbnailReader(PDFReader):
     """PDF parser with thumbnail for each page."""
 
-    def __init__(self) -> None:
+    def __init__(self, lazy_thumbnails: bool = PDF_THUMBNAIL_LAZY) -> None:
         """
         Initialize PDFReader.
         """
         super().__init__(return_full_document=False)
+        self.lazy_thumbnails = lazy_thumbnails and get_blob_store() is not None
 
     def load_data(
         self,
@@ -94,7 +227,10 @@ class PDFThumbnailReader(PDFReader):
         page_numbers = list(range(len(page_numbers_str)))
 
         print("Page numbers:", len(page_numbers))
-        page_thumbnails = get_page_thumbnails(file, page_numbers)
+        if self.lazy_thumbnails:
+            page_thumbnails = get_lazy_page_thumbnails(file, page_numbers)
+        else:
+            page_thumbnails = get_page_thumbnails(file, page_numbers)
 
         documents.extend(
             [
@@ -1,3 +1,5 @@
+from .blob_store import BlobStore, get_blob_store, is_blob_url, resolve_blob_url
+from .chunk_archive import ChunkArchive, get_chunk_archive
 from .docstores import (
     BaseDocumentStore,
     ElasticsearchDocumentStore,
@@ -8,7 +10,9 @@ from .docstores import (
 from .vectorstores import (
     BaseVectorStore,
     ChromaVectorStore,
+    FlatVectorStore,
     InMemoryVectorStore,
+    IVFVectorStore,
     LanceDBVectorStore,
     MilvusVectorStore,
     QdrantVectorStore,
@@ -25,9 +29,19 @@ __all__ = [
     # Vector stores
     "BaseVectorStore",
     "ChromaVectorStore",
+    "FlatVectorStore",
     "InMemoryVectorStore",
+    "IVFVectorStore",
     "SimpleFileVectorStore",
     "LanceDBVectorStore",
     "MilvusVectorStore",
     "QdrantVectorStore",
+    # Chunk archive
+    "ChunkArchive",
+    "get_chunk_archive",
+    # Blob store
+    "BlobStore",
+    "get_blob_store",
+    "is_blob_url",
+    "resolve_blob_url",
 ]
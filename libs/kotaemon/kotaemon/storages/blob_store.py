@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import base64
+import mimetypes
+import os
+import tempfile
+import threading
+from hashlib import sha256
+from pathlib import Path
+from typing import Optional
+
+from theflow.settings import settings as flowsettings
+
+from kotaemon.base import Document
+
+BLOB_URL_PREFIX = "kh-blob://"
+
+
+def is_blob_url(value) -> bool:
+    """Check if the value is a reference to a blob in the blob store"""
+    return isinstance(value, str) and value.startswith(BLOB_URL_PREFIX)
+
+
+class BlobStore:
+    """Store binary content, e.g. images, as files named by their content hash
+
+    The content is referenced by a URL like `kh-blob://<sha256>.png`, that can be
+    kept in the document metadata instead of the content itself. The same
+    content is only stored once.
+
+    A page of a stored PDF file is referenced as `kh-blob://<sha256>.pdf#page=N`.
+    Its thumbnail is rendered the first time it is resolved, then kept in the
+    store.
+
+    Args:
+        path: the folder of the blob store
+    """
+
+    def __init__(self, path: str | Path):
+        self._path = Path(path)
+        self._path.mkdir(parents=True, exist_ok=True)
+
+    def _file(self, url: str) -> Path:
+        name = url[len(BLOB_URL_PREFIX) :].partition("#")[0]
+        if not is_blob_url(url) or "/" in name or "\\" in name:
+            raise ValueError(f"Invalid blob URL: {url}")
+        return self._path / name[:2] / name
+
+    def put(self, data: bytes, extension: str = "") -> str:
+        """Store the content and return its URL
+
+        Args:
+            data: the content
+            extension: the file extension of the content, e.g. ".png"
+
+        Returns:
+            the URL of the content
+        """
+        url = f"{BLOB_URL_PREFIX}{sha256(data).hexdigest()}{extension}"
+        file = self._file(url)
+        if not file.exists():
+            self._write(file, data)
+        return url
+
+    def _write(self, file: Path, data: bytes):
+        file.parent.mkdir(parents=True, exist_ok=True)
+        # write to a temporary file first, so that readers never see a
+        # partially written blob
+        fd, tmp_path = tempfile.mkstemp(dir=file.parent)
+        with os.fdopen(fd, "wb") as fo:
+            fo.write(data)
+        os.replace(tmp_path, file)
+
+    def get(self, url: str) -> bytes:
+        """Get the content of a URL"""
+        return self._file(url).read_bytes()
+
+    def exists(self, url: str) -> bool:
+        """Check if the content of a URL is stored"""
+        return self._file(url).exists()
+
+    def delete(self, url: str):
+        """Delete the content of a URL, with the page thumbnails rendered from it
+
+        The content is shared by every URL with the same hash, so only delete it
+        once nothing references it anymore.
+        """
+        file = self._file(url)
+        for thumbnail_file in file.parent.glob(f"{file.name}.page*"):
+            thumbnail_file.unlink(missing_ok=True)
+        file.unlink(missing_ok=True)
+
+    def put_data_url(self, data_url: str) -> str:
+        """Store the content of a base64 data URL and return its blob URL"""
+        header, _, data = data_url.partition(",")
+        mime_type = header[len("data:") :].split(";")[0]
+        extension = mimetypes.guess_extension(mime_type) or ""
+        return self.put(base64.b64decode(data), extension)
+
+    def to_data_url(self, url: str) -> str:
+        """Get the content of a URL as a base64 data URL"""
+        url, _, fragment = url.partition("#")
+        if fragment.startswith("page="):
+            return self._page_thumbnail(url, int(fragment[len("page=") :]))
+
+        mime_type = mimetypes.guess_type(url)[0] or "application/octet-stream"
+        data = base64.b64encode(self.get(url)).decode("utf-8")
+        return f"data:{mime_type};base64,{data}"
+
+    def _page_thumbnail(self, url: str, page_number: int) -> str:
+        thumbnail_file = self._file(f"{url}.page{page_number}")
+        if not thumbnail_file.exists():
+            from kotaemon.loaders.pdf_loader import get_page_thumbnails
+
+            thumbnail = get_page_thumbnails(
+                self._file(url), [page_number], max_workers=1
+            )[0]
+            self._write(thumbnail_file, thumbnail.encode("utf-8"))
+        return thumbnail_file.read_text(encoding="utf-8")
+
+    def offload(self, docs: list[Document], keys: tuple[str, ...] = ("image_origin",)):
+        """Move the base64 data URLs in the metadata of the docs to the store
+
+        The data URLs are replaced by their blob URLs in place.
+
+        Args:
+            docs: the docs
+            keys: the metadata keys that can hold data URLs
+        """
+        for doc in docs:
+            for key in keys:
+                value = doc.metadata.get(key)
+                if isinstance(value, str) and value.startswith("data:"):
+                    doc.metadata[key] = self.put_data_url(value)
+
+
+_stores: dict[str, BlobStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_blob_store(path: Optional[str | Path] = None) -> Optional[BlobStore]:
+    """Get the blob store at the path, shared within the process
+
+    Args:
+        path: the folder of the blob store, default to `KH_BLOB_STORE_DIR`
+
+    Returns:
+        the blob store, or None if no path is given or configured
+    """
+    path = path or getattr(flowsettings, "KH_BLOB_STORE_DIR", None)
+    if not path:
+        return None
+
+    key = str(Path(path).resolve())
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = BlobStore(path)
+        return _stores[key]
+
+
+def resolve_blob_url(value: str) -> str:
+    """Get the data URL of a blob URL, other values are returned as is
+
+    Use this right before the content is needed, e.g. to render an image or to
+    send it to a multimodal model.
+    """
+    if not is_blob_url(value):
+        return value
+
+    store = get_blob_store()
+    if store is None:
+        raise ValueError("KH_BLOB_STORE_DIR is not set, cannot resolve blob URLs")
+    return store.to_data_url(value)
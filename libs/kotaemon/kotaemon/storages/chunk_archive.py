@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+import json
+import logging
+import queue
+import re
+import threading
+from array import array
+from pathlib import Path
+from typing import Iterator, Optional
+
+from kotaemon.base import Document
+
+from .blob_store import resolve_blob_url
+
+logger = logging.getLogger(__name__)
+
+# size in bytes of an entry of the offset index
+_OFFSET_SIZE = array("Q").itemsize
+
+
+def chunk_to_markdown(chunk: Document) -> str:
+    """Render a chunk and its main metadata as markdown"""
+    metadata = chunk.metadata
+    content = ""
+    if "page_label" in metadata:
+        content += f"Page label: {metadata['page_label']}"
+    if "file_name" in metadata:
+        content += f"\nFile name: {metadata['file_name']}"
+    if "section" in metadata:
+        content += f"\nSection: {metadata['section']}"
+    if metadata.get("type") == "image":
+        image_url = resolve_blob_url(metadata.get("image_origin", ""))
+        image_origin = f'<p><img src="{image_url}"></p>'
+        content += f"\nImage origin: {image_origin}"
+    if chunk.text:
+        content += f"\ntext:\n{chunk.text}"
+    return content
+
+
+class ChunkArchive:
+    """Store the chunks of each source in a single append-only file
+
+    Each source (usually an indexed file) has 3 files in the archive folder:
+        - `<source>.chunks`: the chunks, one JSON record per line
+        - `<source>.offsets`: the byte offset of each record, as 8-byte integers,
+        so that any range of chunks can be read without scanning the file
+        - `<source>.removed`: the ids of the chunks removed after they were
+        archived, one per line, each with the number of chunks archived at the
+        time, so that a chunk archived again later with the same id is kept
+
+    The writes happen in a background thread in the order they are requested, so
+    that archiving doesn't slow down indexing. Call `flush` to wait for them.
+
+    Args:
+        path: the folder of the archive
+    """
+
+    def __init__(self, path: str | Path):
+        self._path = Path(path)
+        self._path.mkdir(parents=True, exist_ok=True)
+        self._queue: queue.Queue = queue.Queue()
+        self._writer = threading.Thread(
+            target=self._write_loop, name="chunk-archive", daemon=True
+        )
+        self._writer.start()
+
+    def _files(self, source: str) -> tuple[Path, Path, Path]:
+        name = re.sub(r"[^\w.-]", "_", source)
+        return (
+            self._path / f"{name}.chunks",
+            self._path / f"{name}.offsets",
+            self._path / f"{name}.removed",
+        )
+
+    def append(self, source: str, chunks: list[Document]):
+        """Add the chunks to the archive of a source, in the background"""
+        records = [
+            json.dumps(
+                {"id": chunk.doc_id, "text": chunk.text, "metadata": chunk.metadata},
+                ensure_ascii=False,
+                default=str,
+            )
+            for chunk in chunks
+        ]
+        self._queue.put((self._append, source, records))
+
+    def remove(self, source: str, chunk_ids: list[str]):
+        """Mark some chunks of a source as removed, in the background"""
+        self._queue.put((self._remove, source, list(chunk_ids)))
+
+    def delete(self, source: str):
+        """Delete the archive of a source, in the background"""
+        self._queue.put((self._delete, source))
+
+    def flush(self):
+        """Wait for the pending writes to finish"""
+        self._queue.join()
+
+    def exists(self, source: str) -> bool:
+        """Check if the source has archived chunks"""
+        return self._files(source)[0].exists()
+
+    def count(self, source: str) -> int:
+        """Get the number of archived chunks of a source, including removed ones"""
+        offsets_file = self._files(source)[1]
+        if not offsets_file.exists():
+            return 0
+        return offsets_file.stat().st_size // _OFFSET_SIZE
+
+    def read(
+        self, source: str, start: int = 0, stop: Optional[int] = None
+    ) -> Iterator[Document]:
+        """Read the archived chunks of a source, skipping the removed ones
+
+        Args:
+            source: the source
+            start: the position of the first chunk to read
+            stop: the position after the last chunk to read, or None to read to
+                the end
+
+        Yields:
+            the chunks, in the order they were archived
+        """
+        chunks_file, offsets_file, removed_file = self._files(source)
+        if not chunks_file.exists():
+            return
+
+        # the chunks archived before this position are removed, by id
+        removed: dict[str, float] = {}
+        if removed_file.exists():
+            with removed_file.open(encoding="utf-8") as fi:
+                for line in fi:
+                    chunk_id, *position = line.split()
+                    removed[chunk_id] = max(
+                        removed.get(chunk_id, 0),
+                        int(position[0]) if position else float("inf"),
+                    )
+
+        start_offset = 0
+        if start:
+            with offsets_file.open("rb") as fi:
+                fi.seek(start * _OFFSET_SIZE)
+                offset = array("Q")
+                offset.frombytes(fi.read(_OFFSET_SIZE))
+                if not offset:
+                    return
+                start_offset = offset[0]
+
+        n_chunks = None if stop is None else stop - start
+        with chunks_file.open("rb") as fi:
+            fi.seek(start_offset)
+            for idx, line in enumerate(fi):
+                if n_chunks is not None and idx >= n_chunks:
+                    break
+                record = json.loads(line)
+                if start + idx < removed.get(record["id"], 0):
+                    continue
+                yield Document(
+                    id_=record["id"], text=record["text"], metadata=record["metadata"]
+                )
+
+    def export_markdown(self, source: str) -> Iterator[str]:
+        """Render the archived chunks of a source as markdown, chunk by chunk"""
+        for chunk in self.read(source):
+            yield chunk_to_markdown(chunk) + "\n\n---\n\n"
+
+    def _write_loop(self):
+        while True:
+            func, *args = self._queue.get()
+            try:
+                func(*args)
+            except Exception as e:
+                logger.exception(e)
+            finally:
+                self._queue.task_done()
+
+    def _append(self, source: str, records: list[str]):
+        chunks_file, offsets_file, _ = self._files(source)
+        offsets = array("Q")
+        with chunks_file.open("ab") as fo:
+            for record in records:
+                offsets.append(fo.tell())
+                fo.write(record.encode("utf-8") + b"\n")
+        with offsets_file.open("ab") as fo:
+            fo.write(offsets.tobytes())
+
+    def _remove(self, source: str, chunk_ids: list[str]):
+        removed_file = self._files(source)[2]
+        position = self.count(source)
+        with removed_file.open("a", encoding="utf-8") as fo:
+            fo.writelines(f"{chunk_id} {position}\n" for chunk_id in chunk_ids)
+
+    def _delete(self, source: str):
+        for file in self._files(source):
+            file.unlink(missing_ok=True)
+
+
+_archives: dict[str, ChunkArchive] = {}
+_archives_lock = threading.Lock()
+
+
+def get_chunk_archive(path: str | Path) -> ChunkArchive:
+    """Get the chunk archive at the path, shared within the process"""
+    key = str(Path(path).resolve())
+    with _archives_lock:
+        if key not in _archives:
+            _archives[key] = ChunkArchive(path)
+        return _archives[key]
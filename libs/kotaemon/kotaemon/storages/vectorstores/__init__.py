@@ -1,6 +1,8 @@
 from .base import BaseVectorStore
 from .chroma import ChromaVectorStore
+from .flat import FlatVectorStore
 from .in_memory import InMemoryVectorStore
+from .ivf import IVFVectorStore
 from .lancedb import LanceDBVectorStore
 from .milvus import MilvusVectorStore
 from .qdrant import QdrantVectorStore
@@ -9,7 +11,9 @@ from .simple_file import SimpleFileVectorStore
 __all__ = [
     "BaseVectorStore",
     "ChromaVectorStore",
+    "FlatVectorStore",
     "InMemoryVectorStore",
+    "IVFVectorStore",
     "SimpleFileVectorStore",
     "LanceDBVectorStore",
     "MilvusVectorStore",
@@ -12,6 +12,11 @@ from kotaemon.base import DocumentWithEmbedding
 
 
 class BaseVectorStore(ABC):
+    # whether `query` applies the llama-index `MetadataFilters` passed as `filters`
+    # on the metadata of the embeddings, so the scope of a query can be given by
+    # the filters instead of the ids of the embeddings
+    supports_filters: bool = False
+
     @abstractmethod
     def __init__(self, *args, **kwargs):
         ...
@@ -71,6 +76,19 @@ class BaseVectorStore(ABC):
         """Drop the vector store"""
         ...
 
+    def get_embeddings(self, ids: list[str]) -> tuple[list[str], list[list[float]]]:
+        """Get the stored vector embeddings by id
+
+        Args:
+            ids: List of ids of the embeddings to get
+
+        Returns:
+            the ids found in the vector store, and their embeddings
+        """
+        raise NotImplementedError(
+            f"{self.__class__.__name__} can't get the embeddings by id"
+        )
+
 
 class LlamaIndexVectorStore(BaseVectorStore):
     """Mixin for LlamaIndex based vectorstores"""
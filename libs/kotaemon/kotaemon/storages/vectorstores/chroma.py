@@ -1,4 +1,4 @@
-from typing import Any, Dict, List, Optional, Type, cast
+from typing import Any, Dict, List, Optional, Tuple, Type, cast
 
 from llama_index.vector_stores.chroma import ChromaVectorStore as LIChromaVectorStore
 
@@ -7,6 +7,7 @@ from .base import LlamaIndexVectorStore
 
 class ChromaVectorStore(LlamaIndexVectorStore):
     _li_class: Type[LIChromaVectorStore] = LIChromaVectorStore
+    supports_filters = True
 
     def __init__(
         self,
@@ -66,6 +67,10 @@ class ChromaVectorStore(LlamaIndexVectorStore):
         """
         self._client.client.delete(ids=ids)
 
+    def get_embeddings(self, ids: List[str]) -> Tuple[List[str], List[List[float]]]:
+        result = self._client.client.get(ids=ids, include=["embeddings"])
+        return result["ids"], [list(embedding) for embedding in result["embeddings"]]
+
     def drop(self):
         """Delete entire collection from vector stores"""
         self._client.client._client.delete_collection(self._client.client.name)
@@ -0,0 +1,570 @@
+"""Persistent flat vector store, backed by a memory-mapped NumPy matrix
+
+The vectors of a collection are the rows of a float32 matrix stored in a single
+file, which is memory-mapped for searching. Vectors are only ever appended to the
+file: deleting or replacing a vector marks its row as deleted, and the file is
+compacted once enough rows are deleted. Every change is recorded in a log, one
+JSON line per vector, from which the collection is loaded.
+
+The files of a collection, in `path/collection_name/`:
+
+- `meta.json`: the dimension of the vectors and the generation of the data files,
+    increased by every compaction
+- `vectors-<generation>.f32`: the rows of the matrix
+- `log-<generation>.jsonl`: the added and deleted vectors, with their metadata
+"""
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import threading
+import uuid
+from contextlib import suppress
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+import numpy as np
+from llama_index.core.vector_stores.types import FilterCondition, MetadataFilters
+
+from kotaemon.base import DocumentWithEmbedding
+
+from .base import BaseVectorStore
+
+
+def _compare(op: Callable[[Any, Any], bool]) -> Callable[[Any, Any], bool]:
+    def compare(value, target) -> bool:
+        try:
+            return value is not None and op(value, target)
+        except TypeError:
+            return False
+
+    return compare
+
+
+_OPERATORS: dict[str, Callable[[Any, Any], bool]] = {
+    "==": lambda value, target: value == target,
+    "!=": lambda value, target: value != target,
+    ">": _compare(lambda value, target: value > target),
+    ">=": _compare(lambda value, target: value >= target),
+    "<": _compare(lambda value, target: value < target),
+    "<=": _compare(lambda value, target: value <= target),
+    "in": lambda value, target: value in target,
+    "nin": lambda value, target: value not in target,
+    "text_match": lambda value, target: isinstance(value, str) and target in value,
+}
+
+
+def compile_filters(filters: MetadataFilters) -> Callable[[dict], bool]:
+    """Compile llama-index metadata filters to a function matching a metadata dict
+
+    Args:
+        filters: the filters, possibly nested
+
+    Returns:
+        a function returning whether the metadata matches the filters
+    """
+    matchers: list[Callable[[dict], bool]] = []
+    for filter_ in filters.filters:
+        if isinstance(filter_, MetadataFilters):
+            matchers.append(compile_filters(filter_))
+            continue
+
+        operator = getattr(filter_.operator, "value", filter_.operator)
+        if operator not in _OPERATORS:
+            raise ValueError(f"Unsupported metadata filter operator: {operator}")
+
+        target = filter_.value
+        if operator in ("in", "nin"):
+            target = set(target)  # type: ignore[arg-type]
+
+        def matcher(metadata, key=filter_.key, op=_OPERATORS[operator], target=target):
+            return op(metadata.get(key), target)
+
+        matchers.append(matcher)
+
+    if filters.condition == FilterCondition.OR:
+        return lambda metadata: any(matcher(metadata) for matcher in matchers)
+    return lambda metadata: all(matcher(metadata) for matcher in matchers)
+
+
+class FlatVectorStore(BaseVectorStore):
+    """Vector store backed by a float32 matrix in a memory-mapped file
+
+    Adding or deleting vectors costs in proportion to the batch, not to the size
+    of the store, as the vectors are appended to the file and deleted vectors
+    are only marked as deleted. The file is compacted once the deleted rows are
+    more than `compact_ratio` of it.
+
+    Queries are exact: the cosine similarity of the query to every vector in
+    scope is computed with vectorized matrix products, and the top-k are kept.
+    Metadata filters are applied before scoring, and filters selecting files by
+    `file_id` are looked up in an index of the rows of each file.
+
+    Only one process should write to a collection at a time. The other processes
+    see its changes on their next call.
+
+    Args:
+        path: the folder of the collections
+        collection_name: the name of the collection
+        compact_ratio: the fraction of deleted rows above which the file is
+            compacted
+        compact_min_rows: the minimum number of deleted rows before compacting
+        batch_size: the number of rows scored, or copied, at a time
+    """
+
+    supports_filters = True
+
+    def __init__(
+        self,
+        path: str | Path = "./flat_vectorstore",
+        collection_name: str = "default",
+        compact_ratio: float = 0.3,
+        compact_min_rows: int = 1000,
+        batch_size: int = 65536,
+        **kwargs: Any,
+    ):
+        self._path = path
+        self._collection_name = collection_name
+        self._folder = Path(path) / collection_name
+        self._meta_path = self._folder / "meta.json"
+        self.compact_ratio = compact_ratio
+        self.compact_min_rows = compact_min_rows
+        self.batch_size = batch_size
+
+        self._lock = threading.RLock()
+        self._reset()
+        self._refresh()
+
+    def _reset(self):
+        """Forget the loaded state of the collection"""
+        self._dim: Optional[int] = None
+        self._generation = 0
+        self._meta_key: Optional[tuple] = None
+        self._log_offset = 0
+        self._n_rows = 0
+        # by row: the id and the metadata of the vector, None if deleted
+        self._ids: list[Optional[str]] = []
+        self._metadata: list[Optional[dict]] = []
+        self._rows: dict[str, int] = {}
+        # the rows of each file_id in the metadata, to pre-filter by file
+        self._file_rows: dict[str, set[int]] = {}
+        self._alive = np.zeros(0, dtype=bool)
+        self._norms = np.zeros(0, dtype=np.float32)
+        self._matrix: Optional[np.memmap] = None
+
+    @property
+    def _vectors_path(self) -> Path:
+        return self._folder / f"vectors-{self._generation}.f32"
+
+    @property
+    def _log_path(self) -> Path:
+        return self._folder / f"log-{self._generation}.jsonl"
+
+    def _write_meta(self):
+        tmp_path = self._meta_path.with_suffix(".tmp")
+        meta = {"dim": self._dim, "generation": self._generation}
+        tmp_path.write_text(json.dumps(meta))
+        os.replace(tmp_path, self._meta_path)
+        stat = os.stat(self._meta_path)
+        self._meta_key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _refresh(self):
+        """Load the changes made to the collection since the last call"""
+        try:
+            stat = os.stat(self._meta_path)
+        except FileNotFoundError:
+            if self._dim is not None:
+                # dropped by another instance
+                self._reset()
+            return
+
+        meta_key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if meta_key != self._meta_key:
+            meta = json.loads(self._meta_path.read_text())
+            if self._dim is None or meta["generation"] != self._generation:
+                # first load, or compacted by another instance
+                self._reset()
+                self._dim, self._generation = meta["dim"], meta["generation"]
+            self._meta_key = meta_key
+
+        try:
+            if os.path.getsize(self._log_path) <= self._log_offset:
+                return
+        except FileNotFoundError:
+            return
+
+        with open(self._log_path, "rb") as f:
+            f.seek(self._log_offset)
+            data = f.read()
+
+        # a last line without newline is an interrupted write, ignore it
+        end = data.rfind(b"\n") + 1
+        start_row = self._n_rows
+        for line in data[:end].splitlines():
+            if line.strip():
+                self._apply(json.loads(line))
+        self._log_offset += end
+
+        matrix = self._get_matrix()
+        for start in range(start_row, self._n_rows, self.batch_size):
+            stop = min(start + self.batch_size, self._n_rows)
+            self._norms[start:stop] = np.linalg.norm(matrix[start:stop], axis=1)
+
+    def _apply(self, record: dict):
+        """Apply a record of the log"""
+        row = self._rows.pop(record["id"], None)
+        if row is not None:
+            self._delete_row(row)
+        if not record.get("deleted"):
+            self._add_row(record["row"], record["id"], record.get("metadata") or {})
+
+    def _add_row(self, row: int, id_: str, metadata: dict):
+        if row >= len(self._alive):
+            capacity = max(row + 1, 2 * len(self._alive), 1024)
+            self._alive = np.resize(self._alive, capacity)
+            self._alive[self._n_rows :] = False
+            self._norms = np.resize(self._norms, capacity)
+
+        if row >= len(self._ids):
+            self._ids.extend([None] * (row + 1 - len(self._ids)))
+            self._metadata.extend([None] * (row + 1 - len(self._metadata)))
+        self._ids[row] = id_
+        self._metadata[row] = metadata
+        if "file_id" in metadata:
+            self._file_rows.setdefault(metadata["file_id"], set()).add(row)
+        self._alive[row] = True
+        self._rows[id_] = row
+        self._n_rows = max(self._n_rows, row + 1)
+
+    def _delete_row(self, row: int):
+        file_id = (self._metadata[row] or {}).get("file_id")
+        if file_id in self._file_rows:
+            self._file_rows[file_id].discard(row)
+            if not self._file_rows[file_id]:
+                del self._file_rows[file_id]
+        self._ids[row] = None
+        self._metadata[row] = None
+        self._alive[row] = False
+
+    def _get_matrix(self) -> np.ndarray:
+        """Get the memory-mapped matrix of all the rows"""
+        if self._matrix is None or len(self._matrix) != self._n_rows:
+            self._matrix = None
+            if not self._n_rows:
+                return np.zeros((0, self._dim or 0), dtype=np.float32)
+            self._matrix = np.memmap(
+                self._vectors_path,
+                dtype=np.float32,
+                mode="r",
+                shape=(self._n_rows, self._dim),
+            )
+        return self._matrix
+
+    def _write_log(self, records: list[dict]):
+        data = b"".join(
+            json.dumps(record, default=str).encode("utf-8") + b"\n"
+            for record in records
+        )
+        with open(self._log_path, "r+b" if self._log_path.exists() else "wb") as f:
+            # drop the interrupted write, if any
+            f.seek(self._log_offset)
+            f.truncate()
+            f.write(data)
+        self._log_offset += len(data)
+
+    def _maybe_compact(self):
+        n_deleted = self._n_rows - len(self._rows)
+        if (
+            n_deleted >= self.compact_min_rows
+            and n_deleted > self.compact_ratio * self._n_rows
+        ):
+            self.compact()
+
+    def add(
+        self,
+        embeddings: list[list[float]] | list[DocumentWithEmbedding],
+        metadatas: Optional[list[dict]] = None,
+        ids: Optional[list[str]] = None,
+    ) -> list[str]:
+        if not embeddings:
+            return []
+
+        if isinstance(embeddings[0], list):
+            vectors = embeddings
+            if ids is None:
+                ids = [str(uuid.uuid4()) for _ in embeddings]
+        else:
+            docs: list[DocumentWithEmbedding] = embeddings  # type: ignore
+            vectors = [doc.embedding for doc in docs]
+            if ids is None:
+                ids = [doc.doc_id for doc in docs]
+            if metadatas is None:
+                metadatas = [doc.metadata for doc in docs]
+        metadatas = metadatas or [{} for _ in ids]
+
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if matrix.ndim != 2:
+            raise ValueError("The embeddings must all have the same dimension")
+
+        with self._lock:
+            self._refresh()
+            if self._dim is None:
+                self._folder.mkdir(parents=True, exist_ok=True)
+                self._dim = matrix.shape[1]
+                self._write_meta()
+            elif matrix.shape[1] != self._dim:
+                raise ValueError(
+                    f"Expected embeddings of dimension {self._dim}, "
+                    f"got {matrix.shape[1]}"
+                )
+
+            start_row = self._n_rows
+            path = self._vectors_path
+            with open(path, "r+b" if path.exists() else "wb") as f:
+                # overwrite the rows of an interrupted write, if any
+                f.seek(start_row * self._dim * matrix.itemsize)
+                f.write(matrix.tobytes())
+
+            records = [
+                {
+                    "id": id_,
+                    "row": start_row + idx,
+                    "metadata": {
+                        key: value
+                        for key, value in (metadata or {}).items()
+                        if isinstance(value, (str, int, float, bool, type(None)))
+                    },
+                }
+                for idx, (id_, metadata) in enumerate(zip(ids, metadatas))
+            ]
+            self._write_log(records)
+            for record in records:
+                self._apply(record)
+            self._norms[start_row : self._n_rows] = np.linalg.norm(matrix, axis=1)
+
+            self._maybe_compact()
+
+        return ids
+
+    def delete(self, ids: list[str], **kwargs):
+        """Delete vector embeddings from vector stores
+
+        Args:
+            ids: List of ids of the embeddings to be deleted
+            kwargs: meant for vectorstore-specific parameters
+        """
+        with self._lock:
+            self._refresh()
+            records = [
+                {"id": id_, "deleted": True}
+                for id_ in dict.fromkeys(ids)
+                if id_ in self._rows
+            ]
+            if not records:
+                return
+
+            self._write_log(records)
+            for record in records:
+                self._apply(record)
+
+            self._maybe_compact()
+
+    def query(
+        self,
+        embedding: list[float],
+        top_k: int = 1,
+        ids: Optional[list[str]] = None,
+        **kwargs,
+    ) -> tuple[list[list[float]], list[float], list[str]]:
+        """Return the top k most similar vector embeddings
+
+        Args:
+            embedding: List of embeddings
+            top_k: Number of most similar embeddings to return
+            ids: List of ids of the embeddings to be queried
+            kwargs: `filters`, llama-index `MetadataFilters` on the metadata of
+                the embeddings. Other query parameters are ignored.
+
+        Returns:
+            the matched embeddings, the similarity scores, and the ids
+        """
+        query = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            self._refresh()
+            if not self._rows or top_k <= 0:
+                return [], [], []
+            self._check_query(query)
+
+            rows = self._select_rows(ids, kwargs.get("filters"))
+            return self._top_k(rows, query, top_k)
+
+    def _check_query(self, query: np.ndarray):
+        if query.shape != (self._dim,):
+            raise ValueError(
+                f"Expected a query of dimension {self._dim}, got {query.shape}"
+            )
+
+    def _select_rows(
+        self, ids: Optional[list[str]], filters: Optional[MetadataFilters]
+    ) -> np.ndarray:
+        """Get the sorted rows of the given ids, or of all vectors, that match the
+        filters
+        """
+        if ids is not None:
+            rows = np.unique(
+                np.fromiter(
+                    (self._rows[id_] for id_ in ids if id_ in self._rows),
+                    dtype=np.int64,
+                )
+            )
+        else:
+            rows = np.flatnonzero(self._alive[: self._n_rows])
+
+        if filters is None or not filters.filters:
+            return rows
+
+        file_ids = self._get_filtered_file_ids(filters)
+        if file_ids is not None:
+            # pre-filter with the rows of the files, without looking at the
+            # metadata of every row
+            file_rows = [
+                row for file_id in file_ids for row in self._file_rows.get(file_id, ())
+            ]
+            return np.intersect1d(rows, np.asarray(file_rows, dtype=np.int64))
+
+        match = compile_filters(filters)
+        return rows[
+            np.fromiter(
+                (match(self._metadata[row]) for row in rows),  # type: ignore
+                dtype=bool,
+                count=len(rows),
+            )
+        ]
+
+    @staticmethod
+    def _get_filtered_file_ids(filters: MetadataFilters) -> Optional[list[str]]:
+        """Get the file ids if the filters only select files by id"""
+        if len(filters.filters) != 1:
+            return None
+
+        filter_ = filters.filters[0]
+        if isinstance(filter_, MetadataFilters) or filter_.key != "file_id":
+            return None
+
+        operator = getattr(filter_.operator, "value", filter_.operator)
+        if operator == "==":
+            return [filter_.value]  # type: ignore
+        if operator == "in":
+            return list(filter_.value)  # type: ignore
+        return None
+
+    def _score_rows(self, rows: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """Get the cosine similarity of the query to the vectors of the rows"""
+        matrix = self._get_matrix()
+        scores = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), self.batch_size):
+            batch = rows[start : start + self.batch_size]
+            if batch[-1] - batch[0] + 1 == len(batch):
+                # contiguous rows, read them as a slice of the file
+                vectors = matrix[batch[0] : batch[-1] + 1]
+            else:
+                vectors = matrix[batch]
+            scores[start : start + len(batch)] = vectors @ query
+
+        norms = self._norms[rows] * np.linalg.norm(query)
+        return np.divide(scores, norms, out=np.zeros_like(scores), where=norms > 0)
+
+    def _top_k(
+        self, rows: np.ndarray, query: np.ndarray, top_k: int
+    ) -> tuple[list[list[float]], list[float], list[str]]:
+        """Get the top k most similar vectors among the rows"""
+        if not len(rows):
+            return [], [], []
+
+        scores = self._score_rows(rows, query)
+        k = min(top_k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        top_rows = rows[top]
+
+        return (
+            self._get_matrix()[top_rows].tolist(),
+            scores[top].tolist(),
+            [self._ids[row] for row in top_rows],  # type: ignore
+        )
+
+    def get_embeddings(self, ids: list[str]) -> tuple[list[str], list[list[float]]]:
+        with self._lock:
+            self._refresh()
+            found = [id_ for id_ in ids if id_ in self._rows]
+            if not found:
+                return [], []
+            rows = [self._rows[id_] for id_ in found]
+            return found, self._get_matrix()[rows].tolist()
+
+    def compact(self):
+        """Rewrite the files of the collection without the deleted vectors"""
+        with self._lock:
+            self._refresh()
+            if self._dim is None or len(self._rows) == self._n_rows:
+                return
+
+            live = np.flatnonzero(self._alive[: self._n_rows])
+            matrix = self._get_matrix()
+            old_paths = [self._vectors_path, self._log_path]
+            generation = self._generation + 1
+
+            vectors_path = self._folder / f"vectors-{generation}.f32"
+            with open(vectors_path, "wb") as f:
+                for start in range(0, len(live), self.batch_size):
+                    f.write(
+                        np.ascontiguousarray(
+                            matrix[live[start : start + self.batch_size]]
+                        ).tobytes()
+                    )
+            del matrix
+
+            ids = [self._ids[row] for row in live]
+            metadata = [self._metadata[row] for row in live]
+            norms = self._norms[live]
+            log_path = self._folder / f"log-{generation}.jsonl"
+            with open(log_path, "wb") as f:
+                for row, (id_, metadata_) in enumerate(zip(ids, metadata)):
+                    record = {"id": id_, "row": row, "metadata": metadata_}
+                    f.write(json.dumps(record, default=str).encode("utf-8") + b"\n")
+                log_offset = f.tell()
+
+            dim = self._dim
+            self._reset()
+            self._dim, self._generation = dim, generation
+            self._write_meta()
+            for row, (id_, metadata_) in enumerate(zip(ids, metadata)):
+                self._add_row(row, id_, metadata_)  # type: ignore
+            self._norms[: len(norms)] = norms
+            self._log_offset = log_offset
+
+            for path in old_paths:
+                # still mapped by another instance on some platforms
+                with suppress(OSError):
+                    path.unlink()
+
+    def count(self) -> int:
+        with self._lock:
+            self._refresh()
+            return len(self._rows)
+
+    def drop(self):
+        """Delete the collection"""
+        with self._lock:
+            self._reset()
+            shutil.rmtree(self._folder, ignore_errors=True)
+
+    def __persist_flow__(self):
+        return {
+            "path": str(self._path),
+            "collection_name": self._collection_name,
+            "compact_ratio": self.compact_ratio,
+            "compact_min_rows": self.compact_min_rows,
+            "batch_size": self.batch_size,
+        }
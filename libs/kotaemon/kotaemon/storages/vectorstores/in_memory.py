@@ -53,6 +53,11 @@ class InMemoryVectorStore(LlamaIndexVectorStore):
         """
         self._client = self._client.from_persist_path(persist_path=load_path, fs=fs)
 
+    def get_embeddings(self, ids: list[str]) -> tuple[list[str], list[list[float]]]:
+        embedding_dict = self._client.data.embedding_dict
+        found = [id_ for id_ in ids if id_ in embedding_dict]
+        return found, [embedding_dict[id_] for id_ in found]
+
     def drop(self):
         """Clear the old data"""
         self._data = SimpleVectorStoreData()
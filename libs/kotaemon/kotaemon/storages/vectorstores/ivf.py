@@ -0,0 +1,262 @@
+"""Approximate nearest neighbour search over a flat vector store
+
+The vectors are partitioned into `n_lists` inverted lists, by their nearest
+centroid. The centroids are trained by spherical k-means on a sample of the
+vectors, so that the cosine similarity decides the partition. A query scores
+only the vectors of the `n_probe` lists whose centroids are the most similar to
+it: more probed lists give a better recall, at a higher latency.
+
+The index of a collection is saved in `ivf-<generation>.npz`, next to the data
+files of the flat vector store: the centroids and the list of every row.
+"""
+from __future__ import annotations
+
+import os
+from contextlib import suppress
+from pathlib import Path
+from typing import Any, Optional
+
+import numpy as np
+
+from .flat import FlatVectorStore
+
+
+def train_centroids(
+    vectors: np.ndarray, n_lists: int, n_iter: int = 20, seed: int = 0
+) -> np.ndarray:
+    """Train the centroids of the lists by spherical k-means
+
+    Args:
+        vectors: the training vectors, normalized
+        n_lists: the number of centroids
+        n_iter: the number of k-means iterations
+        seed: the seed of the random initialization
+
+    Returns:
+        the normalized centroids, one per row
+    """
+    rng = np.random.default_rng(seed)
+    n_lists = min(n_lists, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+
+    for _ in range(n_iter):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+
+        # restart the empty lists from random vectors
+        empty = np.flatnonzero(np.bincount(assignments, minlength=n_lists) == 0)
+        sums[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = np.divide(sums, norms, out=sums, where=norms > 0)
+
+    return centroids
+
+
+class IVFVectorStore(FlatVectorStore):
+    """Flat vector store with an inverted file index for approximate search
+
+    Small stores, and queries whose ids or filters select few vectors, are
+    searched exactly. Otherwise, only the vectors in the `n_probe` lists nearest
+    to the query are scored, among the selected ones.
+
+    The index is trained on the first query once the store holds more than
+    `exact_search_rows` vectors, and retrained once the store has grown
+    `retrain_factor` times since. Vectors added in between are assigned to their
+    nearest list, without retraining.
+
+    Args:
+        path: the folder of the collections
+        collection_name: the name of the collection
+        n_lists: the number of lists, by default the square root of the number
+            of vectors when trained
+        n_probe: the number of lists searched per query, can be overridden by
+            the `n_probe` query parameter
+        exact_search_rows: the number of selected vectors up to which a query
+            is searched exactly
+        retrain_factor: how many times the store grows before the index is
+            retrained
+        train_rows_per_list: the number of vectors sampled per list to train
+            the centroids
+        kwargs: the parameters of `FlatVectorStore`
+    """
+
+    def __init__(
+        self,
+        path: str | Path = "./flat_vectorstore",
+        collection_name: str = "default",
+        n_lists: Optional[int] = None,
+        n_probe: int = 8,
+        exact_search_rows: int = 10_000,
+        retrain_factor: float = 4.0,
+        train_rows_per_list: int = 64,
+        **kwargs: Any,
+    ):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.exact_search_rows = exact_search_rows
+        self.retrain_factor = retrain_factor
+        self.train_rows_per_list = train_rows_per_list
+        super().__init__(path=path, collection_name=collection_name, **kwargs)
+
+    def _reset(self):
+        super()._reset()
+        self._centroids: Optional[np.ndarray] = None
+        self._lists = np.zeros(0, dtype=np.int32)
+        self._n_assigned = 0
+        self._n_saved = 0
+        self._n_trained = 0
+
+    @property
+    def _index_path(self) -> Path:
+        return self._folder / f"ivf-{self._generation}.npz"
+
+    def _load_index(self):
+        try:
+            with np.load(self._index_path) as data:
+                centroids, lists = data["centroids"], data["lists"]
+                n_trained = int(data["n_trained"])
+        except (OSError, KeyError, ValueError):
+            return
+
+        if centroids.shape[1] != self._dim or len(lists) > self._n_rows:
+            return
+        self._centroids, self._lists, self._n_trained = centroids, lists, n_trained
+        self._n_assigned = self._n_saved = len(lists)
+
+    def _save_index(self):
+        tmp_path = self._index_path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                centroids=self._centroids,
+                lists=self._lists[: self._n_assigned],
+                n_trained=self._n_trained,
+            )
+        os.replace(tmp_path, self._index_path)
+        self._n_saved = self._n_assigned
+
+    def _train(self):
+        live = np.flatnonzero(self._alive[: self._n_rows])
+        n_lists = self.n_lists or max(int(np.sqrt(len(live))), 1)
+        sample_size = min(len(live), n_lists * self.train_rows_per_list)
+        sample = np.sort(
+            np.random.default_rng(0).choice(live, sample_size, replace=False)
+        )
+
+        vectors = np.asarray(self._get_matrix()[sample])
+        norms = self._norms[sample][:, None]
+        vectors = np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+        self._centroids = train_centroids(vectors, n_lists)
+        self._n_trained = len(live)
+        self._n_assigned = self._n_saved = 0
+
+    def _assign_rows(self):
+        """Assign the rows added since the last call to their nearest list"""
+        if self._n_assigned >= self._n_rows:
+            return
+
+        if len(self._lists) < self._n_rows:
+            self._lists = np.resize(
+                self._lists, max(self._n_rows, 2 * len(self._lists))
+            )
+
+        matrix = self._get_matrix()
+        for start in range(self._n_assigned, self._n_rows, self.batch_size):
+            stop = min(start + self.batch_size, self._n_rows)
+            # the norms of the vectors don't change their nearest centroid
+            scores = matrix[start:stop] @ self._centroids.T  # type: ignore
+            self._lists[start:stop] = np.argmax(scores, axis=1)
+        self._n_assigned = self._n_rows
+
+        # save the index once a tenth of it is not saved
+        if self._n_assigned - self._n_saved > 0.1 * self._n_assigned:
+            self._save_index()
+
+    def _ensure_index(self):
+        """Load or train the index, and assign the new rows to their lists"""
+        if self._centroids is None:
+            self._load_index()
+
+        n_live = len(self._rows)
+        if self._centroids is None or n_live > self.retrain_factor * self._n_trained:
+            self._train()
+        self._assign_rows()
+
+    def query(
+        self,
+        embedding: list[float],
+        top_k: int = 1,
+        ids: Optional[list[str]] = None,
+        **kwargs,
+    ) -> tuple[list[list[float]], list[float], list[str]]:
+        """Return the top k most similar vector embeddings
+
+        Args:
+            embedding: List of embeddings
+            top_k: Number of most similar embeddings to return
+            ids: List of ids of the embeddings to be queried
+            kwargs: `filters`, llama-index `MetadataFilters` on the metadata of
+                the embeddings, and `n_probe`, the number of lists to search.
+                Other query parameters are ignored.
+
+        Returns:
+            the matched embeddings, the similarity scores, and the ids
+        """
+        query = np.asarray(embedding, dtype=np.float32)
+        n_probe = kwargs.get("n_probe") or self.n_probe
+        with self._lock:
+            self._refresh()
+            if not self._rows or top_k <= 0:
+                return [], [], []
+            self._check_query(query)
+
+            rows = self._select_rows(ids, kwargs.get("filters"))
+            if len(rows) > self.exact_search_rows:
+                self._ensure_index()
+                centroids: np.ndarray = self._centroids  # type: ignore
+                n_probe = min(n_probe, len(centroids))
+                probed = np.argpartition(-(centroids @ query), n_probe - 1)[:n_probe]
+                candidates = rows[np.isin(self._lists[rows], probed)]
+                if len(candidates) >= top_k:
+                    rows = candidates
+
+            return self._top_k(rows, query, top_k)
+
+    def compact(self):
+        """Rewrite the files of the collection without the deleted vectors
+
+        The lists of the remaining vectors are kept, so that the index doesn't
+        need to be trained again.
+        """
+        with self._lock:
+            self._refresh()
+            generation = self._generation
+            index = None
+            if self._centroids is not None:
+                self._assign_rows()
+                live = np.flatnonzero(self._alive[: self._n_rows])
+                index = (self._centroids, self._lists[live], self._n_trained)
+
+            super().compact()
+            if self._generation == generation:
+                return
+
+            with suppress(OSError):
+                (self._folder / f"ivf-{generation}.npz").unlink()
+            if index is not None:
+                self._centroids, self._lists, self._n_trained = index
+                self._n_assigned = len(self._lists)
+                self._save_index()
+
+    def __persist_flow__(self):
+        return {
+            **super().__persist_flow__(),
+            "n_lists": self.n_lists,
+            "n_probe": self.n_probe,
+            "exact_search_rows": self.exact_search_rows,
+            "retrain_factor": self.retrain_factor,
+            "train_rows_per_list": self.train_rows_per_list,
+        }
@@ -29,6 +29,7 @@ base_lancedb._to_lance_filter = custom_to_lance_filter
 
 class LanceDBVectorStore(LlamaIndexVectorStore):
     _li_class: Type[LILanceDBVectorStore] = LILanceDBVectorStore
+    supports_filters = True
 
     def __init__(
         self,
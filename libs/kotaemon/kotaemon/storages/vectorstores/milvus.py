@@ -8,6 +8,7 @@ from .base import LlamaIndexVectorStore
 
 class MilvusVectorStore(LlamaIndexVectorStore):
     _li_class = None
+    supports_filters = True
 
     def _get_li_class(self):
         try:
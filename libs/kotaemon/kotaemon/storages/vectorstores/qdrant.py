@@ -5,6 +5,7 @@ from .base import LlamaIndexVectorStore
 
 class QdrantVectorStore(LlamaIndexVectorStore):
     _li_class = None
+    supports_filters = True
 
     def _get_li_class(self):
         try:
@@ -58,6 +58,11 @@ class SimpleFileVectorStore(LlamaIndexVectorStore):
         self._client.persist(str(self._save_path), self._fs)
         return r
 
+    def get_embeddings(self, ids: list[str]) -> tuple[list[str], list[list[float]]]:
+        embedding_dict = self._client.data.embedding_dict
+        found = [id_ for id_ in ids if id_ in embedding_dict]
+        return found, [embedding_dict[id_] for id_ in found]
+
     def drop(self):
         self._data = SimpleVectorStoreData()
         self._save_path.unlink(missing_ok=True)
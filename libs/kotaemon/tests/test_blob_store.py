@@ -0,0 +1,43 @@
+import base64
+
+from kotaemon.base import Document
+from kotaemon.storages import BlobStore, is_blob_url
+
+
+def test_blob_store(tmp_path):
+    store = BlobStore(tmp_path)
+    data_url = "data:image/png;base64," + base64.b64encode(b"png bytes").decode()
+    docs = [
+        Document(
+            text="page 1", metadata={"type": "thumbnail", "image_origin": data_url}
+        ),
+        Document(text="page 2", metadata={"type": "image", "image_origin": data_url}),
+        Document(text="text", metadata={"type": "text"}),
+    ]
+    store.offload(docs)
+
+    url = docs[0].metadata["image_origin"]
+    assert is_blob_url(url) and url.endswith(".png")
+    assert docs[1].metadata["image_origin"] == url
+    assert "image_origin" not in docs[2].metadata
+    assert len([file for file in tmp_path.rglob("*") if file.is_file()]) == 1
+
+    assert store.get(url) == b"png bytes"
+    assert store.to_data_url(url) == data_url
+    assert not store.exists(f"kh-blob://{'0' * 64}.png")
+
+
+def test_blob_store_delete(tmp_path):
+    store = BlobStore(tmp_path)
+    url = store.put(b"pdf bytes", ".pdf")
+    other_url = store.put(b"other bytes", ".pdf")
+    thumbnail_file = store._file(url).with_name(store._file(url).name + ".page0")
+    thumbnail_file.write_bytes(b"png bytes")
+
+    store.delete(f"{url}#page=0")
+    assert not store.exists(url)
+    assert not thumbnail_file.exists()
+    assert store.exists(other_url)
+
+    # deleting twice is harmless
+    store.delete(url)
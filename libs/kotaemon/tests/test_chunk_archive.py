@@ -0,0 +1,66 @@
+from kotaemon.base import Document
+from kotaemon.storages import ChunkArchive
+
+
+def test_chunk_archive(tmp_path):
+    archive = ChunkArchive(tmp_path)
+    chunks = [
+        Document(
+            text=f"chunk {idx}\nwith a new line",
+            id_=f"id{idx}",
+            metadata={"file_name": "a.pdf", "page_label": idx},
+        )
+        for idx in range(5)
+    ]
+    archive.append("file1", chunks[:3])
+    archive.append("file1", chunks[3:])
+    archive.append("file2", [Document(text="other", id_="other")])
+    archive.flush()
+
+    assert archive.count("file1") == 5
+    assert [doc.doc_id for doc in archive.read("file1")] == [
+        "id0",
+        "id1",
+        "id2",
+        "id3",
+        "id4",
+    ]
+    assert [doc.doc_id for doc in archive.read("file1", 2, 4)] == ["id2", "id3"]
+    assert [doc.text for doc in archive.read("file2")] == ["other"]
+    assert next(archive.read("file1", 4)).metadata == {
+        "file_name": "a.pdf",
+        "page_label": 4,
+    }
+
+    archive.remove("file1", ["id1", "id3"])
+    archive.flush()
+    assert [doc.doc_id for doc in archive.read("file1")] == ["id0", "id2", "id4"]
+    markdown = "".join(archive.export_markdown("file1"))
+    assert "Page label: 2" in markdown and "chunk 3" not in markdown
+
+    archive.delete("file1")
+    archive.flush()
+    assert not archive.exists("file1")
+    assert list(archive.read("file1")) == []
+    assert archive.exists("file2")
+
+
+def test_chunk_archive_readd_removed(tmp_path):
+    archive = ChunkArchive(tmp_path)
+    chunks = [Document(text=f"chunk {idx}", id_=f"id{idx}") for idx in range(3)]
+    archive.append("file1", chunks)
+    archive.remove("file1", ["id1"])
+
+    # a chunk reindexed with the same id after being removed
+    archive.append("file1", [Document(text="chunk 1 again", id_="id1")])
+    archive.flush()
+    assert [doc.text for doc in archive.read("file1")] == [
+        "chunk 0",
+        "chunk 2",
+        "chunk 1 again",
+    ]
+    assert [doc.doc_id for doc in archive.read("file1", 1)] == ["id2", "id1"]
+
+    archive.remove("file1", ["id1"])
+    archive.flush()
+    assert [doc.doc_id for doc in archive.read("file1")] == ["id0", "id2"]
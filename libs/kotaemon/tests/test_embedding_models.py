@@ -7,10 +7,13 @@ from openai.types.create_embedding_response import CreateEmbeddingResponse
 from kotaemon.base import Document, DocumentWithEmbedding
 from kotaemon.embeddings import (
     AzureOpenAIEmbeddings,
+    BaseEmbeddings,
+    CachedEmbeddings,
     FastEmbedEmbeddings,
     LCCohereEmbeddings,
     LCHuggingFaceEmbeddings,
     OpenAIEmbeddings,
+    QueryEmbeddingCache,
     VoyageAIEmbeddings,
 )
 
@@ -170,3 +173,91 @@ def test_voyageai_embeddings(sync_call, async_call):
     model = VoyageAIEmbeddings(api_key="test")
     output = model("Hello, world!")
     assert all(isinstance(doc, DocumentWithEmbedding) for doc in output)
+
+
+embedded_texts: list[str] = []
+
+
+class LengthEmbeddings(BaseEmbeddings):
+    """Embed a text as its length, recording the embedded texts"""
+
+    def invoke(self, text, *args, **kwargs):
+        input_docs = self.prepare_input(text)
+        embedded_texts.extend(doc.text for doc in input_docs)
+        return [
+            DocumentWithEmbedding(embedding=[float(len(doc.text)), 1.0], content=doc)
+            for doc in input_docs
+        ]
+
+
+def test_cached_embeddings(tmp_path):
+    embedded_texts.clear()
+    model = CachedEmbeddings(
+        embedding=LengthEmbeddings(), path=str(tmp_path / "cache.db")
+    )
+
+    output = model(["a", "bb", "a"])
+    assert [doc.embedding for doc in output] == [[1.0, 1.0], [2.0, 1.0], [1.0, 1.0]]
+    assert [doc.text for doc in output] == ["a", "bb", "a"]
+    assert embedded_texts == ["a", "bb"], "Duplicated texts are embedded once"
+
+    output = model([Document(text="bb"), Document(text="ccc")])
+    assert [doc.embedding for doc in output] == [[2.0, 1.0], [3.0, 1.0]]
+    assert embedded_texts == ["a", "bb", "ccc"], "Cached texts are not embedded"
+    assert model.cache.stats() == {"size": 3, "hits": 1, "misses": 3}
+
+
+def test_cached_embeddings_images(tmp_path):
+    embedded_texts.clear()
+    model = CachedEmbeddings(
+        embedding=LengthEmbeddings(), path=str(tmp_path / "cache.db")
+    )
+    images = [
+        Document(
+            text="<thumbnail>",
+            metadata={"type": "thumbnail", "image_origin": f"data:image/png;{data}"},
+        )
+        for data in ("base64,aaaa", "base64,bbbb")
+    ]
+
+    model(images)
+    assert len(embedded_texts) == 2, "Images with the same text are both embedded"
+
+    model([images[1], Document(text="<thumbnail>")])
+    assert len(embedded_texts) == 3, "Only the text without image is embedded"
+    assert model.cache.stats()["size"] == 3
+
+
+def test_cached_embeddings_eviction(tmp_path):
+    embedded_texts.clear()
+    model = CachedEmbeddings(
+        embedding=LengthEmbeddings(), path=str(tmp_path / "cache.db"), max_entries=2
+    )
+
+    model("a")
+    model("bb")
+    model("a")
+    model("ccc")
+    assert model.cache.stats()["size"] == 2
+
+    model(["a", "bb"])
+    assert embedded_texts == ["a", "bb", "ccc", "bb"], "LRU entry is evicted"
+
+
+def test_query_embedding_cache():
+    embedded_texts.clear()
+    cache = QueryEmbeddingCache(max_entries=2)
+    model = LengthEmbeddings()
+
+    def get(text):
+        return cache.get(model.identity(), text, lambda: model(text)[0].embedding)
+
+    assert get("a b") == [3.0, 1.0]
+    assert get(" a  b ") == [3.0, 1.0], "Whitespace is normalized"
+    assert embedded_texts == ["a b"]
+
+    get("cc")
+    get("ddd")
+    get("a b")
+    assert embedded_texts == ["a b", "cc", "ddd", "a b"], "LRU entry is evicted"
+    assert cache.stats() == {"size": 2, "hits": 1, "misses": 4, "evictions": 2}
@@ -8,6 +8,7 @@ from openai.types.create_embedding_response import CreateEmbeddingResponse
 from kotaemon.base import Document
 from kotaemon.embeddings import AzureOpenAIEmbeddings
 from kotaemon.indices import VectorIndexing, VectorRetrieval
+from kotaemon.indices.vectorindex import fuse_rankings
 from kotaemon.storages import ChromaVectorStore, InMemoryDocumentStore
 
 with open(Path(__file__).parent / "resources" / "embedding_openai.json") as f:
@@ -18,7 +19,7 @@ with open(Path(__file__).parent / "resources" / "embedding_openai.json") as f:
     "openai.resources.embeddings.Embeddings.create",
     side_effect=lambda *args, **kwargs: openai_embedding,
 )
-def test_indexing(tmp_path):
+def test_indexing(openai_embedding_call, tmp_path):
     db = ChromaVectorStore(path=str(tmp_path))
     doc_store = InMemoryDocumentStore()
     embedding = AzureOpenAIEmbeddings(
@@ -42,7 +43,7 @@ def test_indexing(tmp_path):
     "openai.resources.embeddings.Embeddings.create",
     side_effect=lambda *args, **kwargs: openai_embedding,
 )
-def test_retrieving(tmp_path):
+def test_retrieving(openai_embedding_call, tmp_path):
     db = ChromaVectorStore(path=str(tmp_path))
     doc_store = InMemoryDocumentStore()
     embedding = AzureOpenAIEmbeddings(
@@ -65,3 +66,23 @@ def test_retrieving(tmp_path):
 
     assert len(output) == 1, "Expect 1 results"
     assert output == output1, "Expect identical results"
+
+
+def test_fuse_rankings_rrf():
+    doc_ids, scores = fuse_rankings([["a", "b", "c"], ["c", "d", "c"]])
+
+    assert doc_ids == ["c", "a", "b", "d"], "Expect docs found by both lists first"
+    assert scores[0] == 1 / 61 + 1 / 63, "Expect a duplicate to count at its best rank"
+    assert scores[2] == scores[3], "Expect equal ranks to score the same"
+
+
+def test_fuse_rankings_weighted():
+    doc_ids, scores = fuse_rankings(
+        [["a", "b", "c"], ["c", "d"]],
+        scores=[[0.9, 0.5, 0.1], None],
+        weights=[1.0, 0.5],
+        method="weighted",
+    )
+
+    assert doc_ids == ["a", "b", "c", "d"]
+    assert scores == [1.0, 0.5, 0.5, 0.25]
@@ -1,8 +1,10 @@
 from pathlib import Path
 from unittest.mock import patch
 
+import pytest
 from langchain.schema import Document as LangchainDocument
 from llama_index.core.node_parser import SimpleNodeParser
+from PIL import Image
 
 from kotaemon.base import Document
 from kotaemon.loaders import (
@@ -11,8 +13,11 @@ from kotaemon.loaders import (
     DocxReader,
     HtmlReader,
     MhtmlReader,
+    PDFThumbnailReader,
     UnstructuredReader,
 )
+from kotaemon.loaders.pdf_loader import convert_image_to_base64, get_page_thumbnails
+from kotaemon.storages import BlobStore
 
 from .conftest import skip_when_unstructured_pdf_not_installed
 
@@ -54,6 +59,44 @@ def test_pdf_reader():
     assert len(nodes) > 0
 
 
+def test_pdf_page_thumbnails():
+    file_path = Path(__file__).parent / "resources" / "dummy.pdf"
+    thumbnails = get_page_thumbnails(file_path, [0], format="WEBP")
+    assert thumbnails[0].startswith("data:image/webp;base64,")
+
+    # enough pages to be rendered by the worker processes
+    thumbnails = get_page_thumbnails(file_path, [0] * 20, format="JPEG")
+    assert len(thumbnails) == 20
+    assert thumbnails[0].startswith("data:image/jpeg;base64,")
+    assert len(set(thumbnails)) == 1
+
+    # the thumbnails are lossless by default
+    assert get_page_thumbnails(file_path, [0])[0].startswith("data:image/png;base64,")
+
+
+def test_convert_image_to_base64_unknown_format():
+    image = Image.new("RGB", (4, 4))
+    assert convert_image_to_base64(image, format="webp").startswith(
+        "data:image/webp;base64,"
+    )
+    with pytest.raises(ValueError, match="PNG, JPEG, WEBP"):
+        convert_image_to_base64(image, format="BMP")
+
+
+def test_pdf_lazy_page_thumbnails(tmp_path):
+    store = BlobStore(tmp_path)
+    with patch("kotaemon.loaders.pdf_loader.get_blob_store", return_value=store):
+        reader = PDFThumbnailReader(lazy_thumbnails=True)
+        documents = reader.load_data(Path(__file__).parent / "resources" / "dummy.pdf")
+
+    thumbnail_url = documents[-1].metadata["image_origin"]
+    assert documents[-1].metadata["type"] == "thumbnail"
+    assert thumbnail_url.endswith(".pdf#page=0")
+    thumbnail = store.to_data_url(thumbnail_url)
+    assert thumbnail.startswith("data:image/")
+    assert store.to_data_url(thumbnail_url) == thumbnail
+
+
 @skip_when_unstructured_pdf_not_installed
 def test_unstructured_pdf_reader():
     reader = UnstructuredReader()
@@ -1,7 +1,8 @@
+import tiktoken
 from llama_index.core.schema import NodeRelationship
 
 from kotaemon.base import Document
-from kotaemon.indices.splitters import TokenSplitter
+from kotaemon.indices.splitters import TiktokenSplitter, TokenSplitter
 
 source1 = Document(
     content="The City Hall and Raffles Place MRT stations are paired cross-platform "
@@ -53,3 +54,58 @@ def test_split_token():
     )
     assert chunks[1].relationships[NodeRelationship.NEXT].node_id == chunks[2].doc_id
     assert chunks[-1].relationships[NodeRelationship.SOURCE].node_id == source2.doc_id
+
+
+def test_split_tiktoken():
+    """Test that the native splitter follows the TokenSplitter semantics"""
+    splitter = TiktokenSplitter(chunk_size=30, chunk_overlap=10)
+    chunks = splitter([source1, source2])
+
+    assert isinstance(chunks[0], Document), "Chunks should be a list of Documents"
+    assert chunks[0].relationships[NodeRelationship.SOURCE].node_id == source1.doc_id
+    assert (
+        chunks[1].relationships[NodeRelationship.PREVIOUS].node_id == chunks[0].doc_id
+    )
+    assert chunks[1].relationships[NodeRelationship.NEXT].node_id == chunks[2].doc_id
+    assert chunks[-1].relationships[NodeRelationship.SOURCE].node_id == source2.doc_id
+    assert NodeRelationship.NEXT not in chunks[-1].relationships
+
+    # the chunks are cut from the documents, with their token count
+    encoding = tiktoken.get_encoding("cl100k_base")
+    for chunk in chunks:
+        source = source1 if chunk.ref_doc_id == source1.doc_id else source2
+        assert source.text[chunk.start_char_idx : chunk.end_char_idx] == chunk.text
+        assert 0 < chunk.metadata["n_tokens"] <= 30
+    assert sum(chunk.metadata["n_tokens"] for chunk in chunks) > len(
+        encoding.encode(source1.text + source2.text)
+    )
+
+    # consecutive chunks overlap
+    assert chunks[1].start_char_idx < chunks[0].end_char_idx
+
+
+def test_split_tiktoken_separators():
+    """Test that the text is split by the separators in order"""
+    text = "\n\n".join(
+        [" ".join(["first paragraph"] * 5), " ".join(["second paragraph"] * 5)]
+    )
+    splitter = TiktokenSplitter(
+        chunk_size=15, chunk_overlap=0, separator="\n\n", include_metadata=False
+    )
+    chunks = splitter([Document(text=text)])
+    assert [chunk.text for chunk in chunks] == text.split("\n\n")
+
+    splitter.chunk_size = 4
+    chunks = splitter([Document(text=text)])
+    assert all(chunk.metadata["n_tokens"] <= 4 for chunk in chunks)
+    assert chunks[0].text == "first paragraph first paragraph"
+
+
+def test_split_tiktoken_multi_token_character():
+    """Test that a character of more tokens than the chunk size is kept whole"""
+    splitter = TiktokenSplitter(
+        chunk_size=2, chunk_overlap=0, separator=" ", include_metadata=False
+    )
+    chunks = splitter([Document(text="ab😀cd")])
+    assert "".join(chunk.text for chunk in chunks) == "ab😀cd"
+    assert "😀" in [chunk.text for chunk in chunks]
@@ -2,11 +2,19 @@ import json
 import os
 
 import pytest
+from llama_index.core.vector_stores.types import (
+    FilterOperator,
+    MetadataFilter,
+    MetadataFilters,
+)
 
 from kotaemon.base import DocumentWithEmbedding
+from kotaemon.indices.vectorindex import exact_search
 from kotaemon.storages import (
     ChromaVectorStore,
+    FlatVectorStore,
     InMemoryVectorStore,
+    IVFVectorStore,
     MilvusVectorStore,
     QdrantVectorStore,
     SimpleFileVectorStore,
@@ -130,6 +138,19 @@ class TestInMemoryVectorStore:
             0.6,
         ], "load function does not load data completely"
 
+    def test_exact_search(self):
+        """Test that the scoped exact search ranks by cosine similarity"""
+        embeddings = [[1.0, 0.0], [0.6, 0.8], [0.0, 2.0], [-1.0, 0.0]]
+        ids = ["1", "2", "3", "4"]
+        db = InMemoryVectorStore()
+        db.add(embeddings=embeddings, ids=ids)
+
+        assert db.get_embeddings(["2", "5"]) == (["2"], [[0.6, 0.8]])
+
+        scores, out_ids = exact_search(db, [0.0, 1.0], ["1", "2", "3", "5"], top_k=2)
+        assert out_ids == ["3", "2"], "Expected the scoped ids, most similar first"
+        assert scores == pytest.approx([1.0, 0.8])
+
 
 class TestSimpleFileVectorStore:
     def test_add_delete(self, tmp_path):
@@ -159,6 +180,103 @@ class TestSimpleFileVectorStore:
         os.remove(tmp_path / collection_name)
 
 
+class TestFlatVectorStore:
+    def test_add_query(self, tmp_path):
+        """Test that query ranks by cosine similarity, within the ids and filters"""
+        embeddings = [[1.0, 0.0], [0.6, 0.8], [0.0, 2.0], [-1.0, 0.0]]
+        metadatas = [{"file_id": "a"}, {"file_id": "b"}, {"file_id": "a"}, {}]
+        ids = ["1", "2", "3", "4"]
+        db = FlatVectorStore(path=tmp_path, collection_name="test_add_query")
+
+        output = db.add(embeddings=embeddings, metadatas=metadatas, ids=ids)
+        assert output == ids, "Excepted output to be the same as ids"
+
+        embs, scores, out_ids = db.query(embedding=[0.0, 1.0], top_k=2)
+        assert out_ids == ["3", "2"], "Expected the most similar first"
+        assert scores == pytest.approx([1.0, 0.8])
+        assert embs == [[0.0, 2.0], pytest.approx([0.6, 0.8])]
+
+        _, _, out_ids = db.query(embedding=[0.0, 1.0], top_k=5, ids=["1", "2", "5"])
+        assert out_ids == ["2", "1"], "Expected only the given ids"
+
+        filters = MetadataFilters(
+            filters=[
+                MetadataFilter(key="file_id", value=["a"], operator=FilterOperator.IN)
+            ]
+        )
+        _, _, out_ids = db.query(embedding=[0.0, 1.0], top_k=5, filters=filters)
+        assert out_ids == ["3", "1"], "Expected only the filtered embeddings"
+
+    def test_delete_compact_load(self, tmp_path):
+        """Test that deleted embeddings are compacted away and not loaded again"""
+        embeddings = [[0.1, 0.2, 0.3], [0.4, 0.5, 0.6], [0.7, 0.8, 0.9]]
+        ids = ["1", "2", "3"]
+        collection_name = "test_delete_compact_load"
+        db = FlatVectorStore(
+            path=tmp_path, collection_name=collection_name, compact_min_rows=2
+        )
+        db.add(embeddings=embeddings, ids=ids)
+        db.delete(["3"])
+        assert db.count() == 2
+        assert (tmp_path / collection_name / "vectors-0.f32").is_file()
+
+        # replacing "1" leaves 2 deleted rows out of 4, which are compacted
+        db.add(embeddings=[[1.0, 1.0, 1.0]], ids=["1"])
+        assert not (tmp_path / collection_name / "vectors-0.f32").exists()
+        assert (tmp_path / collection_name / "vectors-1.f32").is_file()
+
+        db2 = FlatVectorStore(path=tmp_path, collection_name=collection_name)
+        assert db2.count() == 2
+        found, vectors = db2.get_embeddings(["1", "2", "3"])
+        assert found == ["1", "2"]
+        assert vectors == [[1.0, 1.0, 1.0], pytest.approx([0.4, 0.5, 0.6])]
+
+        db2.drop()
+        assert not (tmp_path / collection_name).exists()
+
+
+class TestIVFVectorStore:
+    def test_query_index(self, tmp_path):
+        """Test that the index is trained, saved and searched by probed lists"""
+        embeddings = [[1.0, 0.1], [0.9, 0.2], [0.1, 1.0], [0.2, 0.9]]
+        metadatas = [{"file_id": "a"}, {"file_id": "b"}, {"file_id": "a"}, {}]
+        ids = ["1", "2", "3", "4"]
+        collection_name = "test_query_index"
+        db = IVFVectorStore(
+            path=tmp_path,
+            collection_name=collection_name,
+            n_lists=2,
+            n_probe=1,
+            exact_search_rows=0,
+        )
+        db.add(embeddings=embeddings, metadatas=metadatas, ids=ids)
+
+        _, _, out_ids = db.query(embedding=[1.0, 0.0], top_k=2)
+        assert out_ids == ["1", "2"], "Expected the most similar first"
+        assert (tmp_path / collection_name / "ivf-0.npz").is_file()
+        lists = db._lists[:4].tolist()
+        assert lists[0] == lists[1] != lists[2] == lists[3]
+
+        # not enough vectors in the probed list, all are searched
+        _, _, out_ids = db.query(embedding=[1.0, 0.0], top_k=3)
+        assert out_ids == ["1", "2", "4"]
+
+        filters = MetadataFilters(
+            filters=[
+                MetadataFilter(key="file_id", value=["a"], operator=FilterOperator.IN)
+            ]
+        )
+        _, _, out_ids = db.query(embedding=[0.0, 1.0], top_k=1, filters=filters)
+        assert out_ids == ["3"], "Expected only the filtered embeddings"
+
+        db2 = IVFVectorStore(
+            path=tmp_path, collection_name=collection_name, exact_search_rows=0
+        )
+        _, _, out_ids = db2.query(embedding=[0.0, 1.0], top_k=2)
+        assert out_ids == ["3", "4"]
+        assert db2._lists[:4].tolist() == lists, "Expected the saved index"
+
+
 class TestMilvusVectorStore:
     def test_add(self, tmp_path):
         """Test that the DB add correctly"""
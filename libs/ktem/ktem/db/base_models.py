@@ -100,3 +100,78 @@ class BaseIssueReport(SQLModel):
     chat: Optional[dict] = Field(default=None, sa_column=Column(JSON))
     settings: Optional[dict] = Field(default=None, sa_column=Column(JSON))
     user: Optional[str] = Field(default=None)
+
+
+class BaseIndexingJob(SQLModel):
+    """Store the background indexing job of a file
+
+    The chunks of the file are already in the docstore, the job embeds them into
+    the vector store. The job can be resumed from the last embedded batch.
+
+    Attributes:
+        id: canonical id to identify the job
+        source_table: the name of the Source table of the file index
+        file_id: the id of the file
+        file_name: the name of the file
+        user: the user id
+        status: pending, running, completed or failed
+        n_attempts: the number of times the job was claimed by a worker
+        n_done: the number of embedded chunks
+        n_total: the number of chunks to embed
+        error: the error message if the job failed
+        date_created: the date the job was created
+        date_updated: the date the job was last updated
+    """
+
+    __table_args__ = {"extend_existing": True}
+
+    id: str = Field(
+        default_factory=lambda: uuid.uuid4().hex, primary_key=True, index=True
+    )
+    source_table: str = Field(index=True)
+    file_id: str = Field(index=True)
+    file_name: str = Field(default="")
+    user: str = Field(default="")
+    status: str = Field(default="pending", index=True)
+    n_attempts: int = Field(default=0)
+    n_done: int = Field(default=0)
+    n_total: int = Field(default=0)
+    error: Optional[str] = Field(default=None)
+    date_created: datetime.datetime = Field(
+        default_factory=lambda: datetime.datetime.now(get_localzone())
+    )
+    date_updated: datetime.datetime = Field(
+        default_factory=lambda: datetime.datetime.now(get_localzone())
+    )
+
+
+class BaseIndexVersion(SQLModel):
+    """Store the version of a file index, bumped whenever its content changes
+
+    Attributes:
+        source_table: the name of the Source table of the file index
+        version: the number of changes of the index
+    """
+
+    __table_args__ = {"extend_existing": True}
+
+    source_table: str = Field(primary_key=True)
+    version: int = Field(default=0)
+
+
+class BaseBlobReference(SQLModel):
+    """Store which files of the file indices reference a blob of the blob store
+
+    A blob that no file references anymore is deleted from the blob store.
+
+    Attributes:
+        id: canonical id of the reference
+        url: the blob URL, without its fragment
+        owner: the file referencing the blob, as `<source table>/<file id>`
+    """
+
+    __table_args__ = {"extend_existing": True}
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    url: str = Field(index=True)
+    owner: str = Field(index=True)
@@ -28,6 +28,24 @@ _base_issue_report = (
     else base_models.BaseIssueReport
 )
 
+_base_indexing_job = (
+    import_dotted_string(settings.KH_TABLE_INDEXING_JOB, safe=False)
+    if hasattr(settings, "KH_TABLE_INDEXING_JOB")
+    else base_models.BaseIndexingJob
+)
+
+_base_index_version = (
+    import_dotted_string(settings.KH_TABLE_INDEX_VERSION, safe=False)
+    if hasattr(settings, "KH_TABLE_INDEX_VERSION")
+    else base_models.BaseIndexVersion
+)
+
+_base_blob_reference = (
+    import_dotted_string(settings.KH_TABLE_BLOB_REFERENCE, safe=False)
+    if hasattr(settings, "KH_TABLE_BLOB_REFERENCE")
+    else base_models.BaseBlobReference
+)
+
 
 class Conversation(_base_conv, table=True):  # type: ignore
     """Conversation record"""
@@ -45,5 +63,17 @@ class IssueReport(_base_issue_report, table=True):  # type: ignore
     """Record of issues"""
 
 
+class IndexingJob(_base_indexing_job, table=True):  # type: ignore
+    """Record of background indexing jobs"""
+
+
+class IndexVersion(_base_index_version, table=True):  # type: ignore
+    """Record of the file index versions"""
+
+
+class BlobReference(_base_blob_reference, table=True):  # type: ignore
+    """Record of the blobs referenced by the indexed files"""
+
+
 if not getattr(settings, "KH_ENABLE_ALEMBIC", False):
     SQLModel.metadata.create_all(engine)
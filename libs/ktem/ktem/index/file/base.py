@@ -12,6 +12,7 @@ class BaseFileIndexRetriever(BaseComponent):
     DS = Param(help="The DocStore")
     FSPath = Param(help="The file storage path")
     user_id = Param(help="The user id")
+    private = Param(False, help="Whether this is private index")
 
     @classmethod
     def get_user_settings(cls) -> dict:
@@ -57,6 +58,22 @@ class BaseFileIndexIndexing(BaseComponent):
     private = Param(False, help="Whether this is private index")
     chunk_size = Param(help="Chunk size for this index")
     chunk_overlap = Param(help="Chunk overlap for this index")
+    indexing_workers = Param(1, help="Number of files to index concurrently")
+    indexing_memory_limit = Param(
+        0, help="Max total size (MB) of files indexed concurrently, 0 to disable"
+    )
+    staged_indexing = Param(
+        False, help="Whether to split, store and embed chunks in concurrent stages"
+    )
+    incremental_reindex = Param(
+        False, help="Whether to only reindex the files and chunks that changed"
+    )
+    defer_relation_writes = Param(
+        False, help="Whether to write the chunk relations once the file is stored"
+    )
+    embed_images = Param(
+        False, help="Whether to embed the page thumbnails and images of the files"
+    )
 
     def run(
         self, file_paths: str | Path | list[str | Path], *args, **kwargs
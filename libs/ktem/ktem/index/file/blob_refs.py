@@ -0,0 +1,144 @@
+"""References of the indexed files to the blob store
+
+The page thumbnails and figures of the files are kept in the blob store, which
+is shared by all the file indices, and the same image is only stored once. Each
+file records the blobs it references in the `BlobReference` table, and a blob is
+deleted from the blob store once the last file referencing it is deleted, or
+reindexed without it.
+
+The blobs are stored and released under a lock, so that a blob is never deleted
+while another file of the same process is being stored with it.
+"""
+
+from __future__ import annotations
+
+import threading
+from typing import Optional
+
+from ktem.db.models import BlobReference, engine
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from kotaemon.base import Document
+from kotaemon.storages import get_blob_store, is_blob_url
+
+# Number of blob URLs or owners per statement, within the bound parameter limit
+# of SQLite
+BATCH_SIZE = 500
+
+_lock = threading.Lock()
+
+
+def get_owner(source_table: str, file_id: str) -> str:
+    """Get the owner of the blob references of a file"""
+    return f"{source_table}/{file_id}"
+
+
+def get_blob_urls(docs: list[Document]) -> set[str]:
+    """Get the blob URLs in the metadata of the docs, without their fragment"""
+    return {
+        doc.metadata["image_origin"].partition("#")[0]
+        for doc in docs
+        if is_blob_url(doc.metadata.get("image_origin"))
+    }
+
+
+def _delete_unreferenced(session: Session, urls: set[str]) -> int:
+    """Delete the blobs that are not referenced anymore, return their number"""
+    store = get_blob_store()
+    if store is None or not urls:
+        return 0
+
+    candidates = sorted(urls)
+    referenced: set[str] = set()
+    for start_idx in range(0, len(candidates), BATCH_SIZE):
+        batch = candidates[start_idx : start_idx + BATCH_SIZE]
+        referenced.update(
+            session.execute(
+                select(BlobReference.url).where(BlobReference.url.in_(batch))
+            ).scalars()
+        )
+
+    unreferenced = urls - referenced
+    for url in unreferenced:
+        store.delete(url)
+    return len(unreferenced)
+
+
+def store_blobs(docs: list[Document], source_table: str, file_id: str):
+    """Move the images of the docs of a file to the blob store, if it is set
+
+    The images are replaced by their blob URLs in the metadata of the docs. The
+    docs are all the docs of the file, so the blobs the file referenced before,
+    e.g. when it is reindexed, and no longer does are released.
+
+    Args:
+        docs: the docs of the file
+        source_table: the name of the Source table of the file index
+        file_id: the id of the file
+    """
+    store = get_blob_store()
+    if store is None:
+        return
+
+    owner = get_owner(source_table, file_id)
+    with _lock:
+        store.offload(docs)
+        urls = get_blob_urls(docs)
+        with Session(engine) as session:
+            existing = set(
+                session.execute(
+                    select(BlobReference.url).where(BlobReference.owner == owner)
+                ).scalars()
+            )
+            released = existing - urls
+            released_urls = sorted(released)
+            for start_idx in range(0, len(released_urls), BATCH_SIZE):
+                session.execute(
+                    delete(BlobReference).where(
+                        BlobReference.owner == owner,
+                        BlobReference.url.in_(
+                            released_urls[start_idx : start_idx + BATCH_SIZE]
+                        ),
+                    )
+                )
+            session.add_all(
+                BlobReference(url=url, owner=owner) for url in urls - existing
+            )
+            session.commit()
+            _delete_unreferenced(session, released)
+
+
+def release_blobs(source_table: str, file_ids: Optional[list[str]] = None) -> int:
+    """Release the blobs referenced by deleted files
+
+    Args:
+        source_table: the name of the Source table of the file index
+        file_ids: the ids of the deleted files, default to all the files of
+            the index
+
+    Returns:
+        the number of blobs deleted from the blob store
+    """
+    if file_ids is None:
+        conditions = [
+            BlobReference.owner.startswith(
+                get_owner(source_table, ""), autoescape=True
+            )
+        ]
+    else:
+        owners = [get_owner(source_table, file_id) for file_id in file_ids]
+        conditions = [
+            BlobReference.owner.in_(owners[start_idx : start_idx + BATCH_SIZE])
+            for start_idx in range(0, len(owners), BATCH_SIZE)
+        ]
+
+    with _lock, Session(engine) as session:
+        urls: set[str] = set()
+        for condition in conditions:
+            urls.update(
+                session.execute(select(BlobReference.url).where(condition)).scalars()
+            )
+            session.execute(delete(BlobReference).where(condition))
+        session.commit()
+        return _delete_unreferenced(session, urls)
@@ -1,27 +1,38 @@
 from __future__ import annotations
 
+import json
 import logging
+import queue
 import shutil
 import threading
 import time
+import uuid
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 from functools import lru_cache
 from hashlib import sha256
 from pathlib import Path
-from typing import Generator, Optional
+from typing import Generator, NamedTuple, Optional
 
-import tiktoken
 from ktem.db.models import engine
 from ktem.embeddings.manager import embedding_models_manager
 from llama_index.core.readers.base import BaseReader
 from llama_index.core.readers.file.base import default_file_metadata_func
-from sqlalchemy import delete, select
+from sqlalchemy import delete, insert, select
 from sqlalchemy.orm import Session
 from theflow.settings import settings
 from theflow.utils.modules import import_dotted_string
 
-from kotaemon.base import BaseComponent, Document, Node, Param
-from kotaemon.embeddings import BaseEmbeddings
+from kotaemon.base import (
+    BaseComponent,
+    Document,
+    Node,
+    Param,
+    get_component_spec,
+    get_encoding_for_model,
+)
+from kotaemon.embeddings import BaseEmbeddings, CachedEmbeddings
 from kotaemon.indices import VectorIndexing
 from kotaemon.indices.ingests.files import (
     KH_DEFAULT_FILE_EXTRACTORS,
@@ -31,14 +42,15 @@ from kotaemon.indices.ingests.files import (
     unstructured,
     web_reader,
 )
-from kotaemon.indices.splitters import BaseSplitter, TokenSplitter
+from kotaemon.indices.splitters import BaseSplitter, TiktokenSplitter
+from kotaemon.storages import ChunkArchive, get_chunk_archive
 
 from .base import BaseFileIndexIndexing
+from .blob_refs import release_blobs, store_blobs
+from .retrieval_cache import bump_index_version
 
 logger = logging.getLogger(__name__)
 
-_default_token_func = tiktoken.encoding_for_model("gpt-3.5-turbo").encode
-
 
 @lru_cache
 def dev_settings():
@@ -61,6 +73,123 @@ def dev_settings():
 
     return file_extractors, chunk_size, chunk_overlap
 
+
+class _FileIndexingResult(NamedTuple):
+    """The outcome of indexing a single file in a worker"""
+
+    file_id: Optional[str]
+    docs: list[Document]
+    error: Optional[str]
+
+
+def _yield_to_queue(gen: Generator, output: queue.Queue):
+    """Exhaust the generator, put its items to the queue and return its value"""
+    while True:
+        try:
+            output.put(next(gen))
+        except StopIteration as e:
+            return e.value
+
+
+_STAGE_END = object()
+
+_store_locks: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+_store_locks_lock = threading.Lock()
+
+
+def _get_store_lock(store) -> threading.Lock:
+    """Get the lock that serializes the writes to a docstore or vectorstore
+
+    Files indexed concurrently and the background embedding jobs share the same
+    stores, and not all store backends support concurrent writes.
+    """
+    with _store_locks_lock:
+        return _store_locks.setdefault(store, threading.Lock())
+
+
+def _run_stage(
+    work,
+    inputs: queue.Queue,
+    outputs: Optional[queue.Queue],
+    messages: queue.Queue,
+    errors: list,
+):
+    """Run `work` on every batch from `inputs` and forward the batch to `outputs`
+
+    After any stage fails, the remaining batches are drained without being
+    processed, so that the upstream stages are never blocked on a full queue.
+    """
+    while True:
+        batch = inputs.get()
+        if batch is _STAGE_END:
+            break
+        if errors:
+            continue
+        try:
+            work(batch)
+        except Exception as e:
+            errors.append(e)
+            continue
+        if outputs is not None:
+            outputs.put(batch)
+
+    if outputs is not None:
+        outputs.put(_STAGE_END)
+    messages.put(_STAGE_END)
+
+
+class RelationWriter:
+    """Write the chunk relations of a file to the Index table in bulk
+
+    The relations are inserted with a single executemany statement per batch
+    instead of one ORM object per chunk. When `defer` is set, the relations are
+    kept in memory and written in a single transaction by `flush`, usually once
+    the whole file is stored.
+
+    Args:
+        Index: the SQLAlchemy Index table
+        file_id: the id of the file the chunks belong to
+        defer: whether to hold the relations until `flush` is called
+    """
+
+    def __init__(self, Index, file_id: str, defer: bool = False):
+        self._table = Index.__table__
+        self._file_id = file_id
+        self._defer = defer
+        self._rows: list[dict] = []
+        self._lock = threading.Lock()
+
+    def add(self, chunk_ids: list[str], relation_type: str):
+        """Record the relation between the file and the chunks"""
+        rows = [
+            {
+                "source_id": self._file_id,
+                "target_id": chunk_id,
+                "relation_type": relation_type,
+            }
+            for chunk_id in chunk_ids
+        ]
+        if not self._defer:
+            self._write(rows)
+            return
+
+        with self._lock:
+            self._rows.extend(rows)
+
+    def flush(self):
+        """Write the held relations in a single transaction"""
+        with self._lock:
+            rows, self._rows = self._rows, []
+        self._write(rows)
+
+    def _write(self, rows: list[dict]):
+        if not rows:
+            return
+        with Session(engine) as session:
+            session.execute(insert(self._table), rows)
+            session.commit()
+
+
 class IndexPipeline(BaseComponent):
     """Index a single file"""
 
@@ -77,6 +206,11 @@ class IndexPipeline(BaseComponent):
     collection_name: str = "default"
     private: bool = False
     run_embedding_in_thread: bool = False
+    staged: bool = False
+    stage_queue_size: int = 4
+    incremental: bool = False
+    defer_relation_writes: bool = False
+    embed_images: bool = False
     embedding: BaseEmbeddings
 
     @Node.auto(depends_on=["Source", "Index", "embedding"])
@@ -85,8 +219,25 @@ class IndexPipeline(BaseComponent):
             vector_store=self.VS, doc_store=self.DS, embedding=self.embedding
         )
 
-    def handle_docs(self, docs, file_id, file_name) -> Generator[Document, None, int]:
-        s_time = time.time()
+    @property
+    def chunk_archive(self) -> Optional[ChunkArchive]:
+        """The archive of the chunks, if enabled with `KH_CHUNKS_OUTPUT_DIR`"""
+        cache_dir = self.vector_indexing.cache_dir
+        return get_chunk_archive(cache_dir) if cache_dir else None
+
+    def offload_images(self, docs: list[Document], file_id: str):
+        """Move the images of the docs to the blob store, if `KH_BLOB_STORE_DIR` is set
+
+        The docs, and so the doc store and vector store, then only keep a
+        reference to their images. The file records the blobs it references, so
+        that they are deleted with it.
+        """
+        store_blobs(docs, self.Source.__tablename__, file_id)
+
+    def group_docs(
+        self, docs: list[Document]
+    ) -> tuple[list[Document], list[Document], list[Document]]:
+        """Group the loaded docs into text docs, non-text docs and page thumbnails"""
         text_docs = []
         non_text_docs = []
         thumbnail_docs = []
@@ -101,10 +252,12 @@ class IndexPipeline(BaseComponent):
                 non_text_docs.append(doc)
 
         print(f"Got {len(thumbnail_docs)} page thumbnails")
-        page_label_to_thumbnail = {
-            doc.metadata["page_label"]: doc.doc_id for doc in thumbnail_docs
-        }
+        return text_docs, non_text_docs, thumbnail_docs
 
+    def split_text_docs(
+        self, text_docs: list[Document], page_label_to_thumbnail: dict
+    ) -> list[Document]:
+        """Split the text docs into chunks and link them to their page thumbnail"""
         if self.splitter:
             all_chunks = self.splitter(text_docs)
         else:
@@ -116,7 +269,91 @@ class IndexPipeline(BaseComponent):
             if page_label and page_label in page_label_to_thumbnail:
                 chunk.metadata["thumbnail_doc_id"] = page_label_to_thumbnail[page_label]
 
+        return all_chunks
+
+    def assign_chunk_ids(
+        self, chunks: list[Document], file_id: str, seen: dict[str, int]
+    ):
+        """Give the chunks stable ids derived from their content and position
+
+        The same chunk of the same file always gets the same id, so that a
+        reindexed file can keep the chunks that didn't change.
+
+        Args:
+            chunks: the chunks to assign ids to
+            file_id: the id of the file the chunks belong to
+            seen: the number of occurrences of each chunk key so far in the file,
+                used to tell apart identical chunks
+        """
+        for chunk in chunks:
+            key = json.dumps(
+                [
+                    file_id,
+                    chunk.metadata.get("type", "text"),
+                    chunk.metadata.get("page_label"),
+                    chunk.metadata.get("thumbnail_doc_id"),
+                    chunk.metadata.get("image_origin"),
+                    " ".join(chunk.text.split()),
+                ],
+                default=str,
+            )
+            n_seen = seen.get(key, 0)
+            seen[key] = n_seen + 1
+            chunk.id_ = str(uuid.uuid5(uuid.NAMESPACE_OID, f"{key}|{n_seen}"))
+
+    def handle_docs(
+        self, docs, file_id, file_name, existing_ids: Optional[set[str]] = None
+    ) -> Generator[Document, None, tuple[int, int]]:
+        """Split, store and embed the docs of a file
+
+        Args:
+            docs: the docs loaded from the file
+            file_id: the file id
+            file_name: the file name
+            existing_ids: the chunk ids already indexed for this file. If given,
+                only the new chunks are indexed and the chunks that no longer
+                exist are deleted.
+
+        Returns:
+            the number of indexed chunks and the number of tokens of the file
+        """
+        if self.staged:
+            return (
+                yield from self.handle_docs_staged(
+                    docs, file_id, file_name, existing_ids
+                )
+            )
+
+        s_time = time.time()
+        self.offload_images(docs, file_id)
+        text_docs, non_text_docs, thumbnail_docs = self.group_docs(docs)
+        chunk_keys: dict[str, int] = {}
+        if self.incremental:
+            self.assign_chunk_ids(non_text_docs + thumbnail_docs, file_id, chunk_keys)
+        page_label_to_thumbnail = {
+            doc.metadata["page_label"]: doc.doc_id for doc in thumbnail_docs
+        }
+        all_chunks = self.split_text_docs(text_docs, page_label_to_thumbnail)
+        if self.incremental:
+            self.assign_chunk_ids(all_chunks, file_id, chunk_keys)
+
         to_index_chunks = all_chunks + non_text_docs + thumbnail_docs
+        n_tokens = self.count_tokens(to_index_chunks)
+        if existing_ids is not None:
+            new_ids = {chunk.doc_id for chunk in to_index_chunks}
+            n_removed = self.delete_chunks(file_id, existing_ids - new_ids)
+            to_index_chunks = [
+                chunk for chunk in to_index_chunks if chunk.doc_id not in existing_ids
+            ]
+            yield Document(
+                f" => [{file_name}] Kept {len(new_ids) - len(to_index_chunks)} "
+                f"unchanged chunks, removed {n_removed} chunks",
+                channel="debug",
+            )
+
+        relations = RelationWriter(
+            self.Index, file_id, defer=self.defer_relation_writes
+        )
 
         # add to doc store
         chunks = []
@@ -124,79 +361,373 @@ class IndexPipeline(BaseComponent):
         chunk_size = self.chunk_batch_size * 4
         for start_idx in range(0, len(to_index_chunks), chunk_size):
             chunks = to_index_chunks[start_idx : start_idx + chunk_size]
-            self.handle_chunks_docstore(chunks, file_id)
+            self.handle_chunks_docstore(chunks, file_id, relations)
             n_chunks += len(chunks)
             yield Document(
                 f" => [{file_name}] Processed {n_chunks} chunks",
                 channel="debug",
             )
 
-        def insert_chunks_to_vectorstore():
-            chunks = []
-            n_chunks = 0
+        # run vector indexing as a background job if specified
+        if self.run_embedding_in_thread and self.VS:
+            # the job looks up the chunks to embed in the index
+            relations.flush()
+            yield self.submit_embedding_job(file_id, file_name)
+        else:
+            n_embedded = 0
             chunk_size = self.chunk_batch_size
             for start_idx in range(0, len(to_index_chunks), chunk_size):
                 chunks = to_index_chunks[start_idx : start_idx + chunk_size]
-                self.handle_chunks_vectorstore(chunks, file_id)
-                n_chunks += len(chunks)
+                self.handle_chunks_vectorstore(chunks, file_id, relations)
+                n_embedded += len(chunks)
                 if self.VS:
                     yield Document(
-                        f" => [{file_name}] Created embedding for {n_chunks} chunks",
+                        f" => [{file_name}] Created embedding for {n_embedded} chunks",
                         channel="debug",
                     )
+            relations.flush()
+
+        print("indexing step took", time.time() - s_time)
+        return n_chunks, n_tokens
+
+    def handle_docs_staged(
+        self, docs, file_id, file_name, existing_ids: Optional[set[str]] = None
+    ) -> Generator[Document, None, tuple[int, int]]:
+        """Split, store and embed the docs in concurrent stages
+
+        The stages (splitting, docstore writing, embedding + vectorstore writing)
+        run in their own threads and pass chunk batches of `chunk_batch_size`
+        through bounded queues of `stage_queue_size` batches, so that the embedding
+        of one batch overlaps with storing the next batch and splitting the
+        following pages, while the number of in-flight chunks stays bounded.
+        """
+        s_time = time.time()
+        self.offload_images(docs, file_id)
+        text_docs, non_text_docs, thumbnail_docs = self.group_docs(docs)
+        chunk_keys: dict[str, int] = {}
+        if self.incremental:
+            self.assign_chunk_ids(non_text_docs + thumbnail_docs, file_id, chunk_keys)
+        new_ids: set[str] = set()
+        page_label_to_thumbnail = {
+            doc.metadata["page_label"]: doc.doc_id for doc in thumbnail_docs
+        }
+
+        to_docstore: queue.Queue = queue.Queue(maxsize=self.stage_queue_size)
+        to_vectorstore: queue.Queue = queue.Queue(maxsize=self.stage_queue_size)
+        messages: queue.Queue = queue.Queue()
+        errors: list[Exception] = []
+        n_chunks = {"docstore": 0, "vectorstore": 0, "tokens": 0}
+        relations = RelationWriter(
+            self.Index, file_id, defer=self.defer_relation_writes
+        )
 
-        # run vector indexing in thread if specified
-        if self.run_embedding_in_thread:
-            print("Running embedding in thread")
+        def keep_new(chunks: list[Document]) -> list[Document]:
+            n_chunks["tokens"] += self.count_tokens(chunks)
+            new_ids.update(chunk.doc_id for chunk in chunks)
+            if existing_ids is None:
+                return chunks
+            return [chunk for chunk in chunks if chunk.doc_id not in existing_ids]
+
+        def split():
+            try:
+                pending: list[Document] = []
+                for start_idx in range(0, len(text_docs), self.chunk_batch_size):
+                    chunks = self.split_text_docs(
+                        text_docs[start_idx : start_idx + self.chunk_batch_size],
+                        page_label_to_thumbnail,
+                    )
+                    if self.incremental:
+                        self.assign_chunk_ids(chunks, file_id, chunk_keys)
+                    pending.extend(keep_new(chunks))
+                    while len(pending) >= self.chunk_batch_size:
+                        to_docstore.put(pending[: self.chunk_batch_size])
+                        pending = pending[self.chunk_batch_size :]
+                        if errors:
+                            return
+
+                pending.extend(keep_new(non_text_docs + thumbnail_docs))
+                for start_idx in range(0, len(pending), self.chunk_batch_size):
+                    to_docstore.put(
+                        pending[start_idx : start_idx + self.chunk_batch_size]
+                    )
+            except Exception as e:
+                errors.append(e)
+            finally:
+                to_docstore.put(_STAGE_END)
+                messages.put(_STAGE_END)
+
+        def store(chunks):
+            self.handle_chunks_docstore(chunks, file_id, relations)
+            n_chunks["docstore"] += len(chunks)
+            messages.put(
+                Document(
+                    f" => [{file_name}] Processed {n_chunks['docstore']} chunks",
+                    channel="debug",
+                )
+            )
+
+        def embed(chunks):
+            self.handle_chunks_vectorstore(chunks, file_id, relations)
+            n_chunks["vectorstore"] += len(chunks)
+            if self.VS:
+                messages.put(
+                    Document(
+                        f" => [{file_name}] Created embedding for "
+                        f"{n_chunks['vectorstore']} chunks",
+                        channel="debug",
+                    )
+                )
+
+        # in quick index mode, leave the embedding to a background job
+        embed_in_job = bool(self.run_embedding_in_thread and self.VS)
+        stages = [
+            threading.Thread(target=split),
             threading.Thread(
-                target=lambda: list(insert_chunks_to_vectorstore())
-            ).start()
-        else:
-            yield from insert_chunks_to_vectorstore()
+                target=_run_stage,
+                args=(
+                    store,
+                    to_docstore,
+                    None if embed_in_job else to_vectorstore,
+                    messages,
+                    errors,
+                ),
+            ),
+        ]
+        if not embed_in_job:
+            stages.append(
+                threading.Thread(
+                    target=_run_stage,
+                    args=(embed, to_vectorstore, None, messages, errors),
+                )
+            )
+        for stage in stages:
+            stage.start()
+
+        n_waiting = len(stages)
+        while n_waiting:
+            message = messages.get()
+            if message is _STAGE_END:
+                n_waiting -= 1
+            else:
+                yield message
+
+        if errors:
+            raise errors[0]
+
+        relations.flush()
+        if existing_ids is not None:
+            n_removed = self.delete_chunks(file_id, existing_ids - new_ids)
+            yield Document(
+                f" => [{file_name}] Kept {len(new_ids & existing_ids)} "
+                f"unchanged chunks, removed {n_removed} chunks",
+                channel="debug",
+            )
+
+        if embed_in_job:
+            yield self.submit_embedding_job(file_id, file_name)
 
         print("indexing step took", time.time() - s_time)
-        return n_chunks
+        return n_chunks["docstore"], n_chunks["tokens"]
 
-    def handle_chunks_docstore(self, chunks, file_id):
-        """Run chunks"""
-        # run embedding, add to both vector store and doc store
-        self.vector_indexing.add_to_docstore(chunks)
+    def count_tokens(self, chunks: list[Document]) -> int:
+        """Record the number of tokens of each chunk in its metadata
 
-        # record in the index
+        Chunks that already have `n_tokens` in their metadata, e.g. set by the
+        splitter, are not tokenized again.
+
+        Returns:
+            the total number of tokens of the chunks
+        """
+        token_func = self.get_token_func()
+        n_tokens = 0
+        for chunk in chunks:
+            if "n_tokens" not in chunk.metadata:
+                chunk.metadata["n_tokens"] = len(token_func(chunk.text))
+            n_tokens += chunk.metadata["n_tokens"]
+        return n_tokens
+
+    def submit_embedding_job(self, file_id: str, file_name: str) -> Document:
+        """Queue a background job to embed the stored chunks of a file"""
+        from .jobs import indexing_jobs
+
+        job_id = indexing_jobs.submit(self, file_id, file_name)
+        return Document(
+            f" => [{file_name}] Queued embedding job {job_id}", channel="debug"
+        )
+
+    def embed_pending_chunks(
+        self, file_id: str
+    ) -> Generator[tuple[int, int], None, None]:
+        """Embed the stored chunks of a file that don't have a vector yet
+
+        The chunks are embedded in batches of `chunk_batch_size`, and each batch is
+        recorded in the index as soon as it is in the vectorstore, so that the
+        embedding can be resumed from the last batch if it is interrupted. The
+        chunks that are not embedded, e.g. the page thumbnails, never get a vector
+        and are left out.
+
+        Args:
+            file_id: the file id
+
+        Yields:
+            the number of embedded chunks and the total number of chunks
+        """
         with Session(engine) as session:
-            nodes = []
-            for chunk in chunks:
-                nodes.append(
-                    self.Index(
-                        source_id=file_id,
-                        target_id=chunk.doc_id,
-                        relation_type="document",
+            doc_ids = [
+                target_id
+                for (target_id,) in session.execute(
+                    select(self.Index.target_id)
+                    .where(
+                        self.Index.source_id == file_id,
+                        self.Index.relation_type == "document",
                     )
+                    .order_by(self.Index.id)
                 )
-            session.add_all(nodes)
-            session.commit()
+            ]
+            vs_ids = {
+                target_id
+                for (target_id,) in session.execute(
+                    select(self.Index.target_id).where(
+                        self.Index.source_id == file_id,
+                        self.Index.relation_type == "vector",
+                    )
+                )
+            }
+
+        pending_ids = []
+        unembedded_ids = [doc_id for doc_id in doc_ids if doc_id not in vs_ids]
+        for start_idx in range(0, len(unembedded_ids), self.chunk_batch_size):
+            batch = unembedded_ids[start_idx : start_idx + self.chunk_batch_size]
+            pending_ids.extend(
+                chunk.doc_id
+                for chunk in self.DS.get(batch)
+                if self.is_embeddable(chunk)
+            )
+
+        n_done = len(vs_ids)
+        n_total = n_done + len(pending_ids)
+        yield n_done, n_total
+
+        for start_idx in range(0, len(pending_ids), self.chunk_batch_size):
+            batch = pending_ids[start_idx : start_idx + self.chunk_batch_size]
+            self.handle_chunks_vectorstore(self.DS.get(batch), file_id)
+            bump_index_version(self.Source.__tablename__)
+            n_done += len(batch)
+            yield n_done, n_total
 
-    def handle_chunks_vectorstore(self, chunks, file_id):
+    def handle_chunks_docstore(
+        self, chunks, file_id, relations: Optional[RelationWriter] = None
+    ):
         """Run chunks"""
         # run embedding, add to both vector store and doc store
-        self.vector_indexing.add_to_vectorstore(chunks)
+        with _get_store_lock(self.DS):
+            self.vector_indexing.add_to_docstore(chunks)
         self.vector_indexing.write_chunk_to_file(chunks)
 
+        # record in the index
+        relations = relations or RelationWriter(self.Index, file_id)
+        relations.add([chunk.doc_id for chunk in chunks], "document")
+
+    def handle_chunks_vectorstore(
+        self, chunks, file_id, relations: Optional[RelationWriter] = None
+    ):
+        """Run chunks"""
+        # placeholder docs, e.g. page thumbnails, are only kept in the doc store
+        chunks = [chunk for chunk in chunks if self.is_embeddable(chunk)]
+        if not chunks:
+            return
+
+        # run embedding, add to the vector store
+        if self.VS:
+            with _get_store_lock(self.VS):
+                self.vector_indexing.add_to_vectorstore(chunks)
+
         if self.VS:
             # record in the index
+            relations = relations or RelationWriter(self.Index, file_id)
+            relations.add([chunk.doc_id for chunk in chunks], "vector")
+
+    def is_embeddable(self, chunk: Document) -> bool:
+        """Check if the chunk has content worth embedding
+
+        Page thumbnails only have a placeholder text, so they are only embedded,
+        like the images, with `embed_images` and an embedding model that
+        supports images. Otherwise, the images are embedded by their text.
+        """
+        doc_type = chunk.metadata.get("type", "text")
+        if (
+            doc_type in ("thumbnail", "image")
+            and self.embed_images
+            and self.embedding.supports_images()
+        ):
+            return True
+        return doc_type != "thumbnail" and bool(chunk.text.strip())
+
+    def delete_chunks(self, file_id: str, chunk_ids: set[str]) -> int:
+        """Delete some chunks of a file from the docstore, vectorstore and index
+
+        Args:
+            file_id: the file id
+            chunk_ids: the ids of the chunks to delete
+
+        Returns:
+            the number of deleted chunks
+        """
+        ids = list(chunk_ids)
+        for start_idx in range(0, len(ids), self.chunk_batch_size):
+            batch = ids[start_idx : start_idx + self.chunk_batch_size]
+            cond = (self.Index.source_id == file_id, self.Index.target_id.in_(batch))
             with Session(engine) as session:
-                nodes = []
-                for chunk in chunks:
-                    nodes.append(
-                        self.Index(
-                            source_id=file_id,
-                            target_id=chunk.doc_id,
-                            relation_type="vector",
+                vs_ids = [
+                    target_id
+                    for (target_id,) in session.execute(
+                        select(self.Index.target_id).where(
+                            *cond, self.Index.relation_type == "vector"
                         )
                     )
-                session.add_all(nodes)
+                ]
+                session.execute(delete(self.Index).where(*cond))
                 session.commit()
 
+            if vs_ids and self.VS:
+                self.VS.delete(vs_ids)
+            self.DS.delete(batch)
+            if self.chunk_archive:
+                self.chunk_archive.remove(file_id, batch)
+
+        return len(ids)
+
+    def get_reusable_chunk_ids(self, file_id: str) -> Optional[set[str]]:
+        """Get the chunk ids of an indexed file that can be kept when reindexing
+
+        Chunks can only be kept if the file was indexed with the same index config.
+
+        Args:
+            file_id: the file id
+
+        Returns:
+            the chunk ids, or None if the file has to be fully reindexed
+        """
+        with Session(engine) as session:
+            result = session.execute(
+                select(self.Source).where(self.Source.id == file_id)
+            ).first()
+            if (
+                not result
+                or (result[0].note or {}).get("index_config") != self.get_index_config()
+            ):
+                return None
+
+            return {
+                target_id
+                for (target_id,) in session.execute(
+                    select(self.Index.target_id).where(
+                        self.Index.source_id == file_id,
+                        self.Index.relation_type == "document",
+                    )
+                )
+            }
+
     def get_id_if_exists(self, file_path: str | Path) -> Optional[str]:
         """Check if the file is already indexed
 
@@ -246,17 +777,75 @@ class IndexPipeline(BaseComponent):
 
         return file_id
 
-    def store_file(self, file_path: Path) -> str:
+    def get_file_hash(self, file_path: Path) -> str:
+        """Get the sha256 hash of the file content
+
+        Args:
+            file_path: the path to the file
+
+        Returns:
+            the hex digest of the file content
+        """
+        file_hash = sha256()
+        with file_path.open("rb") as fi:
+            for block in iter(lambda: fi.read(1024 * 1024), b""):
+                file_hash.update(block)
+        return file_hash.hexdigest()
+
+    def get_index_config(self) -> str:
+        """Get a fingerprint of the loader, splitter and embedding of the pipeline
+
+        A file indexed with the same content and the same fingerprint does not need
+        to be indexed again.
+        """
+        loader = self.get_from_path("loader")
+        splitter = self.get_from_path("splitter")
+        config = {
+            "loader": f"{loader.__class__.__module__}.{loader.__class__.__qualname__}",
+            "splitter": get_component_spec(splitter) if splitter else None,
+            "embedding": self.get_from_path("embedding").identity(),
+        }
+        return sha256(
+            json.dumps(config, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def is_unchanged(self, file_id: str, file_path: Path, file_hash: str) -> bool:
+        """Check if the indexed file has the same content and index config
+
+        Args:
+            file_id: the id of the indexed file
+            file_path: the path to the new file
+            file_hash: the sha256 hash of the new file content
+
+        Returns:
+            True if the file does not need to be indexed again
+        """
+        with Session(engine) as session:
+            result = session.execute(
+                select(self.Source).where(self.Source.id == file_id)
+            ).first()
+            if not result:
+                return False
+            source = result[0]
+
+        return (
+            source.size == file_path.stat().st_size
+            and source.path == file_hash
+            and (source.note or {}).get("index_config") == self.get_index_config()
+        )
+
+    def store_file(self, file_path: Path, file_hash: Optional[str] = None) -> str:
         """Store file into the database and storage, return the file id
 
         Args:
             file_path: the path to the file
+            file_hash: the sha256 hash of the file content, computed if not given
 
         Returns:
             the file id
         """
-        with file_path.open("rb") as fi:
-            file_hash = sha256(fi.read()).hexdigest()
+        if file_hash is None:
+            file_hash = self.get_file_hash(file_path)
 
         shutil.copy(file_path, self.FSPath / file_hash)
         source = self.Source(
@@ -272,8 +861,36 @@ class IndexPipeline(BaseComponent):
 
         return file_id
 
-    def finish(self, file_id: str, file_path: str | Path) -> str:
-        """Finish the indexing"""
+    def update_file(self, file_id: str, file_path: Path, file_hash: str):
+        """Replace the stored content of an indexed file, keeping its file id
+
+        Args:
+            file_id: the file id
+            file_path: the path to the new file
+            file_hash: the sha256 hash of the new file content
+        """
+        shutil.copy(file_path, self.FSPath / file_hash)
+        with Session(engine) as session:
+            result = session.execute(
+                select(self.Source).where(self.Source.id == file_id)
+            ).first()
+            if result:
+                source = result[0]
+                source.path = file_hash
+                source.size = file_path.stat().st_size
+                session.add(source)
+                session.commit()
+
+    def finish(
+        self, file_id: str, file_path: str | Path, n_tokens: Optional[int] = None
+    ) -> str:
+        """Finish the indexing
+
+        Args:
+            file_id: the file id
+            file_path: the path to the file
+            n_tokens: the number of tokens of the file, counted while splitting
+        """
         with Session(engine) as session:
             stmt = select(self.Source).where(self.Source.id == file_id)
             result = session.execute(stmt).first()
@@ -283,27 +900,22 @@ class IndexPipeline(BaseComponent):
             item = result[0]
 
             # populate the number of tokens
-            doc_ids_stmt = select(self.Index.target_id).where(
-                self.Index.source_id == file_id,
-                self.Index.relation_type == "document",
-            )
-            doc_ids = [_[0] for _ in session.execute(doc_ids_stmt)]
-            token_func = self.get_token_func()
-            if doc_ids and token_func:
-                docs = self.DS.get(doc_ids)
-                item.note["tokens"] = sum([len(token_func(doc.text)) for doc in docs])
+            if n_tokens is not None:
+                item.note["tokens"] = n_tokens
 
             # populate the note
             item.note["loader"] = self.get_from_path("loader").__class__.__name__
+            item.note["index_config"] = self.get_index_config()
 
             session.add(item)
             session.commit()
 
+        bump_index_version(self.Source.__tablename__)
         return file_id
 
     def get_token_func(self):
         """Get the token function for calculating the number of tokens"""
-        return _default_token_func
+        return get_encoding_for_model("gpt-3.5-turbo").encode
 
     def delete_file(self, file_id: str):
         """Delete a file from the db, including its chunks in docstore and vectorstore
@@ -329,6 +941,10 @@ class IndexPipeline(BaseComponent):
             self.VS.delete(vs_ids)
         if ds_ids:
             self.DS.delete(ds_ids)
+        if self.chunk_archive:
+            self.chunk_archive.delete(file_id)
+        release_blobs(self.Source.__tablename__, [file_id])
+        bump_index_version(self.Source.__tablename__)
 
     def run(
         self, file_path: str | Path, reindex: bool, **kwargs
@@ -343,6 +959,7 @@ class IndexPipeline(BaseComponent):
             file_path = file_path.resolve()
 
         file_id = self.get_id_if_exists(file_path)
+        existing_ids: Optional[set[str]] = None
 
         if isinstance(file_path, Path):
             if file_id is not None:
@@ -351,13 +968,31 @@ class IndexPipeline(BaseComponent):
                         f"File {file_path.name} already indexed. Please rerun with "
                         "reindex=True to force reindexing."
                     )
+
+                file_hash = self.get_file_hash(file_path)
+                if self.incremental:
+                    if self.is_unchanged(file_id, file_path, file_hash):
+                        yield Document(
+                            f" => Skipping unchanged {file_path.name}",
+                            channel="debug",
+                        )
+                        return file_id, []
+                    existing_ids = self.get_reusable_chunk_ids(file_id)
+
+                if existing_ids is not None:
+                    # only the changed chunks will be reindexed
+                    yield Document(
+                        f" => Updating changed chunks of {file_path.name}",
+                        channel="debug",
+                    )
+                    self.update_file(file_id, file_path, file_hash)
                 else:
                     # remove the existing records
                     yield Document(
                         f" => Removing old {file_path.name}", channel="debug"
                     )
                     self.delete_file(file_id)
-                    file_id = self.store_file(file_path)
+                    file_id = self.store_file(file_path, file_hash)
             else:
                 # add record to db
                 file_id = self.store_file(file_path)
@@ -382,9 +1017,11 @@ class IndexPipeline(BaseComponent):
         yield Document(f" => Converting {file_name} to text", channel="debug")
         docs = self.loader.load_data(file_path, extra_info=extra_info)
         yield Document(f" => Converted {file_name} to text", channel="debug")
-        yield from self.handle_docs(docs, file_id, file_name)
+        _, n_tokens = yield from self.handle_docs(
+            docs, file_id, file_name, existing_ids
+        )
 
-        self.finish(file_id, file_path)
+        self.finish(file_id, file_path, n_tokens)
 
         yield Document(f" => Finished indexing {file_name}", channel="debug")
         return file_id, docs
@@ -445,12 +1082,15 @@ class IndexDocumentPipeline(BaseFileIndexIndexing):
     def get_pipeline(cls, user_settings, index_settings) -> BaseFileIndexIndexing:
         use_quick_index_mode = user_settings.get("quick_index_mode", False)
         print("use_quick_index_mode", use_quick_index_mode)
+        embedding = embedding_models_manager[
+            index_settings.get("embedding", embedding_models_manager.get_default_name())
+        ]
+        if getattr(settings, "KH_EMBEDDING_CACHE", None):
+            embedding = CachedEmbeddings(
+                embedding=embedding, **settings.KH_EMBEDDING_CACHE
+            )
         obj = cls(
-            embedding=embedding_models_manager[
-                index_settings.get(
-                    "embedding", embedding_models_manager.get_default_name()
-                )
-            ],
+            embedding=embedding,
             run_embedding_in_thread=use_quick_index_mode,
             reader_mode=user_settings.get("reader_mode", "default"),
         )
@@ -490,13 +1130,17 @@ class IndexDocumentPipeline(BaseFileIndexIndexing):
         print("Using reader", reader)
         pipeline: IndexPipeline = IndexPipeline(
             loader=reader,
-            splitter=TokenSplitter(
+            splitter=TiktokenSplitter(
                 chunk_size=chunk_size or 1024,
                 chunk_overlap=chunk_overlap or 256,
                 separator="\n\n",
                 backup_separators=["\n", ".", "\u200B"],
             ),
             run_embedding_in_thread=self.run_embedding_in_thread,
+            staged=bool(self.staged_indexing),
+            incremental=bool(self.incremental_reindex),
+            defer_relation_writes=bool(self.defer_relation_writes),
+            embed_images=bool(self.embed_images),
             Source=self.Source,
             Index=self.Index,
             VS=self.VS,
@@ -519,11 +1163,14 @@ class IndexDocumentPipeline(BaseFileIndexIndexing):
     ) -> Generator[
         Document, None, tuple[list[str | None], list[str | None], list[Document]]
     ]:
-        print(f'Harshit IndexDocumentPipeline stream: {file_paths}')
+        print(f"Harshit IndexDocumentPipeline stream: {file_paths}")
         """Return a list of indexed file ids, and a list of errors"""
         if not isinstance(file_paths, list):
             file_paths = [file_paths]
 
+        if int(self.indexing_workers or 1) > 1 and len(file_paths) > 1:
+            return (yield from self.stream_parallel(file_paths, reindex, **kwargs))
+
         file_ids: list[str | None] = []
         errors: list[str | None] = []
         all_docs = []
@@ -553,6 +1200,7 @@ class IndexDocumentPipeline(BaseFileIndexIndexing):
                     content={
                         "file_path": file_path,
                         "file_name": file_name,
+                        "file_id": file_id,
                         "status": "success",
                     },
                     channel="index",
@@ -572,3 +1220,113 @@ class IndexDocumentPipeline(BaseFileIndexIndexing):
                 )
 
         return file_ids, errors, all_docs
+
+    def stream_parallel(
+        self, file_paths: list[str | Path], reindex: bool = False, **kwargs
+    ) -> Generator[
+        Document, None, tuple[list[str | None], list[str | None], list[Document]]
+    ]:
+        """Index multiple files concurrently with a bounded pool of workers
+
+        Each file runs through its own `IndexPipeline` in a worker thread. The
+        messages of each file are buffered and streamed back in the order of
+        `file_paths`, so the output is the same as indexing the files one by one.
+
+        At most `indexing_workers` files are in flight (being indexed or waiting to
+        be streamed back) at any time. If `indexing_memory_limit` is set, a new file
+        is only started when the total size of in-flight files stays under that
+        limit (in MB). The next file in order is always allowed to start.
+        """
+        file_paths = [
+            file_path if self.is_url(file_path) else Path(file_path)
+            for file_path in file_paths
+        ]
+        n_files = len(file_paths)
+        n_workers = int(self.indexing_workers)
+        memory_limit = int(self.indexing_memory_limit or 0) * 1024 * 1024
+        sizes = [
+            file_path.stat().st_size
+            if isinstance(file_path, Path) and file_path.is_file()
+            else 0
+            for file_path in file_paths
+        ]
+        outputs: list[queue.Queue] = [queue.Queue() for _ in file_paths]
+        # the auto nodes of this pipeline, e.g. `readers`, can't be resolved from
+        # several threads at once
+        route_lock = threading.Lock()
+
+        def index_file(idx: int):
+            file_path, output = file_paths[idx], outputs[idx]
+            try:
+                with route_lock:
+                    pipeline = self.route(file_path)
+                file_id, docs = _yield_to_queue(
+                    pipeline.stream(file_path, reindex=reindex, **kwargs), output
+                )
+                output.put(_FileIndexingResult(file_id, docs, None))
+            except Exception as e:
+                logger.exception(e)
+                output.put(_FileIndexingResult(None, [], str(e)))
+
+        file_ids: list[str | None] = []
+        errors: list[str | None] = []
+        all_docs = []
+
+        executor = ThreadPoolExecutor(
+            max_workers=n_workers, thread_name_prefix="file-indexing"
+        )
+        n_submitted, inflight_size = 0, 0
+        try:
+            for idx, file_path in enumerate(file_paths):
+                while n_submitted < n_files and n_submitted - idx < n_workers:
+                    if (
+                        n_submitted > idx
+                        and memory_limit
+                        and inflight_size + sizes[n_submitted] > memory_limit
+                    ):
+                        break
+                    executor.submit(index_file, n_submitted)
+                    inflight_size += sizes[n_submitted]
+                    n_submitted += 1
+
+                file_name = file_path if isinstance(file_path, str) else file_path.name
+                yield Document(
+                    content=f"Indexing [{idx + 1}/{n_files}]: {file_name}",
+                    channel="debug",
+                )
+
+                while True:
+                    item = outputs[idx].get()
+                    if isinstance(item, _FileIndexingResult):
+                        break
+                    yield item
+                inflight_size -= sizes[idx]
+
+                file_ids.append(item.file_id)
+                errors.append(item.error)
+                all_docs.extend(item.docs)
+                if item.error is None:
+                    yield Document(
+                        content={
+                            "file_path": file_path,
+                            "file_name": file_name,
+                            "file_id": item.file_id,
+                            "status": "success",
+                        },
+                        channel="index",
+                    )
+                else:
+                    yield Document(
+                        content={
+                            "file_path": file_path,
+                            "file_name": file_name,
+                            "status": "failed",
+                            "message": item.error,
+                        },
+                        channel="index",
+                    )
+        finally:
+            # don't block the caller if it stops consuming the stream early
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        return file_ids, errors, all_docs
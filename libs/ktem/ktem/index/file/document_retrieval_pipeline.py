@@ -8,7 +8,6 @@ from collections import defaultdict
 from typing import Optional, Sequence
 
 from decouple import config
-from ktem.db.models import engine
 from ktem.embeddings.manager import embedding_models_manager
 from ktem.llms.manager import llms
 from ktem.rerankings.manager import reranking_models_manager
@@ -19,8 +18,6 @@ from llama_index.core.vector_stores import (
     MetadataFilters,
 )
 from llama_index.core.vector_stores.types import VectorStoreQueryMode
-from sqlalchemy import select
-from sqlalchemy.orm import Session
 
 from kotaemon.base import Node, RetrievedDocument
 from kotaemon.embeddings import BaseEmbeddings
@@ -28,6 +25,7 @@ from kotaemon.indices import VectorRetrieval
 from kotaemon.indices.rankings import BaseReranking, LLMReranking, LLMTrulensScoring
 
 from .base import BaseFileIndexRetriever
+from .retrieval_cache import file_scope_resolver, get_index_version, retrieval_cache
 
 logger = logging.getLogger(__name__)
 
@@ -44,6 +42,8 @@ class DocumentRetrievalPipeline(BaseFileIndexRetriever):
             for surrounding tables (e.g. within the page)
         top_k: number of documents to retrieve
         mmr: whether to use mmr to re-rank the documents
+        use_cache: whether to reuse the results of the same retrieval, as long as
+            the index doesn't change
     """
 
     embedding: BaseEmbeddings
@@ -54,6 +54,10 @@ class DocumentRetrievalPipeline(BaseFileIndexRetriever):
     mmr: bool = False
     top_k: int = 5
     retrieval_mode: str = "hybrid"
+    fusion_method: str = "rrf"
+    vector_weight: float = 1.0
+    text_weight: float = 1.0
+    use_cache: bool = True
 
     @Node.auto(depends_on=["embedding", "VS", "DS"])
     def vector_retrieval(self) -> VectorRetrieval:
@@ -62,6 +66,9 @@ class DocumentRetrievalPipeline(BaseFileIndexRetriever):
             vector_store=self.VS,
             doc_store=self.DS,
             retrieval_mode=self.retrieval_mode,  # type: ignore
+            fusion_method=self.fusion_method,  # type: ignore
+            vector_weight=self.vector_weight,  # type: ignore
+            text_weight=self.text_weight,  # type: ignore
             rerankers=self.rerankers,
         )
 
@@ -96,28 +103,83 @@ class DocumentRetrievalPipeline(BaseFileIndexRetriever):
             logger.info(f"Skip retrieval because of no selected files: {self}")
             return []
 
+        cache_key = None
+        if self.use_cache and retrieval_cache is not None:
+            cache_key = self.get_cache_key(text, doc_ids)
+            docs = retrieval_cache.get(cache_key)
+            if docs is not None:
+                logger.debug(f"Retrieval cache hit: {text}")
+                return docs
+
+        docs = self.retrieve(text, doc_ids)
+        if cache_key is not None:
+            retrieval_cache.set(cache_key, docs)
+        return docs
+
+    def get_cache_key(self, text: str, doc_ids: list[str]) -> tuple:
+        """Get the key of the retrieval result in the retrieval cache
+
+        The key includes the version of the index, so the results cached before
+        any change to the index are not used anymore.
+        """
+        source_table = self.Source.__tablename__
+        retrieval_settings = json.dumps(
+            [
+                self.top_k,
+                self.retrieval_mode,
+                self.mmr,
+                self.get_extra_table,
+                self.fusion_method,
+                self.vector_weight,
+                self.text_weight,
+                self.get_from_path("embedding").identity(),
+                [reranker.dump() for reranker in self.rerankers],
+            ],
+            sort_keys=True,
+            default=str,
+        )
+        return (
+            source_table,
+            get_index_version(source_table),
+            text,
+            tuple(sorted(set(doc_ids))),
+            retrieval_settings,
+        )
+
+    def retrieve(self, text: str, doc_ids: list[str]) -> list[RetrievedDocument]:
+        """Retrieve document excerpts similar to the text, without the cache
+
+        Args:
+            text: the text to retrieve similar documents
+            doc_ids: list of document ids to constraint the retrieval, flattened
+        """
         retrieval_kwargs: dict = {}
-        with Session(engine) as session:
-            stmt = select(self.Index).where(
-                self.Index.relation_type == "document",
-                self.Index.source_id.in_(doc_ids),
-            )
-            results = session.execute(stmt)
-            chunk_ids = [r[0].target_id for r in results.all()]
 
         # do first round top_k extension
         retrieval_kwargs["do_extend"] = True
-        retrieval_kwargs["scope"] = chunk_ids
-        retrieval_kwargs["filters"] = MetadataFilters(
-            filters=[
-                MetadataFilter(
-                    key="file_id",
-                    value=doc_ids,
-                    operator=FilterOperator.IN,
-                )
-            ],
-            condition=FilterCondition.OR,
-        )
+        if file_scope_resolver.is_all_files(
+            self.Source, doc_ids, self.user_id if self.private else None
+        ):
+            # no need to restrict the search to the selected files
+            retrieval_kwargs["search_all"] = True
+        else:
+            # the docstore can only be scoped by chunk ids, the vectorstore is
+            # scoped by the file_id metadata instead if it supports the filters
+            retrieval_kwargs["scope"] = file_scope_resolver.get_chunk_ids(
+                self.Source, self.Index, doc_ids
+            )
+            if self.VS.supports_filters:
+                retrieval_kwargs["vector_scope"] = None
+            retrieval_kwargs["filters"] = MetadataFilters(
+                filters=[
+                    MetadataFilter(
+                        key="file_id",
+                        value=doc_ids,
+                        operator=FilterOperator.IN,
+                    )
+                ],
+                condition=FilterCondition.OR,
+            )
 
         if self.mmr:
             # TODO: double check that llama-index MMR works correctly
@@ -252,6 +314,9 @@ class DocumentRetrievalPipeline(BaseFileIndexRetriever):
                 )
             ],
             retrieval_mode=user_settings["retrieval_mode"],
+            fusion_method=index_settings.get("hybrid_fusion", "rrf"),
+            vector_weight=float(index_settings.get("hybrid_vector_weight", 1.0)),
+            text_weight=float(index_settings.get("hybrid_text_weight", 1.0)),
             llm_scorer=(LLMTrulensScoring() if use_llm_reranking else None),
             rerankers=[
                 reranking_models_manager[
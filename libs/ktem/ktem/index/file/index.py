@@ -15,6 +15,7 @@ from tzlocal import get_localzone
 from kotaemon.storages import BaseDocumentStore, BaseVectorStore
 
 from .base import BaseFileIndexIndexing, BaseFileIndexRetriever
+from .blob_refs import release_blobs
 
 
 def generate_uuid():
@@ -118,7 +119,7 @@ class FileIndex(BaseIndex):
             {
                 "__tablename__": f"index__{self.id}__index",
                 "id": Column(Integer, primary_key=True, autoincrement=True),
-                "source_id": Column(String),
+                "source_id": Column(String, index=True),
                 "target_id": Column(String),
                 "relation_type": Column(String),
                 "user": Column(String, default=""),
@@ -329,6 +330,9 @@ class FileIndex(BaseIndex):
         self._resources["Source"].metadata.create_all(engine)  # type: ignore
         self._resources["Index"].metadata.create_all(engine)  # type: ignore
         self._resources["FileGroup"].metadata.create_all(engine)  # type: ignore
+        # index tables created before the source_id index was added don't have it
+        for table_index in self._resources["Index"].__table__.indexes:  # type: ignore
+            table_index.create(engine, checkfirst=True)
         self._fs_path.mkdir(parents=True, exist_ok=True)
 
     def on_delete(self):
@@ -342,6 +346,7 @@ class FileIndex(BaseIndex):
         self._vs.drop()
         self._docstore.drop()
         shutil.rmtree(self._fs_path)
+        release_blobs(self._resources["Source"].__tablename__)
 
     def on_start(self):
         """Setup the classes and hooks"""
@@ -351,6 +356,12 @@ class FileIndex(BaseIndex):
         self._setup_file_index_ui_cls()
         self._setup_file_selector_ui_cls()
 
+        # resume the embedding jobs interrupted by the last shutdown
+        if getattr(flowsettings, "KH_INDEXING_JOBS_RESUME", True):
+            from .jobs import indexing_jobs
+
+            indexing_jobs.resume(self)
+
     def get_selector_component_ui(self):
         if self._selector_ui is None:
             self._selector_ui = self._selector_ui_cls(self._app, self)
@@ -435,11 +446,97 @@ class FileIndex(BaseIndex):
                     "Set 0 to use developer setting."
                 ),
             },
+            "indexing_workers": {
+                "name": "Number of files to index in parallel",
+                "value": 1,
+                "component": "number",
+                "info": (
+                    "Number of files that are indexed at the same time. "
+                    "Set 1 to index files one by one."
+                ),
+            },
+            "indexing_memory_limit": {
+                "name": "Memory limit of parallel indexing (MB)",
+                "value": 0,
+                "component": "number",
+                "info": (
+                    "Maximum total size of the files that are indexed at the same "
+                    "time. Set 0 to disable."
+                ),
+            },
+            "staged_indexing": {
+                "name": "Staged indexing",
+                "value": False,
+                "component": "radio",
+                "choices": [("Yes", True), ("No", False)],
+                "info": (
+                    "If enabled, splitting, storing and embedding the chunks of a "
+                    "file run concurrently."
+                ),
+            },
+            "incremental_reindex": {
+                "name": "Incremental reindexing",
+                "value": False,
+                "component": "radio",
+                "choices": [("Yes", True), ("No", False)],
+                "info": (
+                    "If enabled, reindexing skips the files whose content and "
+                    "indexing settings have not changed, and only re-embeds the "
+                    "changed chunks of the other files."
+                ),
+            },
+            "defer_relation_writes": {
+                "name": "Defer index writes",
+                "value": False,
+                "component": "radio",
+                "choices": [("Yes", True), ("No", False)],
+                "info": (
+                    "If enabled, the chunks of a file are recorded in the index "
+                    "database in a single transaction once the whole file is "
+                    "stored, instead of after every batch."
+                ),
+            },
+            "hybrid_fusion": {
+                "name": "Hybrid retrieval fusion",
+                "value": "rrf",
+                "component": "dropdown",
+                "choices": [
+                    ("Reciprocal rank fusion", "rrf"),
+                    ("Weighted scores", "weighted"),
+                ],
+                "info": (
+                    "How the vector search and full-text search results are "
+                    "merged in hybrid retrieval mode."
+                ),
+            },
+            "hybrid_vector_weight": {
+                "name": "Hybrid retrieval vector search weight",
+                "value": 1.0,
+                "component": "number",
+                "info": "Weight of the vector search results in hybrid retrieval.",
+            },
+            "hybrid_text_weight": {
+                "name": "Hybrid retrieval full-text search weight",
+                "value": 1.0,
+                "component": "number",
+                "info": "Weight of the full-text search results in hybrid retrieval.",
+            },
+            "embed_images": {
+                "name": "Embed images",
+                "value": False,
+                "component": "radio",
+                "choices": [("Yes", True), ("No", False)],
+                "info": (
+                    "If enabled and the embedding model supports images, the page "
+                    "thumbnails and images are embedded. Otherwise, the thumbnails "
+                    "are only kept in the document store."
+                ),
+            },
         }
 
     def get_indexing_pipeline(self, settings, user_id) -> BaseFileIndexIndexing:
         """Define the interface of the indexing pipeline"""
-        print(f'Harshit get_indexing_pipeline settings: {settings}')
+        print(f"Harshit get_indexing_pipeline settings: {settings}")
         prefix = f"index.options.{self.id}."
         stripped_settings = {}
         for key, value in settings.items():
@@ -456,6 +553,12 @@ class FileIndex(BaseIndex):
         obj.private = self.config.get("private", False)
         obj.chunk_size = self.config.get("chunk_size", 0)
         obj.chunk_overlap = self.config.get("chunk_overlap", 0)
+        obj.indexing_workers = self.config.get("indexing_workers", 1)
+        obj.indexing_memory_limit = self.config.get("indexing_memory_limit", 0)
+        obj.staged_indexing = self.config.get("staged_indexing", False)
+        obj.incremental_reindex = self.config.get("incremental_reindex", False)
+        obj.defer_relation_writes = self.config.get("defer_relation_writes", False)
+        obj.embed_images = self.config.get("embed_images", False)
 
         return obj
 
@@ -483,6 +586,7 @@ class FileIndex(BaseIndex):
             obj.DS = self._docstore
             obj.FSPath = self._fs_path
             obj.user_id = user_id
+            obj.private = self.config.get("private", False)
             retrievers.append(obj)
 
         return retrievers
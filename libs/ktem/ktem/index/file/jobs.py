@@ -0,0 +1,268 @@
+"""Durable background jobs that embed the chunks of indexed files
+
+In quick index mode, the chunks of a file are stored in the docstore right away and
+their embedding is left to a background job. The jobs are recorded in the
+`IndexingJob` table and run by a fixed-size pool of workers, so that a burst of
+uploads doesn't start an unbounded number of threads.
+
+Each embedded batch is committed to the Index relation table of the file index,
+which serves as the checkpoint of the job: a job interrupted by a restart is
+resumed when its file index starts, and only embeds the chunks that don't have a
+vector yet.
+
+Every process of the app resumes the unfinished jobs when it starts, so a job is
+claimed with a conditional update of its attempt number before it runs, and only
+the worker that claimed it runs it. A running job sends a heartbeat every
+`KH_INDEXING_JOB_HEARTBEAT` seconds, and is only resumed by another process once
+it missed 3 heartbeats, i.e. once the process running it stopped.
+"""
+
+from __future__ import annotations
+
+import datetime
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+from ktem.db.models import IndexingJob, engine
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+from theflow.settings import settings
+from tzlocal import get_localzone
+
+logger = logging.getLogger(__name__)
+
+UNFINISHED_STATUSES = ("pending", "running")
+
+# number of missed heartbeats after which a running job is considered stopped
+_MISSED_HEARTBEATS = 3
+
+
+def _seconds_since(date: datetime.datetime) -> float:
+    now = datetime.datetime.now(get_localzone())
+    if date.tzinfo is None:
+        # the database may drop the timezone of the local dates
+        date = date.replace(tzinfo=now.tzinfo)
+    return (now - date).total_seconds()
+
+
+class IndexingJobQueue:
+    """Run the background indexing jobs with a fixed number of workers
+
+    Args:
+        n_workers: the number of jobs that can run at the same time
+        heartbeat: the number of seconds between the heartbeats of a running job
+    """
+
+    def __init__(self, n_workers: int = 2, heartbeat: float = 30):
+        self._executor = ThreadPoolExecutor(
+            max_workers=n_workers, thread_name_prefix="indexing-job"
+        )
+        self._heartbeat = heartbeat
+
+    def submit(self, pipeline, file_id: str, file_name: str) -> str:
+        """Create a job to embed the chunks of a file and queue it
+
+        Args:
+            pipeline: the `IndexPipeline` that stored the chunks of the file
+            file_id: the file id
+            file_name: the file name
+
+        Returns:
+            the job id
+        """
+        job = IndexingJob(
+            source_table=pipeline.Source.__tablename__,
+            file_id=file_id,
+            file_name=file_name,
+            user=pipeline.user_id or "",
+        )
+        with Session(engine) as session:
+            session.add(job)
+            session.commit()
+            job_id = job.id
+
+        self._executor.submit(self._run, job_id, 0, pipeline)
+        return job_id
+
+    def resume(self, index) -> list[str]:
+        """Queue the unfinished jobs of a file index again
+
+        The jobs running in another process are checked again once their
+        heartbeat is due, and resumed if it stopped.
+
+        Args:
+            index: the file index
+
+        Returns:
+            the ids of the resumed jobs
+        """
+        stmt = select(IndexingJob).where(
+            IndexingJob.source_table == index._resources["Source"].__tablename__,
+            IndexingJob.status.in_(UNFINISHED_STATUSES),  # type: ignore
+        )
+        with Session(engine) as session:
+            jobs = [job for (job,) in session.execute(stmt)]
+
+        resumed = []
+        for job in jobs:
+            try:
+                indexing_pipeline = index.get_indexing_pipeline({}, job.user)
+                file_path = (
+                    job.file_name
+                    if indexing_pipeline.is_url(job.file_name)
+                    else Path(job.file_name)
+                )
+                pipeline = indexing_pipeline.route(file_path)
+            except Exception as e:
+                logger.exception(e)
+                self._update(job.id, status="failed", error=str(e))
+                continue
+
+            self._schedule(job, pipeline)
+            resumed.append(job.id)
+
+        if resumed:
+            logger.info(f"Resumed {len(resumed)} indexing jobs of index {index.id}")
+        return resumed
+
+    def _schedule(self, job: IndexingJob, pipeline):
+        """Queue the job, or check it again when its heartbeat is overdue"""
+        delay = 0.0
+        if job.status == "running":
+            delay = self._heartbeat * _MISSED_HEARTBEATS - _seconds_since(
+                job.date_updated
+            )
+
+        if delay <= 0:
+            self._executor.submit(self._run, job.id, job.n_attempts, pipeline)
+            return
+
+        timer = threading.Timer(delay, self._check, (job.id, pipeline))
+        timer.daemon = True
+        timer.start()
+
+    def _check(self, job_id: str, pipeline):
+        with Session(engine) as session:
+            job = session.get(IndexingJob, job_id)
+        if job is not None and job.status in UNFINISHED_STATUSES:
+            self._schedule(job, pipeline)
+
+    def _claim(self, job_id: str, n_attempts: int) -> bool:
+        """Mark the job as running, unless another worker claimed it first
+
+        Args:
+            job_id: the job id
+            n_attempts: the attempt number of the job when it was queued
+
+        Returns:
+            True if the job is claimed by the caller
+        """
+        stmt = (
+            update(IndexingJob)
+            .where(
+                IndexingJob.id == job_id,  # type: ignore
+                IndexingJob.n_attempts == n_attempts,  # type: ignore
+                IndexingJob.status.in_(UNFINISHED_STATUSES),  # type: ignore
+            )
+            .values(
+                status="running",
+                n_attempts=n_attempts + 1,
+                date_updated=datetime.datetime.now(get_localzone()),
+            )
+        )
+        with Session(engine) as session:
+            claimed = session.execute(stmt).rowcount == 1
+            session.commit()
+        return claimed
+
+    def _update(self, job_id: str, **values):
+        with Session(engine) as session:
+            job = session.get(IndexingJob, job_id)
+            if job is None:
+                return
+            for key, value in values.items():
+                setattr(job, key, value)
+            job.date_updated = datetime.datetime.now(get_localzone())
+            session.add(job)
+            session.commit()
+
+    def _run(self, job_id: str, n_attempts: int, pipeline):
+        if not self._claim(job_id, n_attempts):
+            logger.info(f"Indexing job {job_id} is run by another worker")
+            return
+
+        with Session(engine) as session:
+            job = session.get(IndexingJob, job_id)
+            if job is None:
+                return
+            file_id = job.file_id
+
+        stop_heartbeat = threading.Event()
+
+        def send_heartbeats():
+            while not stop_heartbeat.wait(self._heartbeat):
+                self._update(job_id)
+
+        threading.Thread(target=send_heartbeats, daemon=True).start()
+        try:
+            for n_done, n_total in pipeline.embed_pending_chunks(file_id):
+                self._update(job_id, n_done=n_done, n_total=n_total)
+        except Exception as e:
+            logger.exception(e)
+            self._update(job_id, status="failed", error=str(e))
+        else:
+            self._update(job_id, status="completed", error=None)
+        finally:
+            stop_heartbeat.set()
+
+
+def get_job(job_id: str) -> Optional[dict]:
+    """Get the status and progress of a job
+
+    Args:
+        job_id: the job id
+
+    Returns:
+        the job record, or None if the job doesn't exist
+    """
+    with Session(engine) as session:
+        job = session.get(IndexingJob, job_id)
+        return job.model_dump() if job else None
+
+
+def list_jobs(
+    source_table: Optional[str] = None,
+    file_ids: Optional[list[str]] = None,
+    status: Optional[str | list[str]] = None,
+) -> list[dict]:
+    """List the jobs, most recent first
+
+    Args:
+        source_table: only list the jobs of the file index with this Source table
+        file_ids: only list the jobs of these files
+        status: only list the jobs with this status (or one of these statuses)
+
+    Returns:
+        the job records
+    """
+    stmt = select(IndexingJob)
+    if source_table is not None:
+        stmt = stmt.where(IndexingJob.source_table == source_table)
+    if file_ids is not None:
+        stmt = stmt.where(IndexingJob.file_id.in_(file_ids))  # type: ignore
+    if status is not None:
+        statuses = [status] if isinstance(status, str) else status
+        stmt = stmt.where(IndexingJob.status.in_(statuses))  # type: ignore
+    stmt = stmt.order_by(IndexingJob.date_created.desc())  # type: ignore
+
+    with Session(engine) as session:
+        return [job.model_dump() for (job,) in session.execute(stmt)]
+
+
+indexing_jobs = IndexingJobQueue(
+    getattr(settings, "KH_INDEXING_JOB_WORKERS", 2),
+    getattr(settings, "KH_INDEXING_JOB_HEARTBEAT", 30),
+)
@@ -0,0 +1,243 @@
+"""Cache of the retrieval results of the file indices
+
+Asking the same question again, or regenerating an answer, retrieves the same
+documents as long as the index doesn't change. The results are cached in memory,
+keyed by the query, the selected files and the retrieval settings, together with
+the version of the index.
+
+The version of an index is recorded in the `IndexVersion` table and bumped by
+every change to the index: a file indexed, reindexed or deleted, or a batch of
+chunks embedded by a background job. A change made by another process, e.g. the
+batch indexer, is seen as well, and the outdated results are never returned
+again; they are evicted once they are the least recently used.
+
+The chunk ids of the selected files, which scope the retrieval, are cached per
+index version as well, see `FileScopeResolver`.
+"""
+
+from __future__ import annotations
+
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+from ktem.db.models import IndexVersion, engine
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from theflow.settings import settings
+
+from kotaemon.base import RetrievedDocument
+
+
+def get_index_version(source_table: str) -> int:
+    """Get the version of a file index
+
+    Args:
+        source_table: the name of the Source table of the file index
+
+    Returns:
+        the version, 0 if the index never changed
+    """
+    with Session(engine) as session:
+        record = session.get(IndexVersion, source_table)
+        return record.version if record else 0
+
+
+def bump_index_version(source_table: str):
+    """Mark a file index as changed, invalidating its cached retrieval results
+
+    Args:
+        source_table: the name of the Source table of the file index
+    """
+    stmt = (
+        update(IndexVersion)
+        .where(IndexVersion.source_table == source_table)  # type: ignore
+        .values(version=IndexVersion.version + 1)
+    )
+    with Session(engine) as session:
+        if session.execute(stmt).rowcount == 0:
+            session.add(IndexVersion(source_table=source_table, version=1))
+            try:
+                session.commit()
+                return
+            except IntegrityError:
+                # created at the same time by another writer
+                session.rollback()
+                session.execute(stmt)
+        session.commit()
+
+
+class RetrievalCache:
+    """In-memory LRU cache of retrieval results
+
+    The cached documents are copied in and out of the cache, so that callers can
+    modify the documents they get.
+
+    Args:
+        max_entries: the maximum number of results to keep
+        ttl: the number of seconds a result is kept, 0 to keep it until evicted
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 3600):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._entries: OrderedDict[
+            Hashable, tuple[float, list[RetrievedDocument]]
+        ] = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[list[RetrievedDocument]]:
+        """Get a copy of the cached result, or None if it isn't cached"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and self._ttl and time.time() - entry[0] >= self._ttl:
+                del self._entries[key]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(entry[1])
+
+    def set(self, key: Hashable, docs: list[RetrievedDocument]):
+        """Cache a copy of the result"""
+        docs = copy.deepcopy(docs)
+        with self._lock:
+            self._entries[key] = (time.time(), docs)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        """Get the number of cached results, hits and misses"""
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def clear(self):
+        """Remove all the cached results"""
+        with self._lock:
+            self._entries.clear()
+
+
+class FileScopeResolver:
+    """Resolve the selected files of a file index to the ids of their chunks
+
+    The chunk ids of each file are cached until the version of the index
+    changes, and only the files missing from the cache are looked up, in a
+    single query. When every file the user can see is selected, no scope is
+    needed at all.
+
+    Args:
+        max_files: the maximum number of files whose chunk ids are kept per
+            index, the least recently used ones are evicted first
+    """
+
+    def __init__(self, max_files: int = 10_000):
+        self._max_files = max_files
+        # by Source table name: the index version, the ids of all the files by
+        # user (None for all the users), and the chunk ids by file id
+        self._versions: dict[str, int] = {}
+        self._all_files: dict[str, dict[Optional[str], frozenset[str]]] = {}
+        self._chunks: dict[str, OrderedDict[str, tuple[str, ...]]] = {}
+        self._lock = threading.Lock()
+
+    def _sync_version(self, source_table: str) -> int:
+        version = get_index_version(source_table)
+        if self._versions.get(source_table) != version:
+            self._versions[source_table] = version
+            self._all_files[source_table] = {}
+            self._chunks[source_table] = OrderedDict()
+        return version
+
+    def is_all_files(
+        self, Source, file_ids: list[str], user_id: Optional[str] = None
+    ) -> bool:
+        """Check if the files are all the files of the index the user can see
+
+        Args:
+            Source: the Source table of the file index
+            file_ids: the ids of the files
+            user_id: the user of a private index, None if the index is shared
+        """
+        source_table = Source.__tablename__
+        with self._lock:
+            version = self._sync_version(source_table)
+            all_files = self._all_files[source_table].get(user_id)
+
+        if all_files is None:
+            stmt = select(Source.id)
+            if user_id is not None:
+                stmt = stmt.where(Source.user == user_id)
+            with Session(engine) as session:
+                all_files = frozenset(session.execute(stmt).scalars())
+            with self._lock:
+                # don't cache the files if the index changed during the query
+                if self._sync_version(source_table) == version:
+                    self._all_files[source_table][user_id] = all_files
+
+        return all_files.issubset(file_ids)
+
+    def get_chunk_ids(self, Source, Index, file_ids: list[str]) -> list[str]:
+        """Get the ids of the chunks of the files
+
+        Args:
+            Source: the Source table of the file index
+            Index: the Index table of the file index
+            file_ids: the ids of the files
+
+        Returns:
+            the chunk ids
+        """
+        source_table = Source.__tablename__
+        file_ids = list(dict.fromkeys(file_ids))
+        with self._lock:
+            version = self._sync_version(source_table)
+            chunks = self._chunks[source_table]
+            found = {
+                file_id: chunks[file_id] for file_id in file_ids if file_id in chunks
+            }
+            for file_id in found:
+                chunks.move_to_end(file_id)
+
+        missing = [file_id for file_id in file_ids if file_id not in found]
+        if missing:
+            loaded: dict[str, list[str]] = {file_id: [] for file_id in missing}
+            with Session(engine) as session:
+                rows = session.execute(
+                    select(Index.source_id, Index.target_id).where(
+                        Index.relation_type == "document",
+                        Index.source_id.in_(missing),
+                    )
+                )
+                for source_id, target_id in rows:
+                    loaded[source_id].append(target_id)
+
+            found.update(
+                (file_id, tuple(chunk_ids)) for file_id, chunk_ids in loaded.items()
+            )
+            with self._lock:
+                # don't cache the chunks if the index changed during the query
+                if self._sync_version(source_table) == version:
+                    chunks = self._chunks[source_table]
+                    for file_id in loaded:
+                        chunks[file_id] = found[file_id]
+                    while len(chunks) > self._max_files:
+                        chunks.popitem(last=False)
+
+        return [chunk_id for file_id in file_ids for chunk_id in found[file_id]]
+
+
+file_scope_resolver = FileScopeResolver()
+
+_cache_settings = getattr(settings, "KH_RETRIEVAL_CACHE", {})
+retrieval_cache: Optional[RetrievalCache] = (
+    RetrievalCache(**_cache_settings) if _cache_settings is not None else None
+)
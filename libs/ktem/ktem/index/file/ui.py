@@ -6,7 +6,7 @@ import tempfile
 import zipfile
 from copy import deepcopy
 from pathlib import Path
-from typing import Generator
+from typing import Generator, Optional
 
 import gradio as gr
 import pandas as pd
@@ -19,8 +19,13 @@ from sqlalchemy import select
 from sqlalchemy.orm import Session
 from theflow.settings import settings as flowsettings
 
+from kotaemon.storages import ChunkArchive, get_chunk_archive
+
 from ...utils.commands import WEB_SEARCH_COMMAND
 from ...utils.rate_limit import check_rate_limit
+from .blob_refs import release_blobs
+from .jobs import list_jobs
+from .retrieval_cache import bump_index_version
 from .utils import download_arxiv_pdf, is_arxiv_url
 
 KH_DEMO_MODE = getattr(flowsettings, "KH_DEMO_MODE", False)
@@ -29,6 +34,24 @@ DOWNLOAD_MESSAGE = "Start download"
 MAX_FILENAME_LENGTH = 20
 MAX_FILE_COUNT = 200
 
+
+def get_file_chunk_archive() -> Optional[ChunkArchive]:
+    """Get the archive of the indexed chunks, if `KH_CHUNKS_OUTPUT_DIR` is set"""
+    cache_dir = getattr(flowsettings, "KH_CHUNKS_OUTPUT_DIR", None)
+    return get_chunk_archive(cache_dir) if cache_dir else None
+
+
+def write_chunks_to_zip(
+    zip_file: zipfile.ZipFile, archive: ChunkArchive, file_id: str, file_name: str
+):
+    """Stream the archived chunks of a file into a zip file as markdown"""
+    if not archive.exists(file_id):
+        return
+    with zip_file.open(f"{file_name}.chunks.md", "w") as fo:
+        for content in archive.export_markdown(file_id):
+            fo.write(content.encode("utf-8"))
+
+
 chat_input_focus_js = """
 function() {
     let chatInput = document.querySelector("#chat-input textarea");
@@ -180,9 +203,10 @@ class FileIndexPage(BasePage):
                 "size",
                 "tokens",
                 "loader",
+                "status",
                 "date_created",
             ],
-            column_widths=["0%", "50%", "8%", "7%", "15%", "20%"],
+            column_widths=["0%", "40%", "8%", "7%", "13%", "12%", "20%"],
             interactive=False,
             wrap=False,
             elem_id="file_list_view",
@@ -398,15 +422,20 @@ class FileIndexPage(BasePage):
             # get the chunks
 
             Index = self._index._resources["Index"]
+            archive = get_file_chunk_archive()
             with Session(engine) as session:
-                matches = session.execute(
-                    select(Index).where(
-                        Index.source_id == file_id,
-                        Index.relation_type == "document",
+                if archive and archive.exists(file_id):
+                    archive.flush()
+                    docs = list(archive.read(file_id))
+                else:
+                    matches = session.execute(
+                        select(Index).where(
+                            Index.source_id == file_id,
+                            Index.relation_type == "document",
+                        )
                     )
-                )
-                doc_ids = [doc.target_id for (doc,) in matches]
-                docs = self._index._docstore.get(doc_ids)
+                    doc_ids = [doc.target_id for (doc,) in matches]
+                    docs = self._index._docstore.get(doc_ids)
                 docs = sorted(
                     docs, key=lambda x: x.metadata.get("page_label", float("inf"))
                 )
@@ -473,6 +502,11 @@ class FileIndexPage(BasePage):
         if vs_ids:
             self._index._vs.delete(vs_ids)
         self._index._docstore.delete(ds_ids)
+        archive = get_file_chunk_archive()
+        if archive:
+            archive.delete(file_id)
+        release_blobs(self._index._resources["Source"].__tablename__, [file_id])
+        bump_index_version(self._index._resources["Source"].__tablename__)
 
         gr.Info(f"File {file_name} has been deleted")
 
@@ -494,11 +528,6 @@ class FileIndexPage(BasePage):
         if source:
             target_file_name = Path(source[0].name)
         zip_files = []
-        for file_name in os.listdir(flowsettings.KH_CHUNKS_OUTPUT_DIR):
-            if target_file_name.stem in file_name:
-                zip_files.append(
-                    os.path.join(flowsettings.KH_CHUNKS_OUTPUT_DIR, file_name)
-                )
         for file_name in os.listdir(flowsettings.KH_MARKDOWN_OUTPUT_DIR):
             if target_file_name.stem in file_name:
                 zip_files.append(
@@ -507,7 +536,12 @@ class FileIndexPage(BasePage):
         zip_file_path = os.path.join(
             flowsettings.KH_ZIP_OUTPUT_DIR, target_file_name.stem
         )
+        archive = get_file_chunk_archive()
+        if archive:
+            archive.flush()
         with zipfile.ZipFile(f"{zip_file_path}.zip", "w") as zipMe:
+            if archive:
+                write_chunks_to_zip(zipMe, archive, file_id, target_file_name.name)
             for file in zip_files:
                 zipMe.write(file, arcname=os.path.basename(file))
 
@@ -553,14 +587,21 @@ class FileIndexPage(BasePage):
             raise gr.Error("This feature is not available for private collection.")
 
         zip_files = []
-        for file_name in os.listdir(flowsettings.KH_CHUNKS_OUTPUT_DIR):
-            zip_files.append(os.path.join(flowsettings.KH_CHUNKS_OUTPUT_DIR, file_name))
         for file_name in os.listdir(flowsettings.KH_MARKDOWN_OUTPUT_DIR):
             zip_files.append(
                 os.path.join(flowsettings.KH_MARKDOWN_OUTPUT_DIR, file_name)
             )
+        Source = self._index._resources["Source"]
+        with Session(engine) as session:
+            sources = session.execute(select(Source.id, Source.name)).all()
         zip_file_path = os.path.join(flowsettings.KH_ZIP_OUTPUT_DIR, "all")
+        archive = get_file_chunk_archive()
+        if archive:
+            archive.flush()
         with zipfile.ZipFile(f"{zip_file_path}.zip", "w") as zipMe:
+            if archive:
+                for file_id, file_name in sources:
+                    write_chunks_to_zip(zipMe, archive, file_id, file_name)
             for file in zip_files:
                 arcname = Path(file)
                 zipMe.write(file, arcname=arcname.name)
@@ -1101,7 +1142,7 @@ class FileIndexPage(BasePage):
             selected_files: the list of files already selected
             settings: the settings of the app
         """
-        print(f'Harshit index_fn: {files}')
+        print(f"Harshit index_fn: {files}")
         if urls:
             files = [it.strip() for it in urls.split("\n")]
             errors = self.validate_urls(files)
@@ -1350,6 +1391,28 @@ class FileIndexPage(BasePage):
             num /= 1024.0
         return f"{num:.0f}Yi{suffix}"
 
+    def get_job_status(self, file_ids: list[str]) -> dict[str, str]:
+        """Get the status of the last background indexing job of each file"""
+        source_table = self._index._resources["Source"].__tablename__
+        job_status = {}
+        for start_idx in range(0, len(file_ids), 500):
+            jobs = list_jobs(
+                source_table=source_table,
+                file_ids=file_ids[start_idx : start_idx + 500],
+            )
+            # the jobs are listed most recent first
+            for job in reversed(jobs):
+                if job["status"] == "running":
+                    status = f"embedding {job['n_done']}/{job['n_total']}"
+                elif job["status"] == "pending":
+                    status = "queued"
+                elif job["status"] == "failed":
+                    status = "embedding failed"
+                else:
+                    status = "indexed"
+                job_status[job["file_id"]] = status
+        return job_status
+
     def list_file(self, user_id, name_pattern=""):
         if user_id is None:
             # not signed in
@@ -1361,6 +1424,7 @@ class FileIndexPage(BasePage):
                         "size": "-",
                         "tokens": "-",
                         "loader": "-",
+                        "status": "-",
                         "date_created": "-",
                     }
                 ]
@@ -1382,11 +1446,17 @@ class FileIndexPage(BasePage):
                         each[0].note.get("tokens", "-"), suffix=""
                     ),
                     "loader": each[0].note.get("loader", "-"),
+                    "status": "indexed",
                     "date_created": each[0].date_created.strftime("%Y-%m-%d %H:%M:%S"),
                 }
                 for each in session.execute(statement).all()
             ]
 
+        # show the progress of the background embedding, in quick index mode
+        job_status = self.get_job_status([result["id"] for result in results])
+        for result in results:
+            result["status"] = job_status.get(result["id"], result["status"])
+
         if results:
             file_list = pd.DataFrame.from_records(results)
         else:
@@ -1398,6 +1468,7 @@ class FileIndexPage(BasePage):
                         "size": "-",
                         "tokens": "-",
                         "loader": "-",
+                        "status": "-",
                         "date_created": "-",
                     }
                 ]
@@ -1,5 +1,6 @@
 import logging
 import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 from textwrap import dedent
 from typing import Generator
 
@@ -92,6 +93,8 @@ class FullQAPipeline(BaseReasoning):
     # configuration parameters
     trigger_context: int = 150
     use_rewrite: bool = False
+    # seconds to wait for the retrievers, the results of slower ones are dropped
+    retriever_timeout: float = config("KH_RETRIEVER_TIMEOUT", default=60, cast=float)
 
     retrievers: list[BaseComponent]
 
@@ -127,10 +130,7 @@ class FullQAPipeline(BaseReasoning):
         docs, doc_ids = [], []
         plot_docs = []
 
-        for idx, retriever in enumerate(self.retrievers):
-            retriever_node = self._prepare_child(retriever, f"retriever_{idx}")
-            retriever_docs = retriever_node(text=query)
-
+        for retriever_docs in self.run_retrievers(query):
             retriever_docs_text = []
             retriever_docs_plot = []
 
@@ -163,6 +163,50 @@ class FullQAPipeline(BaseReasoning):
 
         return docs, info
 
+    def run_retrievers(self, query: str) -> list[list[RetrievedDocument]]:
+        """Run the retrievers concurrently
+
+        The timeout covers the whole batch: the retrievers all start at once, and
+        the results of those not finished `retriever_timeout` seconds later are
+        dropped, so that a slow backend doesn't hold up the answer.
+
+        Returns:
+            the documents of each retriever, in the order of the retrievers
+        """
+        # the child nodes are prepared upfront, from this thread only
+        retriever_nodes = [
+            self._prepare_child(retriever, f"retriever_{idx}")
+            for idx, retriever in enumerate(self.retrievers)
+        ]
+        if not retriever_nodes:
+            return []
+
+        executor = ThreadPoolExecutor(
+            max_workers=len(retriever_nodes),
+            thread_name_prefix="retriever",
+        )
+        try:
+            futures = [
+                executor.submit(retriever_node, text=query)
+                for retriever_node in retriever_nodes
+            ]
+            _, not_done = wait(futures, timeout=self.retriever_timeout or None)
+            results = []
+            for idx, future in enumerate(futures):
+                if future in not_done:
+                    logger.warning(
+                        f"Retriever {idx} ({type(self.retrievers[idx]).__name__}) "
+                        f"didn't finish in {self.retriever_timeout}s, its results "
+                        "are skipped"
+                    )
+                    results.append([])
+                else:
+                    results.append(future.result())
+            return results
+        finally:
+            # don't wait for the retrievers that timed out
+            executor.shutdown(wait=False, cancel_futures=True)
+
     def prepare_mindmap(self, answer) -> Document | None:
         mindmap = answer.metadata["mindmap"]
         if mindmap:
@@ -4,6 +4,7 @@ import markdown
 from fast_langdetect import detect
 
 from kotaemon.base import RetrievedDocument
+from kotaemon.storages import resolve_blob_url
 
 BASE_PATH = os.environ.get("GR_FILE_ROOT_PATH", "")
 
@@ -132,7 +133,7 @@ class Render:
     @staticmethod
     def image(url: str, text: str = "") -> str:
         """Render an image"""
-        img = f'<img src="{url}"><br>'
+        img = f'<img src="{resolve_blob_url(url)}"><br>'
         if text:
             caption = f"<p>{text}</p>"
             return f"<figure>{img}{caption}</figure><br>"
@@ -6,12 +6,11 @@ Refs:
 1. [RAGxplorer](https://github.com/gabrielchua/RAGxplorer)
 2. [RAGVizExpander](https://github.com/KKenny0/RAGVizExpander)
 """
-from typing import List, Tuple
+from typing import Any, List, Tuple
 
 import numpy as np
 import pandas as pd
 import plotly.graph_objs as go
-import umap
 
 from kotaemon.base import BaseComponent
 from kotaemon.embeddings import BaseEmbeddings
@@ -28,9 +27,12 @@ class CreateCitationVizPipeline(BaseComponent):
     """Creating PlotData for visualizing query results"""
 
     embedding: BaseEmbeddings
-    projector: umap.UMAP = None
+    projector: Any = None
 
     def _set_up_umap(self, embeddings: np.ndarray):
+        # umap is slow to import, only import it when a plot is requested
+        import umap
+
         umap_transform = umap.UMAP().fit(embeddings)
         return umap_transform
 
@@ -0,0 +1,140 @@
+import base64
+
+import pytest
+from ktem.index.file import blob_refs, document_indexing_pipeline
+from ktem.index.file import index as file_index
+from ktem.index.file import jobs, retrieval_cache
+from ktem.index.file.document_indexing_pipeline import IndexPipeline
+from ktem.index.file.index import FileIndex
+from sqlmodel import SQLModel, create_engine
+from theflow.settings import settings as flowsettings
+
+from kotaemon.base import Document, DocumentWithEmbedding
+from kotaemon.embeddings import BaseEmbeddings
+from kotaemon.indices.splitters import TiktokenSplitter
+from kotaemon.loaders import TxtReader
+from kotaemon.storages import (
+    InMemoryDocumentStore,
+    InMemoryVectorStore,
+    get_blob_store,
+)
+
+
+class LengthEmbeddings(BaseEmbeddings):
+    """Embed a text as its length, recording the embedded texts"""
+
+    dimension: int = 2
+    api_key: str = ""
+
+    def invoke(self, text, *args, **kwargs):
+        input_docs = self.prepare_input(text)
+        embedded_texts.extend(doc.text for doc in input_docs)
+        return [
+            DocumentWithEmbedding(
+                embedding=[float(len(doc.text))] + [1.0] * (self.dimension - 1),
+                content=doc,
+            )
+            for doc in input_docs
+        ]
+
+
+embedded_texts: list[str] = []
+
+THUMBNAIL = "data:image/png;base64," + base64.b64encode(b"png bytes").decode()
+
+
+class PageReader(TxtReader):
+    """Read a text file as a single page, with the thumbnail of the page"""
+
+    def load_data(self, file_path, extra_info=None, **kwargs) -> list[Document]:
+        metadata = {"page_label": 1, **(extra_info or {})}
+        (doc,) = super().load_data(file_path, extra_info=metadata, **kwargs)
+        thumbnail = Document(
+            text="Page 1",
+            metadata={"type": "thumbnail", "image_origin": THUMBNAIL, **metadata},
+        )
+        return [doc, thumbnail]
+
+
+@pytest.fixture(scope="function")
+def sql_engine(tmp_path, monkeypatch):
+    """A fresh database for the file index, instead of the one of the app"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'sql.db'}")
+    SQLModel.metadata.create_all(engine)
+    for module in (
+        document_indexing_pipeline,
+        jobs,
+        retrieval_cache,
+        file_index,
+        blob_refs,
+    ):
+        monkeypatch.setattr(module, "engine", engine)
+    return engine
+
+
+@pytest.fixture(scope="function")
+def blob_store(tmp_path, monkeypatch):
+    """Keep the images of the indexed files in a temporary blob store"""
+    monkeypatch.setattr(
+        flowsettings, "KH_BLOB_STORE_DIR", str(tmp_path / "blobs"), raising=False
+    )
+    return get_blob_store()
+
+
+@pytest.fixture(scope="function")
+def file_index_resources(sql_engine, tmp_path, monkeypatch):
+    """The tables and stores of a file index, kept in the temporary directory"""
+    monkeypatch.setattr(
+        file_index, "get_vectorstore", lambda name: InMemoryVectorStore()
+    )
+    monkeypatch.setattr(
+        file_index, "get_docstore", lambda name: InMemoryDocumentStore()
+    )
+    monkeypatch.setattr(file_index, "filestorage_path", tmp_path / "files")
+
+    index = FileIndex(app=None, id=1, name="test", config={})
+    index._setup_resources()
+    resources = index._resources
+    resources["Source"].metadata.create_all(sql_engine)
+    resources["FileStoragePath"].mkdir(parents=True)
+    return resources
+
+
+@pytest.fixture(scope="function")
+def make_index_pipeline(file_index_resources):
+    """Create an `IndexPipeline` of text files, split line by line"""
+    embedded_texts.clear()
+
+    def make(**kwargs) -> IndexPipeline:
+        params = dict(
+            loader=TxtReader(),
+            # the chunks don't inherit the metadata of the files, which alone is
+            # longer than the chunk size
+            splitter=TiktokenSplitter(
+                chunk_size=16,
+                chunk_overlap=0,
+                separator="\n",
+                include_metadata=False,
+            ),
+            Source=file_index_resources["Source"],
+            Index=file_index_resources["Index"],
+            VS=file_index_resources["VectorStore"],
+            DS=file_index_resources["DocStore"],
+            FSPath=file_index_resources["FileStoragePath"],
+            user_id="default",
+            embedding=LengthEmbeddings(),
+        )
+        params.update(kwargs)
+        return IndexPipeline(**params)
+
+    return make
+
+
+def run_stream(gen):
+    """Exhaust a generator and return its messages and its value"""
+    messages = []
+    while True:
+        try:
+            messages.append(next(gen))
+        except StopIteration as e:
+            return messages, e.value
@@ -0,0 +1,62 @@
+from ktem.db.models import BlobReference
+from ktem.index.file.blob_refs import get_owner, release_blobs
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from kotaemon.loaders import TxtReader
+
+from .conftest import PageReader, run_stream
+from .test_file_indexing import LINES, write_file
+
+
+def get_blob_urls(sql_engine, owner: str) -> set[str]:
+    with Session(sql_engine) as session:
+        return set(
+            session.execute(
+                select(BlobReference.url).where(BlobReference.owner == owner)
+            ).scalars()
+        )
+
+
+def test_shared_blob_kept_while_referenced(
+    make_index_pipeline, sql_engine, tmp_path, blob_store
+):
+    pipeline = make_index_pipeline(loader=PageReader())
+    file_ids = []
+    for name in ("a.txt", "b.txt"):
+        file_path = write_file(tmp_path / name, [name] + LINES[:2])
+        _, (file_id, _) = run_stream(pipeline.stream(file_path, reindex=False))
+        file_ids.append(file_id)
+
+    source_table = pipeline.Source.__tablename__
+    (url,) = get_blob_urls(sql_engine, get_owner(source_table, file_ids[0]))
+    assert get_blob_urls(sql_engine, get_owner(source_table, file_ids[1])) == {url}
+
+    # the other file still references the thumbnail
+    pipeline.delete_file(file_ids[0])
+    assert not get_blob_urls(sql_engine, get_owner(source_table, file_ids[0]))
+    assert blob_store.exists(url)
+
+    # the file no longer references the thumbnail once reindexed without it
+    text_pipeline = make_index_pipeline(loader=TxtReader())
+    run_stream(text_pipeline.stream(tmp_path / "b.txt", reindex=True))
+    assert not get_blob_urls(sql_engine, get_owner(source_table, file_ids[1]))
+    assert not blob_store.exists(url)
+
+
+def test_release_blobs_of_the_index(
+    make_index_pipeline, sql_engine, tmp_path, blob_store
+):
+    pipeline = make_index_pipeline(loader=PageReader())
+    file_path = write_file(tmp_path / "doc.txt", LINES[:2])
+    _, (file_id, _) = run_stream(pipeline.stream(file_path, reindex=False))
+    source_table = pipeline.Source.__tablename__
+    (url,) = get_blob_urls(sql_engine, get_owner(source_table, file_id))
+
+    # the blobs of other indices are kept
+    assert release_blobs(f"{source_table}_other") == 0
+    assert blob_store.exists(url)
+
+    assert release_blobs(source_table) == 1
+    assert not get_blob_urls(sql_engine, get_owner(source_table, file_id))
+    assert not blob_store.exists(url)
@@ -0,0 +1,379 @@
+import threading
+from collections import defaultdict
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from ktem.index.file.document_indexing_pipeline import RelationWriter
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from kotaemon.base import Document
+
+from .conftest import (
+    THUMBNAIL,
+    LengthEmbeddings,
+    PageReader,
+    embedded_texts,
+    run_stream,
+)
+
+LINES = [f"Line {idx} of the document, about topic {idx}." for idx in range(6)]
+
+
+def write_file(path: Path, lines: list[str]) -> Path:
+    path.write_text("\n".join(lines), encoding="utf-8")
+    return path
+
+
+class ImageEmbeddings(LengthEmbeddings):
+    """Embed the docs by their length, recording the images they are given"""
+
+    embedded_images: list = []
+
+    def supports_images(self) -> bool:
+        return True
+
+    def invoke(self, text, *args, **kwargs):
+        input_docs = self.prepare_input(text)
+        self.embedded_images.extend(
+            (doc.metadata.get("image_origin"), self.get_image(doc))
+            for doc in input_docs
+        )
+        return super().invoke(input_docs, *args, **kwargs)
+
+
+def get_relations(sql_engine, pipeline, file_id: str) -> dict[str, set[str]]:
+    """Get the chunk ids of a file in the Index table, by relation type"""
+    relations = defaultdict(set)
+    with Session(sql_engine) as session:
+        for row in session.execute(
+            select(pipeline.Index).where(pipeline.Index.source_id == file_id)
+        ):
+            relations[row[0].relation_type].add(row[0].target_id)
+    return relations
+
+
+def get_note(sql_engine, pipeline, file_id: str) -> dict:
+    with Session(sql_engine) as session:
+        source = session.execute(
+            select(pipeline.Source).where(pipeline.Source.id == file_id)
+        ).first()[0]
+        return dict(source.note)
+
+
+def test_index_config_follows_splitter_and_embedding(make_index_pipeline):
+    config = make_index_pipeline().get_index_config()
+    assert make_index_pipeline().get_index_config() == config
+
+    splitter = make_index_pipeline().splitter
+    splitter.chunk_size = 32
+    assert make_index_pipeline(splitter=splitter).get_index_config() != config
+
+    embedding = LengthEmbeddings(dimension=3)
+    assert make_index_pipeline(embedding=embedding).get_index_config() != config
+
+
+def test_index_config_ignores_credentials(make_index_pipeline):
+    config = make_index_pipeline().get_index_config()
+    embedding = LengthEmbeddings(api_key="another-key")
+    assert make_index_pipeline(embedding=embedding).get_index_config() == config
+
+
+def test_is_unchanged(make_index_pipeline, tmp_path):
+    file_path = write_file(tmp_path / "doc.txt", LINES)
+    pipeline = make_index_pipeline(incremental=True)
+    run_stream(pipeline.stream(file_path, reindex=False))
+    file_id = pipeline.get_id_if_exists(file_path)
+    file_hash = pipeline.get_file_hash(file_path)
+    assert pipeline.is_unchanged(file_id, file_path, file_hash)
+
+    # the same content indexed with another splitter
+    splitter = pipeline.splitter
+    splitter.chunk_size = 32
+    other_pipeline = make_index_pipeline(splitter=splitter)
+    assert not other_pipeline.is_unchanged(file_id, file_path, file_hash)
+
+    # another content indexed with the same pipeline
+    write_file(file_path, LINES[:-1])
+    file_hash = pipeline.get_file_hash(file_path)
+    assert not pipeline.is_unchanged(file_id, file_path, file_hash)
+    assert not pipeline.is_unchanged("missing", file_path, file_hash)
+
+
+def test_unchanged_file_is_skipped(make_index_pipeline, tmp_path):
+    file_path = write_file(tmp_path / "doc.txt", LINES)
+    pipeline = make_index_pipeline(incremental=True)
+    _, (file_id, docs) = run_stream(pipeline.stream(file_path, reindex=False))
+    assert docs
+
+    messages, (same_file_id, docs) = run_stream(
+        pipeline.stream(file_path, reindex=True)
+    )
+    assert same_file_id == file_id
+    assert docs == []
+    assert "Skipping unchanged doc.txt" in messages[-1].text
+
+
+class FailingEmbeddings(LengthEmbeddings):
+    def invoke(self, text, *args, **kwargs):
+        raise RuntimeError("the embedding service is down")
+
+
+def test_staged_indexing_matches_sequential(make_index_pipeline, sql_engine, tmp_path):
+    indexed = {}
+    for staged in (False, True):
+        file_path = write_file(tmp_path / f"staged-{staged}.txt", LINES)
+        pipeline = make_index_pipeline(staged=staged, chunk_batch_size=2)
+        messages, (file_id, _) = run_stream(pipeline.stream(file_path, reindex=False))
+
+        relations = get_relations(sql_engine, pipeline, file_id)
+        assert relations["vector"] == relations["document"]
+        assert [msg.text for msg in messages if "Processed" in msg.text]
+        indexed[staged] = (
+            sorted(doc.text for doc in pipeline.DS.get(list(relations["document"]))),
+            get_note(sql_engine, pipeline, file_id)["tokens"],
+        )
+
+    assert len(indexed[True][0]) > 2
+    assert indexed[True] == indexed[False]
+
+
+def test_staged_indexing_stops_on_errors(make_index_pipeline, sql_engine, tmp_path):
+    file_path = write_file(tmp_path / "doc.txt", LINES)
+    pipeline = make_index_pipeline(
+        staged=True,
+        chunk_batch_size=1,
+        stage_queue_size=1,
+        embedding=FailingEmbeddings(),
+    )
+
+    # the failed stage doesn't leave the other stages blocked on a full queue
+    with pytest.raises(RuntimeError, match="the embedding service is down"):
+        run_stream(pipeline.stream(file_path, reindex=False))
+
+    file_id = pipeline.get_id_if_exists(file_path)
+    assert get_relations(sql_engine, pipeline, file_id)["vector"] == set()
+
+
+def test_assign_chunk_ids_is_stable(make_index_pipeline):
+    pipeline = make_index_pipeline()
+    chunks = [Document(text) for text in ["first", "second", "first", "second  "]]
+    pipeline.assign_chunk_ids(chunks, "file", {})
+    ids = [chunk.doc_id for chunk in chunks]
+
+    # identical chunks are told apart by their order, whitespace doesn't matter
+    assert len(set(ids)) == 4
+    same_chunks = [Document(text) for text in ["first", "second", "first", "second"]]
+    pipeline.assign_chunk_ids(same_chunks, "file", {})
+    assert [chunk.doc_id for chunk in same_chunks] == ids
+
+    other_chunks = [Document("first")]
+    pipeline.assign_chunk_ids(other_chunks, "other file", {})
+    assert other_chunks[0].doc_id not in ids
+
+
+def test_get_reusable_chunk_ids(make_index_pipeline, sql_engine, tmp_path):
+    file_path = write_file(tmp_path / "doc.txt", LINES)
+    pipeline = make_index_pipeline(incremental=True)
+    _, (file_id, _) = run_stream(pipeline.stream(file_path, reindex=False))
+
+    chunk_ids = get_relations(sql_engine, pipeline, file_id)["document"]
+    assert chunk_ids
+    assert pipeline.get_reusable_chunk_ids(file_id) == chunk_ids
+    assert pipeline.get_reusable_chunk_ids("missing") is None
+
+    # the chunks of another splitter can't be reused
+    splitter = pipeline.splitter
+    splitter.chunk_size = 32
+    other_pipeline = make_index_pipeline(incremental=True, splitter=splitter)
+    assert other_pipeline.get_reusable_chunk_ids(file_id) is None
+
+
+@pytest.mark.parametrize("staged", [False, True])
+def test_reindex_keeps_unchanged_chunks(
+    make_index_pipeline, sql_engine, tmp_path, staged
+):
+    file_path = write_file(tmp_path / "doc.txt", LINES)
+    pipeline = make_index_pipeline(incremental=True, staged=staged)
+    _, (file_id, _) = run_stream(pipeline.stream(file_path, reindex=False))
+    old_ids = get_relations(sql_engine, pipeline, file_id)["document"]
+
+    edited_lines = LINES[:2] + ["An edited line, about another topic."] + LINES[3:]
+    write_file(file_path, edited_lines)
+    embedded_texts.clear()
+    messages, (same_file_id, _) = run_stream(pipeline.stream(file_path, reindex=True))
+
+    assert same_file_id == file_id
+    relations = get_relations(sql_engine, pipeline, file_id)
+    new_ids = relations["document"]
+    kept, removed, added = old_ids & new_ids, old_ids - new_ids, new_ids - old_ids
+    assert kept and removed and added
+    assert relations["vector"] == new_ids
+
+    # only the chunks of the edited line are replaced and embedded
+    added_texts = [doc.text for doc in pipeline.DS.get(list(added))]
+    assert all("edited line" in text for text in added_texts)
+    assert sorted(embedded_texts) == sorted(added_texts)
+    assert {doc.doc_id for doc in pipeline.DS.get_all()} == new_ids
+    assert set(pipeline.VS.get_embeddings(list(old_ids))[0]) == kept
+    assert any(
+        f"Kept {len(kept)} unchanged chunks, removed {len(removed)} chunks" in msg.text
+        for msg in messages
+    )
+
+    # the stored file is replaced
+    with Session(sql_engine) as session:
+        source = session.execute(
+            select(pipeline.Source).where(pipeline.Source.id == file_id)
+        ).first()[0]
+    assert source.path == pipeline.get_file_hash(file_path)
+    assert (pipeline.FSPath / source.path).read_text() == "\n".join(edited_lines)
+
+
+def test_relation_writer(file_index_resources, sql_engine):
+    Index = file_index_resources["Index"]
+    pipeline = SimpleNamespace(Index=Index)
+
+    writer = RelationWriter(Index, "file")
+    writer.add(["a", "b"], "document")
+    assert get_relations(sql_engine, pipeline, "file")["document"] == {"a", "b"}
+
+    deferred_writer = RelationWriter(Index, "deferred file", defer=True)
+    threads = [
+        threading.Thread(
+            target=deferred_writer.add, args=([f"{idx}-a", f"{idx}-b"], "vector")
+        )
+        for idx in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert get_relations(sql_engine, pipeline, "deferred file") == {}
+
+    deferred_writer.flush()
+    assert get_relations(sql_engine, pipeline, "deferred file")["vector"] == {
+        f"{idx}-{chunk}" for idx in range(4) for chunk in "ab"
+    }
+
+    # the relations are only written once
+    deferred_writer.flush()
+    with Session(sql_engine) as session:
+        rows = session.execute(
+            select(Index).where(Index.source_id == "deferred file")
+        ).all()
+    assert len(rows) == 8
+
+
+def test_deferred_relations_match(make_index_pipeline, sql_engine, tmp_path):
+    relations = []
+    for defer in (False, True):
+        file_path = write_file(tmp_path / f"defer-{defer}.txt", LINES)
+        pipeline = make_index_pipeline(defer_relation_writes=defer, chunk_batch_size=2)
+        _, (file_id, _) = run_stream(pipeline.stream(file_path, reindex=False))
+        file_relations = get_relations(sql_engine, pipeline, file_id)
+        relations.append({key: len(ids) for key, ids in file_relations.items()})
+        assert file_relations["vector"] == file_relations["document"]
+
+    assert relations[0]["document"] > 2
+    assert relations[1] == relations[0]
+
+
+def test_count_tokens(make_index_pipeline):
+    pipeline = make_index_pipeline()
+    token_func = pipeline.get_token_func()
+    chunks = [
+        Document("A chunk to tokenize."),
+        Document("A chunk counted by the splitter.", metadata={"n_tokens": 100}),
+    ]
+
+    assert pipeline.count_tokens(chunks) == len(token_func(chunks[0].text)) + 100
+    assert chunks[0].metadata["n_tokens"] == len(token_func(chunks[0].text))
+    assert chunks[1].metadata["n_tokens"] == 100
+
+
+@pytest.mark.parametrize("staged", [False, True])
+def test_file_tokens_sum_the_chunks(make_index_pipeline, sql_engine, tmp_path, staged):
+    file_path = write_file(tmp_path / "doc.txt", LINES)
+    pipeline = make_index_pipeline(incremental=True, staged=staged)
+
+    def count_file_tokens(file_id):
+        chunk_ids = get_relations(sql_engine, pipeline, file_id)["document"]
+        chunks = pipeline.DS.get(list(chunk_ids))
+        assert all(chunk.metadata["n_tokens"] > 0 for chunk in chunks)
+        return sum(chunk.metadata["n_tokens"] for chunk in chunks)
+
+    _, (file_id, _) = run_stream(pipeline.stream(file_path, reindex=False))
+    n_tokens = get_note(sql_engine, pipeline, file_id)["tokens"]
+    assert n_tokens == count_file_tokens(file_id) > 0
+
+    # the kept chunks still count after an incremental reindex
+    write_file(file_path, LINES + ["One more line."])
+    run_stream(pipeline.stream(file_path, reindex=True))
+    new_n_tokens = get_note(sql_engine, pipeline, file_id)["tokens"]
+    assert new_n_tokens == count_file_tokens(file_id) > n_tokens
+
+
+def test_thumbnails_are_not_embedded(make_index_pipeline, sql_engine, tmp_path):
+    file_path = write_file(tmp_path / "doc.txt", LINES[:2])
+    pipeline = make_index_pipeline(loader=PageReader(), embed_images=True)
+    _, (file_id, _) = run_stream(pipeline.stream(file_path, reindex=False))
+
+    relations = get_relations(sql_engine, pipeline, file_id)
+    docs = pipeline.DS.get(list(relations["document"]))
+    thumbnail_ids = {
+        doc.doc_id for doc in docs if doc.metadata.get("type") == "thumbnail"
+    }
+    assert len(thumbnail_ids) == 1
+    # the thumbnails are only kept in the doc store, for the citations
+    assert relations["vector"] == relations["document"] - thumbnail_ids
+    assert "Page 1" not in embedded_texts
+
+
+def test_thumbnails_embedded_as_images(
+    make_index_pipeline, sql_engine, tmp_path, blob_store
+):
+    file_path = write_file(tmp_path / "doc.txt", LINES[:2])
+    embedding = ImageEmbeddings(embedded_images=[])
+    pipeline = make_index_pipeline(
+        loader=PageReader(), embed_images=True, embedding=embedding
+    )
+    _, (file_id, _) = run_stream(pipeline.stream(file_path, reindex=False))
+
+    relations = get_relations(sql_engine, pipeline, file_id)
+    assert relations["vector"] == relations["document"]
+    (thumbnail,) = [
+        doc
+        for doc in pipeline.DS.get(list(relations["document"]))
+        if doc.metadata.get("type") == "thumbnail"
+    ]
+    blob_url = thumbnail.metadata["image_origin"]
+    assert blob_url.startswith("kh-blob://")
+    # the embedding model reads the image, while the stores only keep its URL
+    assert (blob_url, THUMBNAIL) in embedding.embedded_images
+
+
+def test_embed_pending_chunks_skips_thumbnails(
+    make_index_pipeline, sql_engine, tmp_path
+):
+    file_path = write_file(tmp_path / "doc.txt", LINES[:2])
+    pipeline = make_index_pipeline(loader=PageReader(), chunk_batch_size=1)
+    _, (file_id, _) = run_stream(pipeline.stream(file_path, reindex=False))
+    vs_ids = get_relations(sql_engine, pipeline, file_id)["vector"]
+
+    # nothing is left to embed, though the thumbnail has no vector
+    assert list(pipeline.embed_pending_chunks(file_id)) == [(len(vs_ids), len(vs_ids))]
+
+    # the embedding was interrupted before any chunk was in the vector store
+    with Session(sql_engine) as session:
+        session.execute(
+            delete(pipeline.Index).where(pipeline.Index.relation_type == "vector")
+        )
+        session.commit()
+    embedded_texts.clear()
+    progress = list(pipeline.embed_pending_chunks(file_id))
+    assert progress[0] == (0, len(vs_ids))
+    assert progress[-1] == (len(vs_ids), len(vs_ids))
+    assert len(embedded_texts) == len(vs_ids)
+    assert get_relations(sql_engine, pipeline, file_id)["vector"] == vs_ids
@@ -0,0 +1,152 @@
+import datetime
+import time
+from types import SimpleNamespace
+
+import pytest
+from ktem.db.models import IndexingJob
+from ktem.index.file.jobs import IndexingJobQueue, get_job, list_jobs
+from sqlalchemy.orm import Session
+
+SOURCE = SimpleNamespace(__tablename__="index__1__source")
+
+
+class StubPipeline:
+    """Embed the chunks of a file in 2 batches, recording the embedded files"""
+
+    Source = SOURCE
+    user_id = "default"
+
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.embedded: list[str] = []
+
+    def embed_pending_chunks(self, file_id):
+        yield 0, 4
+        if self.fail:
+            raise ValueError("embedding failed")
+        yield 2, 4
+        self.embedded.append(file_id)
+        yield 4, 4
+
+    def is_url(self, file_path):
+        return False
+
+    def route(self, file_path):
+        return self
+
+
+class StubIndex:
+    _resources = {"Source": SOURCE}
+
+    def __init__(self, pipeline):
+        self.id = 1
+        self.pipeline = pipeline
+
+    def get_indexing_pipeline(self, settings, user_id):
+        return self.pipeline
+
+
+def add_job(engine, file_id: str, **values) -> str:
+    job = IndexingJob(
+        source_table=SOURCE.__tablename__,
+        file_id=file_id,
+        file_name=f"{file_id}.txt",
+        **values,
+    )
+    with Session(engine) as session:
+        session.add(job)
+        session.commit()
+        return job.id
+
+
+def wait_for(condition, timeout: float = 5):
+    start = time.time()
+    while not condition():
+        if time.time() - start > timeout:
+            raise TimeoutError
+        time.sleep(0.01)
+
+
+@pytest.fixture(scope="function")
+def job_queue(sql_engine):
+    queue = IndexingJobQueue(n_workers=2, heartbeat=0.2)
+    yield queue
+    queue._executor.shutdown(wait=True)
+
+
+def test_submit(job_queue):
+    pipeline = StubPipeline()
+    job_id = job_queue.submit(pipeline, "file1", "file1.txt")
+    wait_for(lambda: get_job(job_id)["status"] == "completed")
+
+    job = get_job(job_id)
+    assert (job["n_done"], job["n_total"], job["n_attempts"]) == (4, 4, 1)
+    assert pipeline.embedded == ["file1"]
+
+
+def test_failed_job(job_queue):
+    job_id = job_queue.submit(StubPipeline(fail=True), "file1", "file1.txt")
+    wait_for(lambda: get_job(job_id)["status"] == "failed")
+    assert get_job(job_id)["error"] == "embedding failed"
+
+
+def test_job_is_claimed_once(sql_engine, job_queue):
+    job_id = add_job(sql_engine, "file1")
+    assert job_queue._claim(job_id, 0)
+    assert not job_queue._claim(job_id, 0), "The job is already claimed"
+    assert get_job(job_id)["status"] == "running"
+
+
+def test_resume_in_several_processes(sql_engine, job_queue):
+    job_ids = [add_job(sql_engine, f"file{idx}") for idx in range(4)]
+    add_job(sql_engine, "done", status="completed")
+
+    # every process resumes the unfinished jobs when it starts
+    pipeline = StubPipeline()
+    other_queue = IndexingJobQueue(n_workers=2, heartbeat=0.2)
+    assert sorted(job_queue.resume(StubIndex(pipeline))) == sorted(job_ids)
+    assert sorted(other_queue.resume(StubIndex(pipeline))) == sorted(job_ids)
+    other_queue._executor.shutdown(wait=True)
+    job_queue._executor.shutdown(wait=True)
+
+    assert sorted(pipeline.embedded) == [f"file{idx}" for idx in range(4)]
+    assert all(get_job(job_id)["n_attempts"] == 1 for job_id in job_ids)
+
+
+def test_resume_stopped_running_job(sql_engine, job_queue):
+    now = datetime.datetime.now()
+    stopped_job_id = add_job(
+        sql_engine,
+        "stopped",
+        status="running",
+        n_attempts=1,
+        date_updated=now - datetime.timedelta(hours=1),
+    )
+    running_job_id = add_job(
+        sql_engine, "running", status="running", n_attempts=1, date_updated=now
+    )
+
+    pipeline = StubPipeline()
+    job_queue.resume(StubIndex(pipeline))
+    wait_for(lambda: get_job(stopped_job_id)["status"] == "completed")
+    assert pipeline.embedded == ["stopped"]
+    assert get_job(running_job_id)["status"] == "running"
+
+    # the job is resumed once it misses its heartbeats
+    wait_for(lambda: get_job(running_job_id)["status"] == "completed")
+    assert pipeline.embedded == ["stopped", "running"]
+    assert get_job(running_job_id)["n_attempts"] == 2
+
+
+def test_list_jobs(sql_engine):
+    add_job(sql_engine, "file1", status="completed")
+    add_job(sql_engine, "file2", status="failed")
+    add_job(sql_engine, "file3")
+
+    assert len(list_jobs(source_table=SOURCE.__tablename__)) == 3
+    assert list_jobs(source_table="index__2__source") == []
+    assert [job["file_id"] for job in list_jobs(status="failed")] == ["file2"]
+    assert sorted(job["file_id"] for job in list_jobs(file_ids=["file1", "file3"])) == [
+        "file1",
+        "file3",
+    ]
@@ -0,0 +1,135 @@
+import gc
+import threading
+import time
+
+import pytest
+from ktem.index.file import document_indexing_pipeline
+from ktem.index.file.document_indexing_pipeline import IndexDocumentPipeline
+
+from kotaemon.base import Document
+from kotaemon.storages import InMemoryVectorStore
+
+from .conftest import LengthEmbeddings, run_stream
+
+
+class StubFilePipeline:
+    """Index a file after a delay, recording how many files are indexed at once
+
+    Args:
+        delays: the delay of each file, by name
+    """
+
+    def __init__(self, delays: dict[str, float]):
+        self.delays = delays
+        self.n_running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def stream(self, file_path, reindex=False, **kwargs):
+        with self.lock:
+            self.n_running += 1
+            self.max_running = max(self.max_running, self.n_running)
+        try:
+            time.sleep(self.delays.get(file_path.name, 0.1))
+            if file_path.name.startswith("bad"):
+                raise ValueError(f"cannot read {file_path.name}")
+            yield Document(f"indexed {file_path.name}", channel="debug")
+        finally:
+            with self.lock:
+                self.n_running -= 1
+        return f"id-{file_path.name}", [Document(file_path.name)]
+
+
+@pytest.fixture(scope="function")
+def stub_file_pipeline(monkeypatch):
+    stub = StubFilePipeline({})
+    monkeypatch.setattr(IndexDocumentPipeline, "route", lambda self, file_path: stub)
+    return stub
+
+
+def make_files(tmp_path, names, size=16):
+    file_paths = []
+    for name in names:
+        file_path = tmp_path / name
+        file_path.write_bytes(b"x" * size)
+        file_paths.append(file_path)
+    return file_paths
+
+
+def test_stream_parallel_keeps_the_order(stub_file_pipeline, tmp_path):
+    names = ["a.txt", "bad.txt", "c.txt", "d.txt"]
+    # the last files are indexed first
+    stub_file_pipeline.delays.update(
+        {name: 0.05 * (len(names) - idx) for idx, name in enumerate(names)}
+    )
+    file_paths = make_files(tmp_path, names)
+    pipeline = IndexDocumentPipeline(embedding=LengthEmbeddings(), indexing_workers=4)
+
+    messages, (file_ids, errors, docs) = run_stream(pipeline.stream(file_paths))
+
+    assert stub_file_pipeline.max_running > 1
+    assert file_ids == ["id-a.txt", None, "id-c.txt", "id-d.txt"]
+    assert errors == [None, "cannot read bad.txt", None, None]
+    assert [doc.text for doc in docs] == ["a.txt", "c.txt", "d.txt"]
+    assert [msg.text for msg in messages if msg.channel == "debug"] == [
+        "Indexing [1/4]: a.txt",
+        "indexed a.txt",
+        "Indexing [2/4]: bad.txt",
+        "Indexing [3/4]: c.txt",
+        "indexed c.txt",
+        "Indexing [4/4]: d.txt",
+        "indexed d.txt",
+    ]
+    assert [
+        (msg.content["file_name"], msg.content["status"])
+        for msg in messages
+        if msg.channel == "index"
+    ] == [
+        ("a.txt", "success"),
+        ("bad.txt", "failed"),
+        ("c.txt", "success"),
+        ("d.txt", "success"),
+    ]
+
+
+def test_stream_parallel_bounds_the_workers(stub_file_pipeline, tmp_path):
+    file_paths = make_files(tmp_path, [f"{idx}.txt" for idx in range(6)])
+    pipeline = IndexDocumentPipeline(embedding=LengthEmbeddings(), indexing_workers=2)
+
+    _, (file_ids, _, _) = run_stream(pipeline.stream(file_paths))
+
+    assert file_ids == [f"id-{idx}.txt" for idx in range(6)]
+    assert stub_file_pipeline.max_running == 2
+
+
+def test_stream_parallel_memory_limit(stub_file_pipeline, tmp_path):
+    # each file takes more than half of the limit, so they are indexed one by one
+    file_paths = make_files(tmp_path, ["a.txt", "b.txt", "c.txt"], size=600 * 1024)
+    pipeline = IndexDocumentPipeline(
+        embedding=LengthEmbeddings(), indexing_workers=3, indexing_memory_limit=1
+    )
+
+    _, (file_ids, _, _) = run_stream(pipeline.stream(file_paths))
+
+    assert file_ids == ["id-a.txt", "id-b.txt", "id-c.txt"]
+    assert stub_file_pipeline.max_running == 1
+
+    # a file larger than the limit is still indexed
+    file_paths = make_files(tmp_path, ["big.txt"], size=2 * 1024 * 1024) + file_paths
+    _, (file_ids, _, _) = run_stream(pipeline.stream(file_paths))
+    assert file_ids == ["id-big.txt", "id-a.txt", "id-b.txt", "id-c.txt"]
+    assert stub_file_pipeline.max_running == 1
+
+
+def test_store_locks_follow_the_stores():
+    store, other_store = InMemoryVectorStore(), InMemoryVectorStore()
+    lock = document_indexing_pipeline._get_store_lock(store)
+    assert document_indexing_pipeline._get_store_lock(store) is lock
+    assert document_indexing_pipeline._get_store_lock(other_store) is not lock
+
+    # the lock is dropped with its store
+    gc.collect()
+    n_locks = len(document_indexing_pipeline._store_locks)
+    del store
+    gc.collect()
+    assert len(document_indexing_pipeline._store_locks) == n_locks - 1
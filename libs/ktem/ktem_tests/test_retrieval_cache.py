@@ -0,0 +1,266 @@
+import time
+
+import pytest
+from ktem.index.file import document_retrieval_pipeline
+from ktem.index.file.document_retrieval_pipeline import DocumentRetrievalPipeline
+from ktem.index.file.retrieval_cache import (
+    FileScopeResolver,
+    RetrievalCache,
+    bump_index_version,
+    get_index_version,
+)
+from sqlalchemy.orm import Session
+
+from kotaemon.base import RetrievedDocument
+from kotaemon.indices import VectorRetrieval
+
+from .conftest import LengthEmbeddings
+
+
+@pytest.fixture(scope="function")
+def make_retrieval_pipeline(file_index_resources, monkeypatch):
+    """Create a `DocumentRetrievalPipeline` with its own retrieval cache"""
+    monkeypatch.setattr(
+        document_retrieval_pipeline, "retrieval_cache", RetrievalCache()
+    )
+
+    def make(**kwargs) -> DocumentRetrievalPipeline:
+        params = dict(
+            Source=file_index_resources["Source"],
+            Index=file_index_resources["Index"],
+            VS=file_index_resources["VectorStore"],
+            DS=file_index_resources["DocStore"],
+            FSPath=file_index_resources["FileStoragePath"],
+            user_id="default",
+            embedding=LengthEmbeddings(),
+            llm_scorer=None,
+        )
+        params.update(kwargs)
+        return DocumentRetrievalPipeline(**params)
+
+    return make
+
+
+def test_bump_index_version(sql_engine):
+    assert get_index_version("index__1__source") == 0
+
+    bump_index_version("index__1__source")
+    bump_index_version("index__1__source")
+    bump_index_version("index__2__source")
+    assert get_index_version("index__1__source") == 2
+    assert get_index_version("index__2__source") == 1
+
+
+def test_retrieval_cache_lru():
+    cache = RetrievalCache(max_entries=2, ttl=0)
+    cache.set("a", [RetrievedDocument(text="a")])
+    cache.set("b", [RetrievedDocument(text="b")])
+    assert cache.get("a")[0].text == "a"
+    cache.set("c", [RetrievedDocument(text="c")])
+
+    assert cache.get("b") is None, "The least recently used result is evicted"
+    assert cache.get("c")[0].text == "c"
+    assert cache.stats() == {"size": 2, "hits": 2, "misses": 1}
+
+    # the cached result can't be modified through the returned documents
+    cache.get("c")[0].text = "modified"
+    assert cache.get("c")[0].text == "c"
+
+
+def test_retrieval_cache_ttl(monkeypatch):
+    cache = RetrievalCache(ttl=10)
+    cache.set("a", [RetrievedDocument(text="a")])
+    assert cache.get("a") is not None
+
+    now = time.time()
+    monkeypatch.setattr("time.time", lambda: now + 10)
+    assert cache.get("a") is None
+
+
+def test_cache_key(make_retrieval_pipeline):
+    pipeline = make_retrieval_pipeline()
+    key = pipeline.get_cache_key("query", ["file1", "file2"])
+
+    assert pipeline.get_cache_key("query", ["file2", "file1", "file1"]) == key
+    assert pipeline.get_cache_key("other query", ["file1", "file2"]) != key
+    assert pipeline.get_cache_key("query", ["file1"]) != key
+    other_pipelines = [
+        make_retrieval_pipeline(top_k=10),
+        make_retrieval_pipeline(embedding=LengthEmbeddings(dimension=3)),
+    ]
+    for other_pipeline in other_pipelines:
+        assert other_pipeline.get_cache_key("query", ["file1", "file2"]) != key
+
+    bump_index_version(pipeline.Source.__tablename__)
+    assert pipeline.get_cache_key("query", ["file1", "file2"]) != key
+
+
+def test_cache_invalidation(make_retrieval_pipeline, monkeypatch):
+    retrieved = []
+
+    def retrieve(self, text, doc_ids):
+        retrieved.append(text)
+        return [RetrievedDocument(text=f"result {len(retrieved)}")]
+
+    monkeypatch.setattr(DocumentRetrievalPipeline, "retrieve", retrieve)
+    pipeline = make_retrieval_pipeline()
+
+    assert pipeline.run("query", ["file1"])[0].text == "result 1"
+    assert pipeline.run("query", ["file1"])[0].text == "result 1"
+    assert retrieved == ["query"], "The same retrieval is cached"
+
+    bump_index_version(pipeline.Source.__tablename__)
+    assert pipeline.run("query", ["file1"])[0].text == "result 2"
+    assert retrieved == ["query", "query"], "A change to the index is retrieved"
+
+    uncached_pipeline = make_retrieval_pipeline(use_cache=False)
+    assert uncached_pipeline.run("query", ["file1"])[0].text == "result 3"
+
+
+def add_rows(sql_engine, rows):
+    with Session(sql_engine) as session:
+        session.add_all(rows)
+        session.commit()
+
+
+def add_chunks(sql_engine, Index, file_id, chunk_ids, relation_type="document"):
+    add_rows(
+        sql_engine,
+        [
+            Index(source_id=file_id, target_id=chunk_id, relation_type=relation_type)
+            for chunk_id in chunk_ids
+        ],
+    )
+
+
+def test_file_scope_resolver_chunk_ids(file_index_resources, sql_engine):
+    Source, Index = file_index_resources["Source"], file_index_resources["Index"]
+    add_chunks(sql_engine, Index, "a", ["a1", "a2"])
+    add_chunks(sql_engine, Index, "a", ["a1"], relation_type="vector")
+    add_chunks(sql_engine, Index, "b", ["b1"])
+    resolver = FileScopeResolver()
+
+    assert resolver.get_chunk_ids(Source, Index, ["b", "a", "b", "empty"]) == [
+        "b1",
+        "a1",
+        "a2",
+    ]
+
+    # the chunk ids are kept until the index changes
+    add_chunks(sql_engine, Index, "a", ["a3"])
+    add_chunks(sql_engine, Index, "empty", ["empty1"])
+    assert resolver.get_chunk_ids(Source, Index, ["a", "empty"]) == ["a1", "a2"]
+
+    bump_index_version(Source.__tablename__)
+    assert resolver.get_chunk_ids(Source, Index, ["a", "empty"]) == [
+        "a1",
+        "a2",
+        "a3",
+        "empty1",
+    ]
+
+
+def test_file_scope_resolver_evicts_files(file_index_resources, sql_engine):
+    Source, Index = file_index_resources["Source"], file_index_resources["Index"]
+    add_chunks(sql_engine, Index, "a", ["a1"])
+    add_chunks(sql_engine, Index, "b", ["b1"])
+    resolver = FileScopeResolver(max_files=1)
+
+    assert resolver.get_chunk_ids(Source, Index, ["a"]) == ["a1"]
+    assert resolver.get_chunk_ids(Source, Index, ["b"]) == ["b1"]
+
+    # the least recently used file is looked up again
+    add_chunks(sql_engine, Index, "a", ["a2"])
+    add_chunks(sql_engine, Index, "b", ["b2"])
+    assert resolver.get_chunk_ids(Source, Index, ["a"]) == ["a1", "a2"]
+    assert resolver.get_chunk_ids(Source, Index, ["b"]) == ["b1", "b2"]
+
+
+def test_file_scope_resolver_all_files(file_index_resources, sql_engine):
+    Source = file_index_resources["Source"]
+    add_rows(sql_engine, [Source(id="a", name="a.txt"), Source(id="b", name="b.txt")])
+    resolver = FileScopeResolver()
+
+    assert resolver.is_all_files(Source, ["b", "a"])
+    assert resolver.is_all_files(Source, ["a", "b", "deleted"])
+    assert not resolver.is_all_files(Source, ["a"])
+
+    # the files are kept until the index changes
+    add_rows(sql_engine, [Source(id="c", name="c.txt")])
+    assert resolver.is_all_files(Source, ["a", "b"])
+
+    bump_index_version(Source.__tablename__)
+    assert not resolver.is_all_files(Source, ["a", "b"])
+    assert resolver.is_all_files(Source, ["a", "b", "c"])
+
+
+def test_file_scope_resolver_user_files(file_index_resources, sql_engine):
+    Source = file_index_resources["Source"]
+    add_rows(
+        sql_engine,
+        [
+            Source(id="a", name="a.txt", user="user1"),
+            Source(id="b", name="b.txt", user="user2"),
+        ],
+    )
+    resolver = FileScopeResolver()
+
+    # the files of the other users are not selectable in a private index
+    assert resolver.is_all_files(Source, ["a"], "user1")
+    assert not resolver.is_all_files(Source, ["a"], "user2")
+    assert not resolver.is_all_files(Source, ["a"])
+    assert resolver.is_all_files(Source, ["a", "b"])
+
+    bump_index_version(Source.__tablename__)
+    add_rows(sql_engine, [Source(id="c", name="c.txt", user="user1")])
+    assert not resolver.is_all_files(Source, ["a"], "user1")
+
+
+@pytest.fixture(scope="function")
+def retrieval_kwargs(monkeypatch):
+    """Record the keyword arguments of the vector retrievals"""
+    calls = []
+
+    def run(self, text, top_k=None, **kwargs):
+        calls.append(kwargs)
+        return []
+
+    monkeypatch.setattr(VectorRetrieval, "run", run)
+    return calls
+
+
+def test_retrieve_scope(
+    make_retrieval_pipeline,
+    file_index_resources,
+    sql_engine,
+    retrieval_kwargs,
+    monkeypatch,
+):
+    Source, Index = file_index_resources["Source"], file_index_resources["Index"]
+    add_rows(
+        sql_engine,
+        [
+            Source(id="a", name="a.txt", user="default"),
+            Source(id="b", name="b.txt", user="other"),
+        ],
+    )
+    add_chunks(sql_engine, Index, "a", ["a1", "a2"])
+
+    # all the files of the user are selected
+    make_retrieval_pipeline(private=True).retrieve("query", ["a"])
+    assert retrieval_kwargs[-1]["search_all"]
+    assert "scope" not in retrieval_kwargs[-1]
+
+    # the vector store can't filter by file, so it is scoped by the chunk ids
+    make_retrieval_pipeline().retrieve("query", ["a"])
+    assert retrieval_kwargs[-1]["scope"] == ["a1", "a2"]
+    assert "vector_scope" not in retrieval_kwargs[-1]
+    assert "search_all" not in retrieval_kwargs[-1]
+
+    monkeypatch.setattr(
+        type(file_index_resources["VectorStore"]), "supports_filters", True
+    )
+    make_retrieval_pipeline().retrieve("query", ["a"])
+    assert retrieval_kwargs[-1]["scope"] == ["a1", "a2"]
+    assert retrieval_kwargs[-1]["vector_scope"] is None
+    assert retrieval_kwargs[-1]["filters"].filters[0].value == ["a"]
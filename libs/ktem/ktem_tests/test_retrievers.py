@@ -0,0 +1,64 @@
+import time
+
+from ktem.reasoning.simple import FullQAPipeline
+
+from kotaemon.base import BaseComponent, RetrievedDocument
+
+
+class SleepyRetriever(BaseComponent):
+    """Retrieve a single document labelled by the retriever, after a delay"""
+
+    label: str
+    delay: float = 0.0
+
+    def run(self, text: str) -> list[RetrievedDocument]:
+        time.sleep(self.delay)
+        return [RetrievedDocument(text=f"{self.label}: {text}", id_=self.label)]
+
+
+def retrieved_texts(results):
+    return [[doc.text for doc in docs] for docs in results]
+
+
+def test_run_retrievers_keeps_the_order():
+    pipeline = FullQAPipeline(
+        retrievers=[
+            SleepyRetriever(label="slow", delay=0.2),
+            SleepyRetriever(label="fast"),
+            SleepyRetriever(label="medium", delay=0.1),
+        ],
+        retriever_timeout=5,
+    )
+
+    start = time.monotonic()
+    results = pipeline.run_retrievers("query")
+
+    # the retrievers run concurrently
+    assert time.monotonic() - start < 0.3
+    assert retrieved_texts(results) == [
+        ["slow: query"],
+        ["fast: query"],
+        ["medium: query"],
+    ]
+
+
+def test_run_retrievers_drops_the_slow_ones():
+    pipeline = FullQAPipeline(
+        retrievers=[
+            SleepyRetriever(label="fast"),
+            SleepyRetriever(label="slow", delay=2),
+            SleepyRetriever(label="medium", delay=0.1),
+        ],
+        retriever_timeout=0.5,
+    )
+
+    start = time.monotonic()
+    results = pipeline.run_retrievers("query")
+
+    # the timeout covers the whole batch, not each retriever in turn
+    assert time.monotonic() - start < 1
+    assert retrieved_texts(results) == [["fast: query"], [], ["medium: query"]]
+
+
+def test_run_retrievers_without_retrievers():
+    assert FullQAPipeline(retrievers=[]).run_retrievers("query") == []
@@ -25,6 +25,11 @@ KEYCLOAK_REALM = config("KEYCLOAK_REALM", default="")
 KEYCLOAK_CLIENT_ID = config("KEYCLOAK_CLIENT_ID", default="")
 KEYCLOAK_CLIENT_SECRET = config("KEYCLOAK_CLIENT_SECRET", default="")
 
+from kotaemon.loaders.pdf_loader import start_thumbnail_pool  # noqa
+
+# fork the thumbnail rendering workers, if any, before the app starts threads
+start_thumbnail_pool()
+
 from ktem.main import App  # noqa
 
 gradio_app = App()
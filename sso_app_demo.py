@@ -43,6 +43,11 @@ def add_session_middleware(app):
     return oauth
 
 
+from kotaemon.loaders.pdf_loader import start_thumbnail_pool  # noqa
+
+# fork the thumbnail rendering workers, if any, before the app starts threads
+start_thumbnail_pool()
+
 from ktem.main import App  # noqa
 
 gradio_app = App()